@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import server
+
+def main():
+    parser = argparse.ArgumentParser(description='Task bundle benchmark')
+    parser.add_argument('--files', type=str, default='16,256,2048', help='comma separated numbers of files per task')
+    parser.add_argument('--size', type=str, default='1K', help='file size')
+    parser.add_argument('--workers', type=int, default=8, help='number of transfer workers')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated server latency per request (in seconds)')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from kolejka.common import kolejka_config, KolejkaTask
+    from kolejka.common.bundle import bundle_extract
+    from kolejka.common.parse import parse_memory
+    server.user('client', 'task.add_task', 'blob.add_reference', password='client')
+    url = server.serve(latency=args.latency)
+    kolejka_config(args={ 'server': url, 'username': 'client', 'password': 'client' })
+    from kolejka.client import KolejkaClient
+    client = KolejkaClient()
+    client.config.transfer_workers = args.workers
+    size = parse_memory(args.size)
+
+    temp_dir = tempfile.mkdtemp(prefix='kolejka-benchmark-bundle-')
+    try:
+        for count in [ int(n) for n in args.files.split(',') ]:
+            for bundle in [ False, True ]:
+                task_path = os.path.join(temp_dir, 'task')
+                shutil.rmtree(task_path, ignore_errors=True)
+                os.makedirs(task_path)
+                files = dict()
+                for i in range(count):
+                    name = f'dir_{i%16}/input_{i}'
+                    os.makedirs(os.path.dirname(os.path.join(task_path, name)), exist_ok=True)
+                    with open(os.path.join(task_path, name), 'wb') as f:
+                        f.write(os.urandom(size))
+                    files[name] = name
+                task = KolejkaTask(task_path, image='ubuntu', args=['true'], files=files)
+                task.commit()
+                start = time.perf_counter()
+                task = client.task_put(KolejkaTask(task_path), bundle=bundle)
+                put_time = time.perf_counter() - start
+                start = time.perf_counter()
+                client.task_put(KolejkaTask(task_path), bundle=bundle)
+                reput_time = time.perf_counter() - start
+                get_path = os.path.join(temp_dir, 'get', task.id)
+                start = time.perf_counter()
+                task = client.task_get(task.id, get_path)
+                if task.bundle is not None:
+                    bundle_extract(os.path.join(get_path, task.bundle), os.path.join(get_path, 'unpacked'))
+                get_time = time.perf_counter() - start
+                mode = 'bundle' if bundle else 'files'
+                print(f'files: {count:5d}  mode: {mode:6s}  put: {put_time:8.3f}s  put again: {reput_time:8.3f}s  get: {get_time:8.3f}s')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kolejka.common import ControlGroupSystem
+
+def measure(function, samples):
+    function()
+    start = time.perf_counter()
+    for i in range(samples):
+        function()
+    return (time.perf_counter() - start) / samples
+
+def main():
+    parser = argparse.ArgumentParser(description='Control group statistics sampling benchmark')
+    parser.add_argument('--samples', type=int, default=10000, help='number of samples per method')
+    parser.add_argument('--pid', type=int, default=os.getpid(), help='process whose control groups are sampled')
+    args = parser.parse_args()
+
+    system = ControlGroupSystem()
+    groups = system.pid_groups(args.pid)
+    print(f'cgroup version: {system.version}  groups: {sorted(groups)}')
+    with system.groups_reader(groups) as reader:
+        print(f'open files: {sorted(reader.fds)}')
+        for name, function in [
+                ('groups_stats', lambda: system.groups_stats(groups)),
+                ('reader.stats', reader.stats),
+                ('reader.sample', reader.sample),
+                ('reader.cpu_usage', reader.cpu_usage),
+            ]:
+            cost = measure(function, args.samples)
+            print(f'method: {name:16s}  per sample: {cost*10**6:8.1f}us  max rate: {1/cost:9.0f}Hz')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import os
+import shutil
+import time
+
+import server
+
+def task_dirs(path):
+    for root, dirs, files in os.walk(path):
+        if 'kolejka_task.json' in files:
+            yield root
+
+def store_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description='Blob compression benchmark')
+    parser.add_argument('--path', type=str, default=os.path.join(server.PROJECT_DIR, 'examples'), help='folder with task trees')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated server latency per request (in seconds)')
+    parser.add_argument('--bandwidth', type=str, default='10M', help='link bandwidth used to estimate transfer time (bytes per second)')
+    args = parser.parse_args()
+
+    temp_dir = server.setup(database=server.database_from_env())
+    from django.conf import settings
+    from kolejka.common import kolejka_config, KolejkaTask
+    from kolejka.common.compression import available_encodings, encode_chunks, file_chunks
+    from kolejka.common.parse import parse_memory
+    from kolejka.server.blob.models import Blob, Reference
+    server.user('client', 'blob.add_reference', 'blob.view_blob', password='client')
+    bandwidth = parse_memory(args.bandwidth)
+
+    paths = list()
+    for task_dir in task_dirs(args.path):
+        task = KolejkaTask(task_dir)
+        paths += [ os.path.join(task_dir, f.path) for f in task.files.values() if f.path ]
+    raw_size = sum([ os.path.getsize(path) for path in paths ], 0)
+    print(f'tasks: {len(list(task_dirs(args.path)))}  files: {len(paths)}  bytes: {raw_size}')
+
+    from kolejka.client import KolejkaClient
+    client = None
+    for encoding in [ None ] + available_encodings():
+        Reference.objects.all().delete()
+        Blob.objects.all().delete()
+        shutil.rmtree(settings.BLOB_STORE_PATH, ignore_errors=True)
+        settings.BLOB_STORE_ENCODING = encoding
+        url = server.serve(latency=args.latency)
+        if client is None:
+            kolejka_config(args={ 'server': url, 'username': 'client', 'password': 'client' })
+            client = KolejkaClient()
+        client.config.server = url
+        client.login()
+        client.config.blob_encodings = client.get('/settings/').json()['blob_encodings']
+        client.config.compression = encoding
+        wire_size = raw_size
+        if encoding is not None:
+            wire_size = sum([ sum([ len(chunk) for chunk in encode_chunks(file_chunks(path), encoding) ], 0) for path in paths ], 0)
+        start = time.perf_counter()
+        for path in paths:
+            client.blob_upload(path)
+        upload_time = time.perf_counter() - start
+        stored = store_size(os.path.join(settings.BLOB_STORE_PATH, 'blob'))
+        saved = 100.0 * (raw_size - wire_size) / max(raw_size, 1)
+        print(f'encoding: {str(encoding):5s}  wire: {wire_size:10d}  saved: {saved:5.1f}%  stored: {stored:10d}  upload: {upload_time:7.3f}s  at {args.bandwidth}/s: {wire_size/bandwidth:7.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import json
+import threading
+import time
+
+import server
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent dequeue benchmark')
+    parser.add_argument('--tasks', type=int, default=2000, help='number of queued tasks')
+    parser.add_argument('--foremen', type=str, default='1,2,4,8,16', help='comma separated numbers of concurrent foremen')
+    parser.add_argument('--concurency', type=int, default=4, help='tasks requested per dequeue')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from django.db import connection
+    from django.test import Client
+    from kolejka.common import KolejkaTask, KolejkaLimits
+    from kolejka.server.task.models import Task
+
+    client_user = server.user('client')
+    foremen = [ server.user(f'foreman{i}', 'task.process_task') for i in range(max([ int(n) for n in args.foremen.split(',') ])) ]
+    limits = KolejkaLimits(cpus=args.concurency, memory='64G')
+    print(f'backend: {connection.vendor}, skip locked: {connection.features.has_select_for_update_skip_locked}')
+    for count in [ int(n) for n in args.foremen.split(',') ]:
+        Task.objects.all().delete()
+        for i in range(args.tasks):
+            t = KolejkaTask(None, image='ubuntu', args=['true'], limits={'cpus': 1, 'memory': '1G'})
+            task = Task(user=client_user)
+            t.id = task.key
+            task.set_task(t)
+            task.save()
+        connection.close()
+        claimed = [ list() for i in range(count) ]
+        def worker(index):
+            client = Client()
+            client.force_login(foremen[index])
+            data = json.dumps({ 'concurency': args.concurency, 'limits': limits.dump(), 'tags': [] })
+            while True:
+                response = client.post('/queue/dequeue/', data=data, content_type='application/json')
+                tasks = response.json()['tasks']
+                if not tasks:
+                    break
+                claimed[index] += [ t['id'] for t in tasks ]
+            from django.db import connection
+            connection.close()
+        threads = [ threading.Thread(target=worker, args=(i,)) for i in range(count) ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        keys = [ key for c in claimed for key in c ]
+        assert len(keys) == len(set(keys)), 'task assigned twice'
+        print(f'foremen: {count:3d}  claimed: {len(keys):6d}  time: {elapsed:8.3f}s  throughput: {len(keys)/elapsed:10.1f} tasks/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import random
+import threading
+import time
+
+import server
+
+def main():
+    parser = argparse.ArgumentParser(description='Task completion notification benchmark')
+    parser.add_argument('--tasks', type=int, default=20, help='number of watched tasks')
+    parser.add_argument('--duration', type=float, default=10, help='time span over which results are posted (in seconds)')
+    parser.add_argument('--interval', type=float, default=5, help='result query interval for polling (in seconds)')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from kolejka.common import kolejka_config, KolejkaTask, KolejkaResult
+    server.user('client', 'task.add_task', password='client')
+    server.user('foreman', 'task.process_task', 'task.add_result', password='foreman')
+    url = server.serve()
+    kolejka_config(args={ 'server': url, 'username': 'client', 'password': 'client' })
+    from kolejka.client import KolejkaClient
+    from kolejka.client.client import KolejkaClientObjectNotFoundError
+
+    for mode in [ 'polling', 'events' ]:
+        client = KolejkaClient()
+        foreman = KolejkaClient()
+        foreman.login('foreman', 'foreman')
+        keys = [ client.task_put(KolejkaTask(None, image='ubuntu', args=['true'])).id for i in range(args.tasks) ]
+        posted = dict()
+        def post():
+            for key in random.sample(keys, len(keys)):
+                time.sleep(args.duration / len(keys))
+                posted[key] = time.monotonic()
+                foreman.result_put(KolejkaResult(None, id=key, result=0))
+        thread = threading.Thread(target=post)
+        thread.start()
+        seen = dict()
+        requests = 0
+        if mode == 'polling':
+            while len(seen) < len(keys):
+                time.sleep(args.interval)
+                for key in keys:
+                    if key in seen:
+                        continue
+                    requests += 1
+                    try:
+                        client.get(f'/task/result/{key}/')
+                        seen[key] = time.monotonic()
+                    except KolejkaClientObjectNotFoundError:
+                        pass
+        else:
+            while len(seen) < len(keys):
+                requests += 1
+                for event, data in client.events([ key for key in keys if key not in seen ]):
+                    if event == 'state' and data['state'] == 'finished':
+                        seen[data['task']] = time.monotonic()
+        thread.join()
+        latency = [ seen[key] - posted[key] for key in keys ]
+        print(f'mode: {mode:8s}  requests: {requests:5d}  latency average: {sum(latency)/len(latency):7.3f}s  max: {max(latency):7.3f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import statistics
+import time
+
+import server
+
+POLICIES = [
+    'kolejka.server.queue.policy.FifoPolicy',
+    'kolejka.server.queue.policy.PriorityPolicy',
+    'kolejka.server.queue.policy.FairSharePolicy',
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue policy simulation')
+    parser.add_argument('--heavy', type=int, default=5000, help='number of tasks submitted by the heavy user')
+    parser.add_argument('--light', type=int, default=50, help='number of tasks submitted by each light user')
+    parser.add_argument('--light-users', type=int, default=3, help='number of light users')
+    parser.add_argument('--concurency', type=int, default=8, help='tasks claimed per dequeue')
+    parser.add_argument('--rounds', type=int, default=100, help='number of simulated dequeues')
+    parser.add_argument('--backlogs', type=str, default='1000,10000,40000', help='comma separated backlog sizes for the dequeue cost scaling run')
+    parser.add_argument('--users', type=int, default=10, help='number of users submitting the backlog in the scaling run')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from django.test.utils import override_settings
+    from kolejka.common import KolejkaTask, KolejkaLimits
+    from kolejka.server.queue.views import dequeue_tasks
+    from kolejka.server.task.models import Task
+
+    heavy = server.user('heavy')
+    light = [ server.user(f'light{i}') for i in range(args.light_users) ]
+    foreman = server.user('foreman', 'task.process_task')
+    limits = KolejkaLimits(cpus=args.concurency)
+    for policy in POLICIES:
+        Task.objects.all().delete()
+        users = [ heavy ] * args.heavy
+        for user in light:
+            users += [ user ] * args.light
+        for user in users:
+            t = KolejkaTask(None, image='ubuntu', args=['true'], limits={'cpus': 1})
+            task = Task(user=user)
+            t.id = task.key
+            task.set_task(t)
+            task.save()
+        first_light = dict()
+        timings = list()
+        with override_settings(DEQUEUE_POLICY=policy):
+            for r in range(args.rounds):
+                start = time.perf_counter()
+                tasks = dequeue_tasks(foreman, args.concurency, limits, set())
+                timings.append(time.perf_counter() - start)
+                if not tasks:
+                    break
+                for t in Task.objects.filter(key__in=[ t['id'] for t in tasks ]).select_related('user'):
+                    if t.user != heavy:
+                        first_light.setdefault(t.user.username, r)
+        served = Task.objects.filter(assignee__isnull=False).values_list('user__username', flat=True)
+        share = dict()
+        for username in served:
+            share[username] = share.get(username, 0) + 1
+        waits = [ first_light.get(u.username, args.rounds) for u in light ]
+        print(f'{policy.split(".")[-1]:16s} dequeue: {1000*statistics.mean(timings):7.2f}ms  first light task after {statistics.mean(waits):6.1f} rounds  served: {share}')
+
+    submitters = [ server.user(f'user{i}') for i in range(args.users) ]
+    Task.objects.all().delete()
+    count = 0
+    for backlog in [ int(n) for n in args.backlogs.split(',') ]:
+        batch = list()
+        for i in range(count, backlog):
+            t = KolejkaTask(None, image='ubuntu', args=['true'], limits={'cpus': 1})
+            task = Task(user=submitters[i % len(submitters)])
+            t.id = task.key
+            task.set_task(t)
+            batch.append(task)
+        Task.objects.bulk_create(batch, batch_size=1000)
+        count = max(count, backlog)
+        for policy in POLICIES:
+            timings = list()
+            with override_settings(DEQUEUE_POLICY=policy):
+                for r in range(args.rounds):
+                    start = time.perf_counter()
+                    tasks = dequeue_tasks(foreman, args.concurency, limits, set())
+                    timings.append(time.perf_counter() - start)
+                    Task.objects.filter(key__in=[ t['id'] for t in tasks ]).update(assignee=None, time_assign=None)
+            print(f'backlog: {backlog:7d}  {policy.split(".")[-1]:16s} median dequeue: {1000*statistics.median(timings):7.2f}ms')
+
+if __name__ == '__main__':
+    main()
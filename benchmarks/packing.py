@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kolejka.common import KolejkaLimits, KolejkaTask, KolejkaResources, pack_tasks
+
+def synthetic_trace(count, seed):
+    rng = random.Random(seed)
+    trace = list()
+    submit = 0.0
+    for i in range(count):
+        submit += rng.expovariate(2.0)
+        cpus = rng.choice([1, 1, 1, 2, 2, 4, 8])
+        trace.append({
+            'id' : str(i),
+            'submit' : submit,
+            'duration' : rng.lognormvariate(1.5, 1.0),
+            'image' : rng.choice(['ubuntu', 'debian', 'gcc', 'pytorch']),
+            'exclusive' : rng.random() < 0.01,
+            'limits' : { 'cpus' : cpus, 'memory' : f'{rng.choice([1, 2, 4, 8]) * cpus}G', 'image' : '1G' },
+        })
+    return trace
+
+def load_trace(trace):
+    tasks = list()
+    for spec in trace:
+        task = KolejkaTask(None, id=spec.get('id'), image=spec.get('image', 'ubuntu'), exclusive=spec.get('exclusive'), limits=spec.get('limits', {}))
+        task.submit = float(spec.get('submit', 0))
+        task.duration = float(spec['duration'])
+        tasks.append(task)
+    return sorted(tasks, key=lambda t: t.submit)
+
+def first_fit(resources, queue, window):
+    selected = list()
+    for task in queue[0:window]:
+        if not resources.task_fits(task):
+            break
+        resources.task_add(task)
+        selected.append(task)
+    return selected
+
+def best_fit(resources, queue, window):
+    return pack_tasks(resources, queue, window=window)
+
+def simulate(tasks, capacity, concurency, strategy, window, mode):
+    pending = list(tasks)
+    queue = list()
+    running = list()
+    resources = KolejkaResources(capacity, concurency=concurency)
+    for task in pending:
+        task.limits.update(capacity)
+    now = 0.0
+    counter = 0
+    while pending or queue or running:
+        while pending and pending[0].submit <= now:
+            queue.append(pending.pop(0))
+        if mode == 'slots' or not running:
+            for task in strategy(resources, queue, window):
+                queue.remove(task)
+                counter += 1
+                heapq.heappush(running, (now + task.duration, counter, task))
+        events = list()
+        if running and mode == 'batch':
+            events.append(max([ r[0] for r in running ]))
+        elif running:
+            events.append(running[0][0])
+        if pending and (mode == 'slots' or not running):
+            events.append(pending[0].submit)
+        if not events:
+            break
+        now = min(events)
+        while running and running[0][0] <= now:
+            _, _, task = heapq.heappop(running)
+            resources.task_remove(task)
+    done = [ t for t in tasks if t not in queue ]
+    cpu_time = sum([ t.limits.cpus * t.duration for t in done ])
+    memory_time = sum([ t.limits.memory * t.duration for t in done ])
+    return {
+        'makespan' : now,
+        'cpu_utilization' : cpu_time / (capacity.cpus * now) if now else 0,
+        'memory_utilization' : memory_time / (capacity.memory * now) if now else 0,
+        'unscheduled' : len(queue),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a task trace on a single foreman')
+    parser.add_argument('--trace', type=str, help='JSON list of tasks with submit, duration, image, exclusive and limits')
+    parser.add_argument('--save-trace', type=str, help='save generated trace')
+    parser.add_argument('--tasks', type=int, default=2000, help='number of generated tasks')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for generated trace')
+    parser.add_argument('--cpus', type=int, default=16)
+    parser.add_argument('--memory', type=str, default='64G')
+    parser.add_argument('--image', type=str, default='8G')
+    parser.add_argument('--concurency', type=int, default=16)
+    parser.add_argument('--window', type=int, default=32, help='lookahead window')
+    parser.add_argument('--mode', type=str, default='batch,slots', help='comma separated execution modes (batch, slots)')
+    args = parser.parse_args()
+    if args.trace:
+        with open(args.trace) as trace_file:
+            trace = json.load(trace_file)
+    else:
+        trace = synthetic_trace(args.tasks, args.seed)
+    if args.save_trace:
+        with open(args.save_trace, 'w') as trace_file:
+            json.dump(trace, trace_file, indent=2)
+    capacity = KolejkaLimits(cpus=args.cpus, memory=args.memory, image=args.image)
+    for mode in args.mode.split(','):
+        for name, strategy in [ ('first-fit', first_fit), ('best-fit', best_fit) ]:
+            result = simulate(load_trace(trace), capacity, args.concurency, strategy, args.window, mode)
+            print(f'{mode:6s} {name:10s} makespan: {result["makespan"]:10.1f}s  cpu: {100*result["cpu_utilization"]:5.1f}%  memory: {100*result["memory_utilization"]:5.1f}%  unscheduled: {result["unscheduled"]}')
+
+if __name__ == '__main__':
+    main()
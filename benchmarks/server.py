@@ -0,0 +1,81 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import logging
+import os
+import socketserver
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_DIR not in sys.path:
+    sys.path.insert(0, PROJECT_DIR)
+
+def setup(database=None, **kwargs):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    from kolejka.server import settings as server_settings
+    temp_dir = tempfile.mkdtemp(prefix='kolejka-benchmark-')
+    config = dict([ (k, getattr(server_settings, k)) for k in dir(server_settings) if k.isupper() ])
+    if database is None:
+        database = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(temp_dir, 'database.sqlite3'),
+            'OPTIONS': { 'timeout': 60 },
+        }
+        if django.VERSION >= (5, 1):
+            database['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    config['DATABASES'] = { 'default': database }
+    config['BLOB_STORE_PATH'] = os.path.join(temp_dir, 'blobs')
+    config['ALLOWED_HOSTS'] = [ '*' ]
+    config.update(kwargs)
+    settings.configure(**config)
+    django.setup()
+    call_command('migrate', verbosity=0)
+    return temp_dir
+
+def user(username, *permissions, password=None):
+    from django.contrib.auth.models import Permission, User
+    user, _ = User.objects.get_or_create(username=username)
+    if password is not None:
+        user.set_password(password)
+        user.save()
+    for perm in permissions:
+        app_label, codename = perm.split('.')
+        user.user_permissions.add(Permission.objects.get(codename=codename, content_type__app_label=app_label))
+    return user
+
+def database_from_env():
+    name = os.environ.get('KOLEJKA_BENCHMARK_POSTGRES')
+    if name:
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': name,
+            'HOST': os.environ.get('PGHOST', 'localhost'),
+            'USER': os.environ.get('PGUSER', 'postgres'),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+        }
+
+def serve(latency=0.0):
+    import multiprocessing
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+    class Server(socketserver.ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+    django_application = get_wsgi_application()
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    def application(environ, start_response):
+        if latency > 0:
+            time.sleep(latency)
+        return django_application(environ, start_response)
+    httpd = make_server('127.0.0.1', 0, application, server_class=Server, handler_class=Handler)
+    connections.close_all()
+    process = multiprocessing.get_context('fork').Process(target=httpd.serve_forever, daemon=True)
+    process.start()
+    httpd.socket.close()
+    return f'http://127.0.0.1:{httpd.server_port}'
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import server
+
+def main():
+    parser = argparse.ArgumentParser(description='Task upload and download benchmark')
+    parser.add_argument('--files', type=str, default='1,16,128', help='comma separated numbers of files per task')
+    parser.add_argument('--sizes', type=str, default='1K,1M', help='comma separated file sizes')
+    parser.add_argument('--workers', type=str, default='1,8', help='comma separated numbers of transfer workers')
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated server latency per request (in seconds)')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from kolejka.common import kolejka_config, KolejkaTask
+    from kolejka.common.parse import parse_memory
+    server.user('client', 'task.add_task', 'blob.add_reference', password='client')
+    url = server.serve(latency=args.latency)
+    kolejka_config(args={ 'server': url, 'username': 'client', 'password': 'client' })
+    from kolejka.client import KolejkaClient
+    client = KolejkaClient()
+
+    temp_dir = tempfile.mkdtemp(prefix='kolejka-benchmark-transfer-')
+    try:
+        for size in [ parse_memory(s) for s in args.sizes.split(',') ]:
+            for count in [ int(n) for n in args.files.split(',') ]:
+                for workers in [ int(n) for n in args.workers.split(',') ]:
+                    task_path = os.path.join(temp_dir, 'task')
+                    shutil.rmtree(task_path, ignore_errors=True)
+                    os.makedirs(task_path)
+                    files = dict()
+                    for i in range(count):
+                        name = f'input_{i}'
+                        with open(os.path.join(task_path, name), 'wb') as f:
+                            f.write(os.urandom(size))
+                        files[name] = name
+                    task = KolejkaTask(task_path, image='ubuntu', args=['true'], files=files)
+                    task.commit()
+                    client.config.transfer_workers = workers
+                    start = time.perf_counter()
+                    task = client.task_put(KolejkaTask(task_path))
+                    put_time = time.perf_counter() - start
+                    start = time.perf_counter()
+                    client.task_get(task.id, os.path.join(temp_dir, 'get', task.id))
+                    get_time = time.perf_counter() - start
+                    print(f'size: {size:9d}  files: {count:4d}  workers: {workers:3d}  put: {put_time:8.3f}s  get: {get_time:8.3f}s')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import server
+
+def main():
+    parser = argparse.ArgumentParser(description='Large blob upload benchmark')
+    parser.add_argument('--size', type=str, default='512M', help='blob size')
+    parser.add_argument('--buffers', type=str, default='8K,64K,4M', help='comma separated server buffer sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='uploads per buffer size')
+    args = parser.parse_args()
+
+    server.setup(database=server.database_from_env())
+    from django.conf import settings
+    from kolejka.common import kolejka_config
+    from kolejka.common.parse import parse_memory
+    server.user('client', 'blob.add_reference', password='client')
+
+    temp_dir = tempfile.mkdtemp(prefix='kolejka-benchmark-upload-')
+    try:
+        size = parse_memory(args.size)
+        blob_path = os.path.join(temp_dir, 'blob')
+        with open(blob_path, 'wb') as blob_file:
+            chunk = os.urandom(1024*1024)
+            for i in range(0, size, len(chunk)):
+                blob_file.write(chunk[0:min(len(chunk), size - i)])
+        from kolejka.client import KolejkaClient
+        for buffer_size in [ parse_memory(s) for s in args.buffers.split(',') ]:
+            settings.BLOB_BUFFER_SIZE = buffer_size
+            url = server.serve()
+            kolejka_config(args={ 'server': url, 'username': 'client', 'password': 'client' })
+            client = KolejkaClient()
+            client.config.server = url
+            client.login()
+            blob_hash = client.blob_hash(blob_path)
+            times = list()
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                client.blob_upload(blob_path, blob_hash)
+                times.append(time.perf_counter() - start)
+            best = min(times)
+            print(f'size: {size:12d}  buffer: {buffer_size:9d}  time: {best:8.3f}s  throughput: {size/best/1024/1024:8.1f} MiB/s')
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
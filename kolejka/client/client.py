@@ -2,6 +2,7 @@
 
 from kolejka.common import settings
 
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import json
 import logging
@@ -10,11 +11,15 @@ import re
 import requests
 import shutil
 import sys
+import tempfile
 import time
 
 from kolejka.common import kolejka_config, client_config
 from kolejka.common import KolejkaTask, KolejkaResult, KolejkaLimits
+from kolejka.common.task import KolejkaFiles
 from kolejka.common import MemoryAction, TimeAction, BigIntAction
+from kolejka.common.bundle import bundle_create
+from kolejka.common.compression import encode_chunks, file_chunks
 
 class KolejkaClientError(Exception):
     pass
@@ -37,11 +42,12 @@ class KolejkaClientUploadError(KolejkaClientError):
 class KolejkaClient:
     def __init__(self, max_retries=3):
         self.config = client_config()
+        self.max_retries = max_retries or 0
         self.session = requests.session()
-        if max_retries is not None:
-            adapter = requests.adapters.HTTPAdapter(max_retries=max_retries)
-            self.session.mount('http://', adapter)
-            self.session.mount('https://', adapter)
+        pool_size = max(self.config.transfer_workers or 1, requests.adapters.DEFAULT_POOLSIZE)
+        adapter = requests.adapters.HTTPAdapter(max_retries=max_retries or 0, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         if self.config.username is not None and self.config.password is not None:
             self.login()
         for k,v in self.get('/settings/').json().items():
@@ -70,7 +76,7 @@ class KolejkaClient:
         if response.status_code == requests.codes.not_found:
             response.close()
             raise KolejkaClientObjectNotFoundError()
-        if response.status_code != requests.codes.ok:
+        if response.status_code not in [ requests.codes.ok, requests.codes.partial_content ]:
             response.close()
             raise KolejkaClientRemoteError()
         if response.headers.get('content-type', '') == 'application/json':
@@ -117,6 +123,14 @@ class KolejkaClient:
     def delete(self, *args, **kwargs):
         return self.complex(self.session.delete, *args, **kwargs)
 
+    def transfer(self, function, items):
+        items = list(items)
+        workers = min(self.config.transfer_workers or 1, len(items))
+        if workers <= 1:
+            return [ function(item) for item in items ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(function, items))
+
     def login(self, username=None, password=None):
         username = username or self.config.username
         password = password or self.config.password
@@ -127,10 +141,7 @@ class KolejkaClient:
     def logout(self):
         response = self.post('/logout/')
 
-    def blob_put(self, blob_path):
-        assert os.path.isfile(blob_path)
-        if not self.instance_session:
-            self.login() 
+    def blob_hash(self, blob_path):
         hasher = hashlib.new(self.config.blob_hash_algorithm)
         with open(blob_path, 'rb') as blob_file:
             while True:
@@ -138,31 +149,122 @@ class KolejkaClient:
                 if len(buf) == 0:
                     break
                 hasher.update(buf)
-            hash = hasher.hexdigest()
-            try:
-                response = self.post(f'/blob/blob/{hash}/')
-                reference = response.json()['reference']
-                return reference
-            except KolejkaClientObjectNotFoundError:
-                blob_file.seek(0)
-                response = self.post('/blob/reference/', data=blob_file)
-                reference = response.json()['reference']
-                return reference
-        raise KolejkaClientError()
+        return hasher.hexdigest()
+
+    def blob_upload_resumable(self, blob_path, blob_hash=None):
+        params = { 'size' : os.path.getsize(blob_path) }
+        if blob_hash is not None:
+            params['hash'] = blob_hash
+        upload = self.post('/blob/upload/', data=json.dumps(params)).json()['upload']
+        url = f'/blob/upload/{upload["key"]}/'
+        with open(blob_path, 'rb') as blob_file:
+            failures = 0
+            while True:
+                try:
+                    if upload is None:
+                        upload = self.put(url).json()['upload']
+                    blob_file.seek(upload['offset'])
+                    chunk = blob_file.read(self.config.upload_chunk_size)
+                    response = self.post(url, data=chunk, headers={ 'X-Upload-Offset' : str(upload['offset']) }).json()
+                    if 'reference' in response:
+                        return response['reference']
+                    upload = response['upload']
+                except (requests.exceptions.RequestException, KolejkaClientRemoteError):
+                    failures += 1
+                    if failures > self.max_retries:
+                        raise KolejkaClientUploadError()
+                    upload = None
+
+    def blob_upload(self, blob_path, blob_hash=None):
+        if os.path.getsize(blob_path) > self.config.upload_chunk_size:
+            return self.blob_upload_resumable(blob_path, blob_hash)
+        headers = dict()
+        if blob_hash is not None:
+            headers['X-Blob-Hash'] = blob_hash
+        encoding = self.config.compression
+        if encoding is not None and encoding in (getattr(self.config, 'blob_encodings', None) or []):
+            headers['Content-Encoding'] = encoding
+            with tempfile.TemporaryFile() as encoded_file:
+                for chunk in encode_chunks(file_chunks(blob_path), encoding):
+                    encoded_file.write(chunk)
+                encoded_file.seek(0)
+                response = self.post('/blob/reference/', data=encoded_file, headers=headers)
+                return response.json()['reference']
+        with open(blob_path, 'rb') as blob_file:
+            response = self.post('/blob/reference/', data=blob_file, headers=headers)
+            return response.json()['reference']
+
+    def blob_put(self, blob_path):
+        assert os.path.isfile(blob_path)
+        if not self.instance_session:
+            self.login() 
+        hash = self.blob_hash(blob_path)
+        try:
+            response = self.post(f'/blob/blob/{hash}/')
+            reference = response.json()['reference']
+            return reference
+        except KolejkaClientObjectNotFoundError:
+            return self.blob_upload(blob_path, hash)
+
+    def blob_bulk(self, blob_hashes=[], blob_references=[]):
+        if not blob_hashes and not blob_references:
+            return dict(), dict()
+        params = {
+                'blobs' : list(blob_hashes),
+                'references' : list(blob_references),
+            }
+        response = self.post('/blob/bulk/', data=json.dumps(params)).json()
+        return response['blobs'], response['references']
+
+    def files_put(self, files, path):
+        files = list(files)
+        blobs, references = self.blob_bulk(blob_references=set([ f.reference for f in files if f.reference ]))
+        missing = [ f for f in files if not f.reference or f.reference not in references ]
+        for f in missing:
+            assert f.path
+        hashes = self.transfer(lambda f: self.blob_hash(os.path.join(path, f.path)), missing)
+        blobs, references = self.blob_bulk(blob_hashes=set(hashes))
+        def upload(item):
+            f, hash = item
+            if hash in blobs:
+                f.reference = blobs[hash]['key']
+            else:
+                f.reference = self.blob_upload(os.path.join(path, f.path), hash)['key']
+        self.transfer(upload, zip(missing, hashes))
 
     def blob_get(self, blob_path, blob_reference=None, blob_hash=None):
         assert blob_reference or blob_hash
         if blob_reference is not None:
-            response = self.get(f'/blob/reference/{blob_reference}/', stream=True)
+            url = f'/blob/reference/{blob_reference}/'
         elif blob_hash is not None:
-            response = self.get(f'/blob/blob/{blob_hash}/', stream=True)
+            url = f'/blob/blob/{blob_hash}/'
+        response = self.get(url, stream=True)
         dir_path = os.path.dirname(os.path.abspath(blob_path))
         os.makedirs(dir_path, exist_ok=True)
         try:
             with open(blob_path, 'wb') as blob_file:
-                for chunk in response.iter_content(chunk_size=1024*1024*4):
-                    if chunk:
-                        blob_file.write(chunk)
+                etag = None
+                failures = 0
+                while True:
+                    try:
+                        if response is None:
+                            headers = { 'Range' : f'bytes={blob_file.tell()}-' }
+                            if etag is not None:
+                                headers['If-Range'] = etag
+                            response = self.get(url, stream=True, headers=headers)
+                        if response.status_code != requests.codes.partial_content:
+                            blob_file.seek(0)
+                            blob_file.truncate()
+                        etag = response.headers.get('ETag')
+                        for chunk in response.iter_content(chunk_size=1024*1024*4):
+                            if chunk:
+                                blob_file.write(chunk)
+                        break
+                    except (requests.exceptions.RequestException, KolejkaClientRemoteError):
+                        failures += 1
+                        if failures > self.max_retries:
+                            raise
+                        response = None
         except:
             os.unlink(blob_path)
             raise KolejkaClientDownloadError()
@@ -188,7 +290,7 @@ class KolejkaClient:
         except KolejkaClientObjectNotFoundError:
             return False
 
-    def task_put(self, task):
+    def task_put(self, task, bundle=None):
         limits = KolejkaLimits()
         limits.cpus = self.config.cpus
         limits.memory = self.config.memory
@@ -198,6 +300,7 @@ class KolejkaClient:
         limits.image = self.config.image
         limits.workspace = self.config.workspace
         limits.time = self.config.time
+        limits.cpu_time = self.config.cpu_time
         limits.network = self.config.network
         limits.gpus = self.config.gpus
         limits.perf_instructions = self.config.perf_instructions
@@ -210,25 +313,42 @@ class KolejkaClient:
         task.limits.update(limits)
         if not self.instance_session:
             self.login() 
-        for f in task.files.values():
-            if not f.reference or not self.blob_check(blob_reference = f.reference):
-                assert f.path
-                f.reference = self.blob_put(os.path.join(task.path, f.path))['key']
-        response = self.post('/task/task/', data=json.dumps(task.dump()))
+        if bundle is None:
+            bundle = self.config.bundle
+        if bundle and task.bundle is None and task.files.is_local and len(task.files.keys()) > 0:
+            with tempfile.TemporaryDirectory() as bundle_path:
+                bundle_create(os.path.join(bundle_path, settings.TASK_BUNDLE), task.files, task.path)
+                files = KolejkaFiles(bundle_path)
+                files.add(settings.TASK_BUNDLE)
+                self.files_put(files.values(), files.path)
+            description = task.dump()
+            description['files'] = files.dump()
+            description['bundle'] = settings.TASK_BUNDLE
+            del description['files'][settings.TASK_BUNDLE]['path']
+        else:
+            self.files_put(task.files.values(), task.path)
+            description = task.dump()
+        response = self.post('/task/task/', data=json.dumps(description))
         task = KolejkaTask(None)
         task.load(response.json()['task'])
         return task
 
-    def task_get(self, task_key, task_path):
+    def task_get(self, task_key, task_path, cache=None):
         if isinstance(task_key, KolejkaTask):
             task_key = task_key.id
         response = self.get(f'/task/task/{task_key}/')
         os.makedirs(task_path, exist_ok=True)
         task = KolejkaTask(task_path)
         task.load(response.json()['task'])
-        for k,f in task.files.items():
-            self.blob_get(os.path.join(task.path, k), f.reference)
+        def download(item):
+            k, f = item
+            file_path = os.path.join(task.path, k)
+            if cache is None or not cache.get(f.blob, file_path, self.config.blob_hash_algorithm):
+                self.blob_get(file_path, f.reference)
+                if cache is not None and f.blob:
+                    cache.put(f.blob, file_path)
             f.path = k
+        self.transfer(download, task.files.items())
         task.commit()
         return task
 
@@ -243,10 +363,7 @@ class KolejkaClient:
     def result_put(self, result):
         if not self.instance_session:
             self.login() 
-        for f in result.files.values():
-            if not f.reference or not self.blob_check(blob_reference = f.reference):
-                assert f.path
-                f.reference = self.blob_put(os.path.join(result.path, f.path))['key']
+        self.files_put(result.files.values(), result.path)
         response = self.post('/task/result/', data=json.dumps(result.dump()))
         result = KolejkaResult(None)
         result.load(response.json()['result'])
@@ -258,9 +375,11 @@ class KolejkaClient:
         result = KolejkaResult(result_path)
         desc = response.json()['result']
         result.load(desc)
-        for k,f in result.files.items():
+        def download(item):
+            k, f = item
             self.blob_get(os.path.join(result.path, k), f.reference)
             f.path = k
+        self.transfer(download, result.files.items())
         result.commit()
         return result
 
@@ -274,14 +393,54 @@ class KolejkaClient:
         except KolejkaClientObjectNotFoundError:
             pass
 
-    def dequeue(self, concurency, limits, tags):
+    def events(self, task_keys, timeout=None):
+        if not self.instance_session:
+            self.login()
+        params = { 'tasks' : [ key.id if isinstance(key, KolejkaTask) else key for key in task_keys ] }
+        kwargs = dict()
+        if timeout is not None:
+            params['timeout'] = timeout
+            kwargs['timeout'] = (30, timeout + 30)
+        response = self.post('/task/events/', data=json.dumps(params), stream=True, **kwargs)
+        response.encoding = 'utf-8'
+        try:
+            event = dict()
+            for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                if not line:
+                    if 'data' in event:
+                        yield event.get('event', 'message'), json.loads(event['data'])
+                    event = dict()
+                elif line.startswith(':'):
+                    continue
+                else:
+                    name, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if name == 'data' and 'data' in event:
+                        value = event['data'] + '\n' + value
+                    event[name] = value
+        finally:
+            response.close()
+
+    def wait(self, task_keys, timeout=None):
+        states = dict()
+        for event, data in self.events(task_keys, timeout=timeout):
+            if event == 'state':
+                states[data['task']] = data['state']
+        return states
+
+    def dequeue(self, concurency, limits, tags, timeout=None):
         if not self.instance_session:
             self.login() 
-        response = self.post('/queue/dequeue/', data=json.dumps({
+        params = {
                 'concurency' : concurency,
                 'limits' : limits.dump(),
                 'tags' : tags,
-            }))
+            }
+        kwargs = dict()
+        if timeout is not None:
+            params['timeout'] = timeout
+            kwargs['timeout'] = timeout + 30
+        response = self.post('/queue/dequeue/', data=json.dumps(params), **kwargs)
         ts = response.json()['tasks']
         tasks = list()
         for t in ts:
@@ -336,6 +495,7 @@ def config_parser_task_put(parser):
     parser.add_argument('--image', action=MemoryAction, help='image size limit')
     parser.add_argument('--workspace', action=MemoryAction, help='workspace size limit')
     parser.add_argument('--time', action=TimeAction, help='time limit')
+    parser.add_argument('--cpu-time', action=TimeAction, help='cpu time limit')
     parser.add_argument('--network', type=bool, help='allow netowrking')
     parser.add_argument('--gpus', type=int, help='gpus limit')
     parser.add_argument('--gpu-memory', type=MemoryAction, help='gpu memory limit')
@@ -343,6 +503,7 @@ def config_parser_task_put(parser):
     parser.add_argument('--perf-cycles', type=BigIntAction, help='CPU cycles limit')
     parser.add_argument('--cgroup-depth', type=int, help='Cgroup depth limit')
     parser.add_argument('--cgroup-descendants', type=int, help='Cgroup descendants limit')
+    parser.add_argument('--bundle', action='store_true', default=None, help='upload task files as a single archive')
     def execute(args):
         kolejka_config(args=args)
         client = KolejkaClient()
@@ -427,6 +588,7 @@ def config_parser_execute(parser):
     parser.add_argument('--image', action=MemoryAction, help='image size limit')
     parser.add_argument('--workspace', action=MemoryAction, help='workspace size limit')
     parser.add_argument('--time', action=TimeAction, help='time limit')
+    parser.add_argument('--cpu-time', action=TimeAction, help='cpu time limit')
     parser.add_argument('--network', type=bool, help='allow netowrking')
     parser.add_argument('--gpus', type=int, help='gpus limit')
     parser.add_argument('--gpu-memory', type=MemoryAction, help='gpu memory limit')
@@ -434,14 +596,26 @@ def config_parser_execute(parser):
     parser.add_argument('--perf-cycles', type=BigIntAction, help='CPU cycles limit')
     parser.add_argument('--cgroup-depth', type=int, help='Cgroup depth limit')
     parser.add_argument('--cgroup-descendants', type=int, help='Cgroup descendants limit')
+    parser.add_argument('--bundle', action='store_true', default=None, help='upload task files as a single archive')
     def execute(args):
         kolejka_config(args=args)
         client = KolejkaClient()
         task = KolejkaTask(args.task)
         response = client.task_put(task)
+        events = True
         while True:
-            client.session.close()
-            time.sleep(args.interval)
+            if events:
+                try:
+                    state = client.wait([response.id]).get(response.id)
+                    if state in [ 'queued', 'assigned' ]:
+                        continue
+                    if state != 'finished':
+                        raise KolejkaClientError(f'Task {response.id} is {state}')
+                except KolejkaClientObjectNotFoundError:
+                    events = False
+            if not events:
+                client.session.close()
+                time.sleep(args.interval)
             try:
                 result = client.result_get(response.id, args.result)
             except KolejkaClientObjectNotFoundError:
@@ -8,6 +8,7 @@ from .parse import BigIntAction, TimeAction, MemoryAction, parse_bigint, parse_t
 
 from .config import KolejkaConfig, kolejka_config, client_config, foreman_config, worker_config
 from .limits import KolejkaLimits, KolejkaStats
+from .packing import KolejkaResources, pack_tasks
 from .task import KolejkaTask, KolejkaResult
 
 def main():
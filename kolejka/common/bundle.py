@@ -0,0 +1,44 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import os
+import shutil
+import tarfile
+
+def bundle_create(bundle_path, files, path=None):
+    with tarfile.open(bundle_path, 'w', format=tarfile.GNU_FORMAT) as bundle:
+        for name, f in sorted(files.items()):
+            if name == settings.TASK_SPEC:
+                continue
+            assert f.is_local()
+            file_path = os.path.join(path or files.path or os.getcwd(), f.path)
+            info = tarfile.TarInfo(name)
+            info.size = os.path.getsize(file_path)
+            info.mode = 0o755 if os.access(file_path, os.X_OK) else 0o644
+            with open(file_path, 'rb') as file_file:
+                bundle.addfile(info, file_file)
+
+def bundle_members(bundle):
+    for info in bundle:
+        name = os.path.normpath(info.name).strip('/')
+        if not info.isfile():
+            continue
+        if name.startswith('../') or name in [ '', '.', '..', settings.TASK_SPEC ]:
+            continue
+        yield name, info
+
+def bundle_extract(bundle_path, path):
+    names = list()
+    with tarfile.open(bundle_path, 'r') as bundle:
+        for name, info in bundle_members(bundle):
+            dst_path = os.path.join(path, name)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            if os.path.lexists(dst_path):
+                os.unlink(dst_path)
+            with bundle.extractfile(info) as src_file:
+                with open(dst_path, 'wb') as dst_file:
+                    shutil.copyfileobj(src_file, dst_file, settings.BUNDLE_BUFFER_SIZE)
+            os.chmod(dst_path, 0o755 if info.mode & 0o111 else 0o644)
+            names.append(name)
+    return names
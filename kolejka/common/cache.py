@@ -0,0 +1,150 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+FICLONE = 0x40049409
+
+def clone_file(source, destination):
+    try:
+        with open(source, 'rb') as source_file:
+            with open(destination, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        return
+    except OSError:
+        if os.path.exists(destination):
+            os.unlink(destination)
+        if not os.path.exists(source):
+            raise
+    shutil.copyfile(source, destination)
+
+def file_hash(path, hash_algorithm):
+    hasher = hashlib.new(hash_algorithm)
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(1024*1024)
+            if len(buf) == 0:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+class KolejkaCache:
+    def __init__(self, path, size=None):
+        self.path = os.path.abspath(path)
+        self.size = size
+        os.makedirs(os.path.join(self.path, 'blob'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'temp'), exist_ok=True)
+        self.index_path = os.path.join(self.path, 'index.sqlite')
+        with self.index() as index:
+            index.execute('BEGIN IMMEDIATE')
+            if index.execute('PRAGMA user_version').fetchone()[0] == 0:
+                index.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, access REAL NOT NULL)')
+                index.execute('CREATE INDEX IF NOT EXISTS entries_access ON entries (access)')
+                index.executemany('INSERT OR REPLACE INTO entries (key, size, access) VALUES (?, ?, ?)', self.scan())
+                index.execute('PRAGMA user_version = 1')
+            index.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def index(self):
+        connection = sqlite3.connect(self.index_path, timeout=60, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def blob_path(self, key):
+        return os.path.join(self.path, 'blob', key[0:2], key[2:])
+
+    def temp_path(self):
+        return os.path.join(self.path, 'temp', uuid.uuid4().hex)
+
+    def scan(self):
+        blob_path = os.path.join(self.path, 'blob')
+        for root, dirs, files in os.walk(blob_path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield (os.path.relpath(root, blob_path) + name, stat.st_size, stat.st_mtime)
+
+    def usage(self):
+        with self.index() as index:
+            return index.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def remove(self, key):
+        try:
+            os.unlink(self.blob_path(key))
+        except FileNotFoundError:
+            pass
+        with self.index() as index:
+            index.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def get(self, key, path, hash_algorithm='sha256'):
+        if not key:
+            return False
+        blob_path = self.blob_path(key)
+        if not os.path.exists(blob_path):
+            return False
+        dir_path = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dir_path, exist_ok=True)
+        if os.path.lexists(path):
+            os.unlink(path)
+        try:
+            clone_file(blob_path, path)
+        except FileNotFoundError:
+            return False
+        if file_hash(path, hash_algorithm) != key:
+            os.unlink(path)
+            self.remove(key)
+            return False
+        with self.index() as index:
+            index.execute('UPDATE entries SET access = ? WHERE key = ?', (time.time(), key))
+        return True
+
+    def put(self, key, path):
+        blob_path = self.blob_path(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        temp_path = self.temp_path()
+        try:
+            clone_file(path, temp_path)
+            os.chmod(temp_path, 0o444)
+            size = os.path.getsize(temp_path)
+            os.rename(temp_path, blob_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        with self.index() as index:
+            index.execute('INSERT OR REPLACE INTO entries (key, size, access) VALUES (?, ?, ?)', (key, size, time.time()))
+        self.evict()
+
+    def evict(self):
+        if self.size is None:
+            return
+        with self.index() as index:
+            index.execute('BEGIN IMMEDIATE')
+            try:
+                usage = index.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+                if usage > self.size:
+                    for key, size in index.execute('SELECT key, size FROM entries ORDER BY access').fetchall():
+                        if usage <= self.size:
+                            break
+                        try:
+                            os.unlink(self.blob_path(key))
+                        except FileNotFoundError:
+                            pass
+                        index.execute('DELETE FROM entries WHERE key = ?', (key,))
+                        usage -= size
+                index.execute('COMMIT')
+            except:
+                index.execute('ROLLBACK')
+                raise
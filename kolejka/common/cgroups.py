@@ -10,6 +10,202 @@ import traceback
 
 from .limits import KolejkaStats
 
+UNIFIED_CONTROLLERS = {
+    'cpu' : [ 'cpu', 'cpuacct' ],
+    'cpuset' : [ 'cpuset' ],
+    'io' : [ 'io', 'blkio' ],
+    'memory' : [ 'memory' ],
+    'pids' : [ 'pids' ],
+}
+UNIFIED_GROUPS = [ 'freezer', 'perf_event' ]
+
+CGROUP_FILES = {
+    1 : [
+        ('cpu_usage', 'cpuacct', 'cpuacct.usage'),
+        ('cpu_stat', 'cpuacct', 'cpuacct.stat'),
+        ('cpus_usage', 'cpuacct', 'cpuacct.usage_percpu'),
+        ('memory_usage', 'memory', 'memory.usage_in_bytes'),
+        ('memory_max_usage', 'memory', 'memory.max_usage_in_bytes'),
+        ('memsw_usage', 'memory', 'memory.memsw.usage_in_bytes'),
+        ('memsw_max_usage', 'memory', 'memory.memsw.max_usage_in_bytes'),
+        ('memory_failures', 'memory', 'memory.failcnt'),
+        ('pids_usage', 'pids', 'pids.current'),
+        ('pids_events', 'pids', 'pids.events'),
+    ],
+    2 : [
+        ('cpu_stat', 'cpuacct', 'cpu.stat'),
+        ('memory_usage', 'memory', 'memory.current'),
+        ('memory_max_usage', 'memory', 'memory.peak'),
+        ('swap_usage', 'memory', 'memory.swap.current'),
+        ('swap_max_usage', 'memory', 'memory.swap.peak'),
+        ('memory_events', 'memory', 'memory.events'),
+        ('pids_usage', 'pids', 'pids.current'),
+        ('pids_events', 'pids', 'pids.events'),
+    ],
+}
+CGROUP_READ_SIZE = 4096
+
+def parse_value(data):
+    try:
+        return int(data)
+    except ValueError:
+        return None
+
+def parse_values(data):
+    return [ int(value) for value in data.split() ]
+
+def parse_keys(data):
+    values = data.split()
+    return dict(zip(values[0::2], values[1::2]))
+
+class ControlGroupSnapshot:
+    __slots__ = ( 'cpu_usage', 'cpu_user', 'cpu_system', 'cpus_usage', 'memory_usage', 'memory_max_usage', 'swap_usage', 'swap_max_usage', 'memory_failures', 'pids_usage', 'pids_failures' )
+
+    def __init__(self):
+        for slot in self.__slots__:
+            setattr(self, slot, None)
+
+    def stats(self):
+        result = KolejkaStats()
+        seconds = lambda value: None if value is None else 10**-9*value
+        if self.cpu_usage is not None or self.cpu_user is not None:
+            result.cpu = KolejkaStats.CpusStats(usage = seconds(self.cpu_usage), user = seconds(self.cpu_user), system = seconds(self.cpu_system))
+        if self.cpus_usage is not None:
+            for i, usage in enumerate(self.cpus_usage):
+                result.cpus[str(i)] = KolejkaStats.CpusStats(usage = seconds(usage))
+        result.memory = KolejkaStats.MemoryStats(usage = self.memory_usage, max_usage = self.memory_max_usage, swap = self.swap_usage, max_swap = self.swap_max_usage, failures = self.memory_failures)
+        result.pids = KolejkaStats.PidsStats(usage = self.pids_usage, failures = self.pids_failures)
+        result.update(KolejkaStats())
+        return result
+
+class ControlGroupReader:
+    def __init__(self, system, groups):
+        self.version = system.version
+        self.user_hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        self.fds = dict()
+        self.sizes = dict()
+        for key, group, filename in CGROUP_FILES[self.version]:
+            if group not in groups or group not in system.mount_points:
+                continue
+            try:
+                self.fds[key] = os.open(os.path.join(system.mount_point(group), groups[group].strip('/'), filename), os.O_RDONLY | os.O_CLOEXEC)
+            except OSError:
+                continue
+            self.sizes[key] = max(CGROUP_READ_SIZE, 24*(os.cpu_count() or 1)) if key == 'cpus_usage' else CGROUP_READ_SIZE
+
+    def read(self, key):
+        fd = self.fds.get(key)
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, self.sizes[key], 0)
+        except OSError:
+            return None
+
+    def cpu_usage(self):
+        if self.version == 2:
+            data = self.read('cpu_stat')
+            if data is not None:
+                usage = parse_keys(data).get(b'usage_usec')
+                if usage is not None:
+                    return int(usage) / 10**6
+            return None
+        data = self.read('cpu_usage')
+        if data is not None:
+            usage = parse_value(data)
+            if usage is not None:
+                return usage / 10**9
+
+    def sample(self):
+        if self.version == 2:
+            return self.unified_sample()
+        result = ControlGroupSnapshot()
+        read = self.read
+        data = read('cpu_usage')
+        if data is not None:
+            result.cpu_usage = parse_value(data)
+        data = read('cpu_stat')
+        if data is not None:
+            stats = parse_keys(data)
+            if b'user' in stats and b'system' in stats:
+                result.cpu_user = int(stats[b'user']) * 10**9 // self.user_hz
+                result.cpu_system = int(stats[b'system']) * 10**9 // self.user_hz
+        data = read('cpus_usage')
+        if data is not None:
+            result.cpus_usage = parse_values(data)
+        data = read('memory_usage')
+        if data is not None:
+            result.memory_usage = parse_value(data)
+        data = read('memory_max_usage')
+        if data is not None:
+            value = parse_value(data)
+            if value is not None:
+                result.memory_max_usage = max(result.memory_usage or 0, value)
+        if result.memory_usage is not None:
+            data = read('memsw_usage')
+            if data is not None:
+                value = parse_value(data)
+                if value is not None:
+                    result.swap_usage = max(0, value - result.memory_usage)
+            if result.memory_max_usage is not None:
+                data = read('memsw_max_usage')
+                if data is not None:
+                    value = parse_value(data)
+                    if value is not None:
+                        result.swap_max_usage = max(result.swap_usage or 0, value - result.memory_max_usage)
+        data = read('memory_failures')
+        if data is not None:
+            result.memory_failures = parse_value(data)
+        data = read('pids_usage')
+        if data is not None:
+            result.pids_usage = parse_value(data)
+        data = read('pids_events')
+        if data is not None:
+            value = parse_keys(data).get(b'max')
+            if value is not None:
+                result.pids_failures = int(value)
+        return result
+
+    def unified_sample(self):
+        result = ControlGroupSnapshot()
+        read = self.read
+        data = read('cpu_stat')
+        if data is not None:
+            stats = parse_keys(data)
+            if b'usage_usec' in stats:
+                result.cpu_usage = int(stats[b'usage_usec']) * 1000
+                result.cpu_user = int(stats[b'user_usec']) * 1000
+                result.cpu_system = int(stats[b'system_usec']) * 1000
+        for key in [ 'memory_usage', 'memory_max_usage', 'swap_usage', 'swap_max_usage', 'pids_usage' ]:
+            data = read(key)
+            if data is not None:
+                setattr(result, key, parse_value(data))
+        data = read('memory_events')
+        if data is not None:
+            stats = parse_keys(data)
+            if b'max' in stats:
+                result.memory_failures = int(stats[b'max']) + int(stats.get(b'oom', 0))
+        data = read('pids_events')
+        if data is not None:
+            value = parse_keys(data).get(b'max')
+            if value is not None:
+                result.pids_failures = int(value)
+        return result
+
+    def stats(self):
+        return self.sample().stats()
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 class ControlGroupSystem:
     def __init__(self):
         assert os.path.exists('/proc/cgroups')
@@ -21,9 +217,12 @@ class ControlGroupSystem:
                     available_groups.add(cgroup)
 
         self.mount_points = dict()
+        self.unified = None
         with open('/proc/mounts') as mounts_file:
             for line in mounts_file.readlines():
                 dev, path, fs, opts, _, _ = re.split(r'\s+', line.strip()) 
+                if fs == 'cgroup2':
+                    self.unified = path
                 if fs == 'cgroup':
                     groups = opts.split(',')
                     named=False
@@ -39,6 +238,21 @@ class ControlGroupSystem:
                                 logging.debug(f'Found \'{group}\' control group at mount point \'{path}\'')
                                 self.mount_points[group] = path
 
+        self.version = settings.CGROUP_VERSION
+        if self.version is None:
+            self.version = 2 if self.unified is not None and not [ group for group in self.mount_points if group in available_groups ] else 1
+        if self.version == 2:
+            assert self.unified is not None
+            self.mount_points = dict()
+            with open(os.path.join(self.unified, 'cgroup.controllers')) as controllers_file:
+                controllers = controllers_file.readline().split()
+            for controller in controllers:
+                for group in UNIFIED_CONTROLLERS.get(controller, [ controller ]):
+                    self.mount_points[group] = self.unified
+            for group in UNIFIED_GROUPS:
+                self.mount_points[group] = self.unified
+            logging.debug(f'Using unified control group hierarchy at mount point \'{self.unified}\' with groups {sorted(self.mount_points)}')
+
     def mount_point(self, group):
         assert group in self.mount_points
         return self.mount_points[group]
@@ -51,7 +265,12 @@ class ControlGroupSystem:
         result = dict()
         with open(cgroups_path) as cgroups_file:
             for line in cgroups_file.readlines():
-                num, groups, path, = re.split(r':', line.strip())
+                num, groups, path, = re.split(r':', line.strip(), maxsplit=2)
+                if self.version == 2:
+                    if num == '0' and groups == '':
+                        for group in self.mount_points:
+                            result[group] = path
+                    continue
                 for group in re.split(r',', groups):
                     result[group] = path
         return result
@@ -76,8 +295,12 @@ class ControlGroupSystem:
                     cpuset.add(cpu)
         return cpuset
 
+    @property
+    def cpuset_file(self):
+        return 'cpuset.cpus.effective' if self.version == 2 else 'cpuset.cpus'
+
     def groups_cpuset(self, groups):
-        with open(os.path.join(self.mount_point('cpuset'), groups['cpuset'].strip('/'), 'cpuset.cpus')) as cpuset_file:
+        with open(os.path.join(self.mount_point('cpuset'), groups['cpuset'].strip('/'), self.cpuset_file)) as cpuset_file:
             return self.parse_cpuset(cpuset_file.readline().strip())
 
     def full_cpuset(self):
@@ -99,77 +322,24 @@ class ControlGroupSystem:
         cpus_offset %= len(cpuset)
         return set((2*cpuset)[cpus_offset:cpus_offset+cpus])
 
+    def read_keys(self, path):
+        with open(path) as f:
+            return dict([ line.strip().split()[0:2] for line in f.readlines() if line.strip() ])
+
+    def groups_reader(self, groups):
+        return ControlGroupReader(self, groups)
+
+    def pid_reader(self, pid=None):
+        if pid is None:
+            pid = os.getpid()
+        return self.groups_reader(self.pid_groups(pid))
+
+    def name_reader(self, name):
+        return self.groups_reader(self.name_groups(name))
+
     def groups_stats(self, groups):
-        result = KolejkaStats()
-        if 'cpuacct' in groups and 'cpuacct' in self.mount_points:
-            user_hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
-            total = 0
-            stats = { 'user' : 0, 'system' : 0 }
-            try:
-                usage_file = os.path.join(self.mount_point('cpuacct'), groups['cpuacct'].strip('/'), 'cpuacct.usage')
-                with open(usage_file) as f:
-                    total = 10**-9*float(f.readline().strip())
-            except:
-                pass
-            try:
-                usage_file = os.path.join(self.mount_point('cpuacct'), groups['cpuacct'].strip('/'), 'cpuacct.stat')
-                with open(usage_file) as f:
-                    stats = dict([line.strip().split() for line in f.readlines()])
-            except:
-                pass
-            result.cpu = KolejkaStats.CpusStats(usage = total, user = float(stats['user'])/user_hz, system = float(stats['system'])/user_hz)
-            usage_file = os.path.join(self.mount_point('cpuacct'), groups['cpuacct'].strip('/'), 'cpuacct.usage_percpu')
-            try:
-                with open(usage_file) as f:
-                    cpusplit = f.readline().strip().split()
-                for i,c in zip(range(len(cpusplit)), cpusplit):
-                    result.cpus[str(i)] = KolejkaStats.CpusStats(usage = 10**-9*float(c))
-            except:
-                pass
-        if 'memory' in groups and 'memory' in self.mount_points:
-            try:
-                usage_file = os.path.join(self.mount_point('memory'), groups['memory'].strip('/'), 'memory.usage_in_bytes')
-                with open(usage_file) as f:
-                    result.memory.usage = int(f.readline().strip())
-            except:
-                pass
-            try:
-                usage_file = os.path.join(self.mount_point('memory'), groups['memory'].strip('/'), 'memory.max_usage_in_bytes')
-                with open(usage_file) as f:
-                    result.memory.max_usage = max(result.memory.usage, int(f.readline().strip()))
-            except:
-                pass
-            try:
-                usage_file = os.path.join(self.mount_point('memory'), groups['memory'].strip('/'), 'memory.memsw.usage_in_bytes')
-                with open(usage_file) as f:
-                    result.memory.swap = max(0, int(f.readline().strip()) - result.memory.usage)
-            except:
-                pass
-            try:
-                usage_file = os.path.join(self.mount_point('memory'), groups['memory'].strip('/'), 'memory.memsw.max_usage_in_bytes')
-                with open(usage_file) as f:
-                    result.memory.max_swap = max(result.memory.swap, int(f.readline().strip()) - result.memory.max_usage)
-            except:
-                pass
-            try:
-                usage_file = os.path.join(self.mount_point('memory'), groups['memory'].strip('/'), 'memory.failcnt')
-                with open(usage_file) as f:
-                    result.memory.failures = int(f.readline().strip())
-            except:
-                pass
-        if 'pids' in groups and 'pids' in self.mount_points:
-            usage_file = os.path.join(self.mount_point('pids'), groups['pids'].strip('/'), 'pids.current')
-            with open(usage_file) as f:
-                result.pids.usage = int(f.readline().strip())
-            try:
-                usage_file = os.path.join(self.mount_point('pids'), groups['pids'].strip('/'), 'pids.events')
-                with open(usage_file) as f:
-                    stats = dict([line.strip().split() for line in f.readlines()])
-                    result.pids.failures = int(stats['max'])
-            except:
-                pass
-        result.update(KolejkaStats())
-        return result
+        with self.groups_reader(groups) as reader:
+            return reader.stats()
 
     def pid_stats(self, pid=None):
         if pid is None:
@@ -179,7 +349,37 @@ class ControlGroupSystem:
     def name_stats(self, name):
         return self.groups_stats(self.name_groups(name))
 
+    def unified_close(self, path):
+        parent_path = os.path.dirname(path)
+        dst_paths = [ os.path.join(parent_path, settings.OBSERVER_CGROUP_LEAF, 'cgroup.procs'), os.path.join(parent_path, 'cgroup.procs') ]
+        dst_paths = [ dst_path for dst_path in dst_paths if os.path.exists(dst_path) ]
+        for d, _, _ in os.walk(path, topdown=False):
+            group_list_file = os.path.join(path, d, 'cgroup.procs')
+            if os.path.exists(group_list_file):
+                with open(group_list_file) as src_file:
+                    pids = src_file.read().split()
+                for pid in pids:
+                    for dst_path in dst_paths:
+                        try:
+                            with open(dst_path, 'w') as dst_file:
+                                dst_file.write(pid)
+                            break
+                        except ProcessLookupError:
+                            break
+                        except OSError as e:
+                            logging.debug(f'Failed to move process {pid} to {dst_path}: {e}')
+                    else:
+                        logging.warning(f'Failed to move process {pid} out of {path}')
+            os.rmdir(os.path.join(path, d))
+
     def groups_close(self, groups):
+        if self.version == 2:
+            for path in set([ os.path.join(self.mount_point(group), path.strip('/')) for group, path in groups.items() if group in self.mount_points ]):
+                try:
+                    self.unified_close(path)
+                except:
+                    traceback.print_exc()
+            return
         for group in sorted(groups, key=lambda x: 1 if x == 'freezer' else 0):
             if group in self.mount_points:
                 try:
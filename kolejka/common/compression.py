@@ -0,0 +1,107 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+def available_encodings():
+    encodings = list()
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+def compressor(encoding, level=None):
+    if encoding == 'gzip':
+        return zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+    raise ValueError(f'Unsupported encoding {encoding}')
+
+def decompressor(encoding):
+    if encoding == 'gzip':
+        return zlib.decompressobj(31)
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f'Unsupported encoding {encoding}')
+
+class DecompressionLimitExceeded(ValueError):
+    pass
+
+class ZlibDecodeWriter:
+    def __init__(self, decoder, write, buffer_size):
+        self.decoder = decoder
+        self.output = write
+        self.buffer_size = buffer_size
+
+    def write(self, data):
+        while True:
+            chunk = self.decoder.decompress(data, self.buffer_size)
+            if chunk:
+                self.output(chunk)
+            data = self.decoder.unconsumed_tail
+            if not data and len(chunk) < self.buffer_size:
+                break
+
+    def flush(self):
+        chunk = self.decoder.flush()
+        if chunk:
+            self.output(chunk)
+
+class DecodeSink:
+    def __init__(self, write):
+        self.output = write
+
+    def write(self, data):
+        self.output(data)
+        return len(data)
+
+class ZstdDecodeWriter:
+    def __init__(self, write, buffer_size):
+        self.writer = zstandard.ZstdDecompressor().stream_writer(DecodeSink(write), write_size=buffer_size)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def flush(self):
+        self.writer.flush()
+
+def decode_writer(encoding, write, buffer_size=1024*1024):
+    if encoding == 'gzip':
+        return ZlibDecodeWriter(zlib.decompressobj(31), write, buffer_size)
+    if encoding == 'zstd' and zstandard is not None:
+        return ZstdDecodeWriter(write, buffer_size)
+    raise ValueError(f'Unsupported encoding {encoding}')
+
+def file_chunks(path, buffer_size=4*1024*1024):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(buffer_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+def encode_chunks(chunks, encoding, level=None):
+    encoder = compressor(encoding, level)
+    for chunk in chunks:
+        data = encoder.compress(chunk)
+        if data:
+            yield data
+    data = encoder.flush()
+    if data:
+        yield data
+
+def decode_chunks(chunks, encoding):
+    decoder = decompressor(encoding)
+    for chunk in chunks:
+        data = decoder.decompress(chunk)
+        if data:
+            yield data
+    data = decoder.flush()
+    if data:
+        yield data
@@ -68,6 +68,10 @@ class KolejkaConfig:
         self.client.__setattr__('server', client_config.get('server', default_config.get('server', None) or settings.CONFIG_SERVER))
         self.client.__setattr__('username', client_config.get('username', default_config.get('username', None)))
         self.client.__setattr__('password', client_config.get('password', default_config.get('password', None)))
+        self.client.__setattr__('transfer_workers', parse_int(client_config.get('transfer_workers', default_config.get('transfer_workers', None) or settings.CLIENT_TRANSFER_WORKERS)))
+        self.client.__setattr__('upload_chunk_size', parse_memory(client_config.get('upload_chunk_size', default_config.get('upload_chunk_size', None) or settings.CLIENT_UPLOAD_CHUNK_SIZE)))
+        self.client.__setattr__('compression', client_config.get('compression', default_config.get('compression', None) or settings.CLIENT_COMPRESSION))
+        self.client.__setattr__('bundle', parse_bool(client_config.get('bundle', default_config.get('bundle', None) or settings.CLIENT_BUNDLE)))
         self.client.__setattr__('cpus', parse_int(client_config.get('cpus', default_config.get('cpus', None))))
         self.client.__setattr__('memory', parse_memory(client_config.get('memory', default_config.get('memory', None))))
         self.client.__setattr__('swap', parse_memory(client_config.get('swap', default_config.get('swap', None))))
@@ -76,6 +80,7 @@ class KolejkaConfig:
         self.client.__setattr__('workspace', parse_memory(client_config.get('workspace', default_config.get('workspace', None))))
         self.client.__setattr__('pids', parse_int(client_config.get('pids', default_config.get('pids', None))))
         self.client.__setattr__('time', parse_time(client_config.get('time', default_config.get('time', None))))
+        self.client.__setattr__('cpu_time', parse_time(client_config.get('cpu_time', default_config.get('cpu_time', None))))
         self.client.__setattr__('network', parse_bool(client_config.get('network', default_config.get('network', None))))
         self.client.__setattr__('gpus', parse_int(client_config.get('gpus', default_config.get('gpus', None))))
         self.client.__setattr__('gpu_memory', parse_memory(client_config.get('gpu_memory', default_config.get('gpu_memory', None))))
@@ -86,7 +91,13 @@ class KolejkaConfig:
 
         self.foreman.__setattr__('temp_path', foreman_config.get('temp', default_config.get('temp', None)))
         self.foreman.__setattr__('interval', parse_float(foreman_config.get('interval', default_config.get('interval', None) or settings.FOREMAN_INTERVAL)))
+        self.foreman.__setattr__('dequeue_timeout', parse_float(foreman_config.get('dequeue_timeout', default_config.get('dequeue_timeout', None) or settings.FOREMAN_DEQUEUE_TIMEOUT)))
         self.foreman.__setattr__('concurency', parse_int(foreman_config.get('concurency', default_config.get('concurency', None) or settings.FOREMAN_CONCURENCY)))
+        prefetch = foreman_config.get('prefetch', default_config.get('prefetch', None))
+        self.foreman.__setattr__('prefetch', parse_int(prefetch if prefetch is not None else settings.FOREMAN_PREFETCH))
+        self.foreman.__setattr__('staging', parse_memory(foreman_config.get('staging', default_config.get('staging', None) or settings.FOREMAN_STAGING)))
+        self.foreman.__setattr__('cache', foreman_config.get('cache', default_config.get('cache', None)))
+        self.foreman.__setattr__('cache_size', parse_memory(foreman_config.get('cache_size', default_config.get('cache_size', None) or settings.FOREMAN_CACHE_SIZE)))
         self.foreman.__setattr__('pull', parse_bool(foreman_config.get('pull', default_config.get('pull', None) or False)))
         self.foreman.__setattr__('cpus', parse_int(foreman_config.get('cpus', default_config.get('cpus', None))))
         self.foreman.__setattr__('memory', parse_memory(foreman_config.get('memory', default_config.get('memory', None))))
@@ -96,6 +107,7 @@ class KolejkaConfig:
         self.foreman.__setattr__('workspace', parse_memory(foreman_config.get('workspace', default_config.get('workspace', None))))
         self.foreman.__setattr__('pids', parse_int(foreman_config.get('pids', default_config.get('pids', None))))
         self.foreman.__setattr__('time', parse_time(foreman_config.get('time', default_config.get('time', None))))
+        self.foreman.__setattr__('cpu_time', parse_time(foreman_config.get('cpu_time', default_config.get('cpu_time', None))))
         self.foreman.__setattr__('network', parse_bool(foreman_config.get('network', default_config.get('network', None))))
         self.foreman.__setattr__('auto_tags', parse_bool(foreman_config.get('auto_tags', default_config.get('auto_tags', []))))
         tags = parse_str_list(foreman_config.get('tags', default_config.get('tags', None) or []))
@@ -123,6 +135,7 @@ class KolejkaConfig:
         self.worker.__setattr__('workspace', parse_memory(worker_config.get('workspace', default_config.get('workspace', None))))
         self.worker.__setattr__('pids', parse_int(worker_config.get('pids', default_config.get('pids', None))))
         self.worker.__setattr__('time', parse_time(worker_config.get('time', default_config.get('time', None))))
+        self.worker.__setattr__('cpu_time', parse_time(worker_config.get('cpu_time', default_config.get('cpu_time', None))))
         self.worker.__setattr__('network', parse_bool(worker_config.get('network', default_config.get('network', None))))
         self.worker.__setattr__('gpus', parse_int(worker_config.get('gpus', default_config.get('gpus', None))))
         self.worker.__setattr__('perf_instructions', parse_bigint(worker_config.get('perf_instructions', default_config.get('perf_instructions', None))))
@@ -0,0 +1,89 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_event = struct.Struct('iIII')
+
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    libc.inotify_init1.argtypes = [ ctypes.c_int ]
+    libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+    libc.inotify_rm_watch.argtypes = [ ctypes.c_int, ctypes.c_int ]
+    return libc
+
+try:
+    libc = _libc()
+except OSError:
+    libc = None
+
+def inotify_available():
+    return libc is not None
+
+class Inotify:
+    def __init__(self):
+        if libc is None:
+            raise OSError('inotify is not available')
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = dict()
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=IN_MODIFY):
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        if self.watches.pop(wd, None) is not None:
+            libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        events = list()
+        while True:
+            try:
+                data = os.read(self.fd, 64*1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset + _event.size <= len(data):
+                wd, mask, cookie, length = _event.unpack_from(data, offset)
+                offset += _event.size + length
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                events.append((wd, mask))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -57,6 +57,7 @@ class KolejkaLimits:
         self.image = parse_memory(args.get('image', None))
         self.workspace = parse_memory(args.get('workspace', None))
         self.time = parse_time(args.get('time', None))
+        self.cpu_time = parse_time(args.get('cpu_time', None))
         self.gpus = parse_int(args.get('gpus', None))
         self.gpus_offset = parse_int(args.get('gpus_offset', None))
         self.gpu_memory = parse_memory(args.get('gpu_memory', None))
@@ -90,6 +91,8 @@ class KolejkaLimits:
             res['workspace'] = unparse_memory(self.workspace)
         if self.time is not None:
             res['time'] = unparse_time(self.time)
+        if self.cpu_time is not None:
+            res['cpu_time'] = unparse_time(self.cpu_time)
         if self.gpus is not None:
             res['gpus'] = self.gpus
         if self.gpus_offset is not None:
@@ -117,6 +120,7 @@ class KolejkaLimits:
         self.image = min_none(self.image, other.image)
         self.workspace = min_none(self.workspace, other.workspace)
         self.time = min_none(self.time, other.time)
+        self.cpu_time = min_none(self.cpu_time, other.cpu_time)
         self.gpus = min_none_is_min(self.gpus, other.gpus)
         self.gpus_offset = min_none(self.gpus_offset, other.gpus_offset)
         self.gpu_memory = min_none(self.gpu_memory, other.gpu_memory)
@@ -294,16 +298,20 @@ class KolejkaStats:
             args.update(kwargs)
             self.instructions = parse_int(args.get('instructions', None))
             self.cycles = parse_int(args.get('cycles', None))
+            self.overrun = parse_int(args.get('overrun', None))
         def dump(self):
             res = dict()
             if self.instructions is not None:
                 res['instructions'] = self.instructions
             if self.cycles is not None:
                 res['cycles'] = self.cycles
+            if self.overrun is not None:
+                res['overrun'] = self.overrun
             return res
         def update(self, other):
             self.instructions = max_none(self.instructions, other.instructions)
             self.cycles = max_none(self.cycles, other.cycles)
+            self.overrun = max_none(self.overrun, other.overrun)
         def copy(self, other):
             self.load(other.dump())
 
@@ -330,6 +338,8 @@ class KolejkaStats:
         self.perf = KolejkaStats.PerfStats()
         self.perf.load(args.get('perf', {}))
         self.time = parse_time(args.get('time', None))
+        self.limit = args.get('limit', None)
+        self.overrun = parse_time(args.get('overrun', None))
         self.gpus = dict()
         for key, val in args.get('gpus', {}).items():
             try:
@@ -348,6 +358,10 @@ class KolejkaStats:
         res['perf'] = self.perf.dump()
         if self.time is not None:
             res['time'] = unparse_time(self.time)
+        if self.limit is not None:
+            res['limit'] = self.limit
+        if self.overrun is not None:
+            res['overrun'] = unparse_time(self.overrun)
         res['gpus'] = dict([(k, v.dump()) for k, v in self.gpus.items()])
         return res
 
@@ -365,6 +379,8 @@ class KolejkaStats:
         self.pids.update(other.pids)
         self.perf.update(other.perf)
         self.time = max_none(self.time, other.time)
+        self.limit = first_none(self.limit, other.limit)
+        self.overrun = max_none(self.overrun, other.overrun)
         for k,v in other.gpus.items():
             if k not in self.gpus:
                 self.gpus[k] = KolejkaStats.GpuStats()
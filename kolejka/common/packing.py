@@ -0,0 +1,144 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+from .limits import KolejkaLimits
+
+class KolejkaResources:
+    CONSUMABLE = [ 'cpus', 'memory', 'swap', 'pids', 'storage', 'workspace', 'gpus', 'perf_instructions', 'perf_cycles', 'cgroup_descendants' ]
+    BOUNDED = [ 'time', 'cpu_time', 'cgroup_depth' ]
+
+    def __init__(self, capacity, concurency=None):
+        self.capacity = KolejkaLimits()
+        self.capacity.copy(capacity)
+        self.concurency = concurency
+        self.used = dict([ (name, 0) for name in self.CONSUMABLE ])
+        self.images = dict()
+        self.count = 0
+        self.exclusive = False
+
+    def image_usage(self, images=None):
+        if images is None:
+            images = self.images
+        return sum([ max(sizes) for sizes in images.values() if sizes ], 0)
+
+    def image_usage_add(self, image, size):
+        sizes = self.images.get(image, [])
+        return max(max(sizes, default=0), size) - max(sizes, default=0)
+
+    @property
+    def available(self):
+        available = KolejkaLimits()
+        available.copy(self.capacity)
+        for name in self.CONSUMABLE:
+            value = getattr(self.capacity, name)
+            if value is not None:
+                setattr(available, name, value - self.used[name])
+        if self.capacity.image is not None:
+            available.image = self.capacity.image - self.image_usage()
+        return available
+
+    def fits(self, limits, image=None, exclusive=False):
+        if self.exclusive:
+            return False
+        if exclusive and self.count > 0:
+            return False
+        if self.concurency is not None and self.count >= self.concurency:
+            return False
+        capacity = self.capacity
+        for name in self.CONSUMABLE:
+            if name == 'gpus':
+                continue
+            if getattr(capacity, name) is not None:
+                value = getattr(limits, name)
+                if value is None or value > getattr(capacity, name) - self.used[name]:
+                    return False
+        for name in self.BOUNDED:
+            if getattr(capacity, name) is not None:
+                value = getattr(limits, name)
+                if value is None or value > getattr(capacity, name):
+                    return False
+        if limits.gpus is not None and limits.gpus > 0:
+            if capacity.gpus is None or limits.gpus > capacity.gpus - self.used['gpus']:
+                return False
+            if capacity.gpu_memory is not None and (limits.gpu_memory is None or limits.gpu_memory > capacity.gpu_memory):
+                return False
+        if capacity.network is not None:
+            if limits.network is None or (limits.network and not capacity.network):
+                return False
+        if capacity.image is not None:
+            if limits.image is None:
+                return False
+            if self.image_usage_add(image, limits.image) > capacity.image - self.image_usage():
+                return False
+        return True
+
+    def add(self, limits, image=None, exclusive=False):
+        for name in self.CONSUMABLE:
+            value = getattr(limits, name)
+            if value is not None:
+                self.used[name] += value
+        if limits.image is not None:
+            self.images.setdefault(image, list()).append(limits.image)
+        self.count += 1
+        self.exclusive = self.exclusive or bool(exclusive)
+
+    def remove(self, limits, image=None, exclusive=False):
+        for name in self.CONSUMABLE:
+            value = getattr(limits, name)
+            if value is not None:
+                self.used[name] -= value
+        if limits.image is not None and limits.image in self.images.get(image, []):
+            self.images[image].remove(limits.image)
+            if not self.images[image]:
+                del self.images[image]
+        self.count -= 1
+        if exclusive:
+            self.exclusive = False
+
+    def score(self, limits, image=None):
+        score = 0.0
+        for name in self.CONSUMABLE:
+            total = getattr(self.capacity, name)
+            value = getattr(limits, name)
+            if total and value:
+                score += float(value) / total
+        if self.capacity.image and limits.image:
+            score += float(self.image_usage_add(image, limits.image)) / self.capacity.image
+        return score
+
+    def task_fits(self, task):
+        return self.fits(task.limits, image=task.image, exclusive=task.exclusive)
+    def task_add(self, task):
+        self.add(task.limits, image=task.image, exclusive=task.exclusive)
+    def task_remove(self, task):
+        self.remove(task.limits, image=task.image, exclusive=task.exclusive)
+    def task_score(self, task):
+        return self.score(task.limits, image=task.image)
+
+def pack_tasks(resources, tasks, concurency=None, window=None):
+    if not isinstance(resources, KolejkaResources):
+        resources = KolejkaResources(resources, concurency=concurency)
+    tasks = list(tasks)
+    if window is not None:
+        tasks = tasks[0:window]
+    limits = [ task.limits for task in tasks ]
+    selected = set()
+    if len(tasks) > 0 and resources.fits(limits[0], image=tasks[0].image, exclusive=tasks[0].exclusive):
+        resources.add(limits[0], image=tasks[0].image, exclusive=tasks[0].exclusive)
+        selected.add(0)
+    while True:
+        best = None
+        for index, task in enumerate(tasks):
+            if index in selected or task.exclusive:
+                continue
+            if not resources.fits(limits[index], image=task.image):
+                continue
+            score = resources.score(limits[index], image=task.image)
+            if best is None or score > best[0]:
+                best = (score, index)
+        if best is None:
+            break
+        resources.add(limits[best[1]], image=tasks[best[1]].image)
+        selected.add(best[1])
+    return [ tasks[index] for index in sorted(selected) ]
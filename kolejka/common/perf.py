@@ -0,0 +1,133 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import ctypes
+import os
+import platform
+import struct
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+PERF_COUNT_HW_CPU_CYCLES = 0
+PERF_COUNT_HW_INSTRUCTIONS = 1
+PERF_COUNT_SW_TASK_CLOCK = 1
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FLAG_PID_CGROUP = 1 << 2
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+PERF_ATTR_INHERIT = 1 << 1
+PERF_ATTR_EXCLUDE_HV = 1 << 6
+PERF_ATTR_SIZE = 112
+
+PERF_EVENTS = {
+    'instructions' : (PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS),
+    'cycles' : (PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES),
+}
+
+_syscall_numbers = {
+    'x86_64' : 298,
+    'aarch64' : 241,
+    'ppc64le' : 319,
+    's390x' : 331,
+    'i686' : 336,
+}
+
+_value = struct.Struct('QQQ')
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.syscall.restype = ctypes.c_long
+except OSError:
+    _libc = None
+_syscall_number = _syscall_numbers.get(platform.machine())
+
+def perf_available():
+    return _libc is not None and _syscall_number is not None
+
+def perf_event_open(event_type, config, pid=0, cpu=-1, flags=0, inherit=False):
+    if not perf_available():
+        raise OSError('perf_event_open is not available')
+    attr = ctypes.create_string_buffer(PERF_ATTR_SIZE)
+    attr_flags = PERF_ATTR_EXCLUDE_HV | (PERF_ATTR_INHERIT if inherit else 0)
+    struct.pack_into('IIQQQQQ', attr, 0, event_type, PERF_ATTR_SIZE, config, 0, 0, PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING, attr_flags)
+    fd = _libc.syscall(ctypes.c_long(_syscall_number), attr, ctypes.c_int(pid), ctypes.c_int(cpu), ctypes.c_int(-1), ctypes.c_ulong(flags | PERF_FLAG_FD_CLOEXEC))
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+def perf_event_read(fd):
+    value, enabled, running = _value.unpack(os.read(fd, _value.size))
+    if running == 0:
+        return 0
+    if running < enabled:
+        return int(value * enabled / running)
+    return value
+
+class PerfCounters:
+    def __init__(self, events=PERF_EVENTS):
+        self.events = dict(events)
+        self.fds = dict([ (name, list()) for name in self.events ])
+        self.offset = dict([ (name, 0) for name in self.events ])
+        self.path = None
+        self.cpus = None
+
+    @classmethod
+    def cgroup(cls, path, cpus=None, events=PERF_EVENTS):
+        counters = cls(events)
+        if cpus is None:
+            cpus = range(os.cpu_count() or 1)
+        counters.path = path
+        counters.cpus = sorted(cpus)
+        group_fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            for name, (event_type, config) in counters.events.items():
+                error = None
+                for cpu in cpus:
+                    try:
+                        counters.fds[name].append(perf_event_open(event_type, config, pid=group_fd, cpu=cpu, flags=PERF_FLAG_PID_CGROUP))
+                    except OSError as e:
+                        error = e
+                if not counters.fds[name] and error is not None:
+                    raise error
+        except:
+            counters.close()
+            raise
+        finally:
+            os.close(group_fd)
+        return counters
+
+    @classmethod
+    def process(cls, pid=0, events=PERF_EVENTS):
+        counters = cls(events)
+        try:
+            for name, (event_type, config) in counters.events.items():
+                counters.fds[name].append(perf_event_open(event_type, config, pid=pid, cpu=-1, inherit=True))
+        except:
+            counters.close()
+            raise
+        return counters
+
+    def read(self):
+        return dict([ (name, sum([ perf_event_read(fd) for fd in fds ], self.offset[name])) for name, fds in self.fds.items() ])
+
+    def restrict(self, cpus):
+        assert self.path is not None
+        cpus = sorted(cpus)
+        if cpus == self.cpus:
+            return
+        counters = PerfCounters.cgroup(self.path, cpus, self.events)
+        start = counters.read()
+        counts = self.read()
+        self.close()
+        self.fds = counters.fds
+        self.offset = dict([ (name, counts[name] - start[name]) for name in self.events ])
+        self.cpus = cpus
+
+    def close(self):
+        for fds in self.fds.values():
+            for fd in fds:
+                os.close(fd)
+        self.fds = dict([ (name, list()) for name in self.events ])
+        self.offset = dict([ (name, 0) for name in self.events ])
@@ -13,10 +13,34 @@ CONFIG_FILE = 'kolejka.conf'
 
 CONFIG_SERVER = 'https://kolejka.matinf.uj.edu.pl/kolejka'
 
+CLIENT_TRANSFER_WORKERS = 8
+
+CLIENT_UPLOAD_CHUNK_SIZE = 64*1024*1024
+
+CLIENT_COMPRESSION = None
+
+CLIENT_BUNDLE = False
+
+BUNDLE_BUFFER_SIZE = 4*1024*1024
+
+TASK_BUNDLE = 'kolejka_bundle.tar'
+
+CGROUP_VERSION = None
+
+CGROUP_CPU_PERIOD = 100000
+
 OBSERVER_CGROUPS = [ 'memory', 'cpuacct', 'pids', 'perf_event', 'blkio', 'cpuset', 'freezer' ]
 
+OBSERVER_CGROUP_LEAF = 'kolejka_observer_leaf'
+
 OBSERVER_PID_FILE = '/var/run/kolejka/observer/pid'
 
+OBSERVER_REAP_INTERVAL = 1
+
+OBSERVER_CPU_TIME_INTERVAL = 0.005
+
+OBSERVER_PERF_INTERVAL = 0.1
+
 OBSERVER_SERVERSTRING = 'Kolejka Observer Daemon'
 
 OBSERVER_SOCKET = '/var/run/kolejka/observer/socket'
@@ -38,3 +62,12 @@ WORKER_RESERVED_DISK_SIZE = 1024*1024
 FOREMAN_CONCURENCY = 8
 
 FOREMAN_INTERVAL = 10
+
+FOREMAN_DEQUEUE_TIMEOUT = 60
+
+FOREMAN_PREFETCH = 2
+
+#Disk space limit for tasks downloaded ahead of execution, including fetches in progress
+FOREMAN_STAGING = 4*1024*1024*1024
+
+FOREMAN_CACHE_SIZE = 16*1024*1024*1024
@@ -82,6 +82,7 @@ class KolejkaFiles:
             self.name = name
             self.path = data.get('path', None)
             self.reference = data.get('reference', None)
+            self.blob = data.get('blob', None)
 
         def dump(self):
             res = dict()
@@ -89,6 +90,8 @@ class KolejkaFiles:
                 res['path'] = self.path
             if self.reference is not None:
                 res['reference'] = self.reference
+            if self.blob is not None:
+                res['blob'] = self.blob
             return res
 
         def is_local(self):
@@ -182,6 +185,7 @@ class KolejkaTask():
         self.image = parse_str(args.get('image', None))
         self.requires = args.get('requires', [])
         self.exclusive = parse_bool(args.get('exclusive', None))
+        self.priority = parse_int(args.get('priority', None))
         self.limits = KolejkaLimits()
         self.limits.load(args.get('limits', {}))
         self.environment = dict()
@@ -193,6 +197,7 @@ class KolejkaTask():
         self.stderr = parse_str(args.get('stderr', None))
         self.files = KolejkaFiles(self.path)
         self.files.load(args.get('files', {}))
+        self.bundle = parse_str(args.get('bundle', None))
         self.collect = KolejkaCollect()
         self.collect.load(args.get('collect', []))
         self.callback_url = parse_str(args.get('callback_url', None))
@@ -206,6 +211,8 @@ class KolejkaTask():
         res['requires'] = copy.copy(self.requires)
         if self.exclusive is not None:
             res['exclusive'] = self.exclusive
+        if self.priority is not None:
+            res['priority'] = self.priority
         res['limits'] = self.limits.dump()
         res['environment'] = copy.copy(self.environment)
         res['args'] = copy.copy(self.args)
@@ -216,6 +223,8 @@ class KolejkaTask():
         if self.stderr is not None:
             res['stderr'] = self.stderr
         res['files'] = self.files.dump()
+        if self.bundle is not None:
+            res['bundle'] = self.bundle
         res['collect'] = self.collect.dump()
         if self.callback_url is not None:
             res['callback_url'] = self.callback_url
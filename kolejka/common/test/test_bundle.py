@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import time
+import unittest
+
+from kolejka.common import KolejkaTask
+from kolejka.common.bundle import bundle_create, bundle_extract
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = self.temp.name
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def task(self, name, files):
+        task = KolejkaTask(os.path.join(self.path, name))
+        for key, content in files.items():
+            file_path = os.path.join(task.path, key)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(content)
+            task.files.add(key)
+        return task
+
+    def digest(self, path):
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def test_roundtrip(self):
+        files = { 'run.sh' : b'#!/bin/sh\n', 'data/input' : b'input' }
+        task = self.task('task', files)
+        os.chmod(os.path.join(task.path, 'run.sh'), 0o755)
+        bundle_path = os.path.join(self.path, settings.TASK_BUNDLE)
+        bundle_create(bundle_path, task.files)
+        target = os.path.join(self.path, 'target')
+        self.assertEqual(sorted(bundle_extract(bundle_path, target)), sorted(files.keys()))
+        for key, content in files.items():
+            with open(os.path.join(target, key), 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertTrue(os.access(os.path.join(target, 'run.sh'), os.X_OK))
+        self.assertFalse(os.access(os.path.join(target, 'data/input'), os.X_OK))
+
+    def test_deterministic(self):
+        files = { 'a' : b'a', 'b/c' : b'c' }
+        first = self.task('first', files)
+        time.sleep(0.01)
+        second = self.task('second', dict(reversed(list(files.items()))))
+        bundle_create(os.path.join(self.path, 'first.tar'), first.files)
+        bundle_create(os.path.join(self.path, 'second.tar'), second.files)
+        self.assertEqual(self.digest(os.path.join(self.path, 'first.tar')), self.digest(os.path.join(self.path, 'second.tar')))
+
+    def test_unsafe_members(self):
+        bundle_path = os.path.join(self.path, 'unsafe.tar')
+        with tarfile.open(bundle_path, 'w') as bundle:
+            for name in [ '../escape', '/absolute', 'a/../../escape', 'safe' ]:
+                info = tarfile.TarInfo(name)
+                info.size = 4
+                bundle.addfile(info, io.BytesIO(b'data'))
+            info = tarfile.TarInfo('link')
+            info.type = tarfile.SYMTYPE
+            info.linkname = '/etc/passwd'
+            bundle.addfile(info)
+        target = os.path.join(self.path, 'target')
+        self.assertEqual(sorted(bundle_extract(bundle_path, target)), [ 'absolute', 'safe' ])
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'escape')))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import hashlib
+import os
+import tempfile
+import unittest
+
+from kolejka.common.cache import KolejkaCache
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = self.temp.name
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def key(self, content):
+        return hashlib.sha256(content).hexdigest()
+
+    def test_get_put(self):
+        cache = KolejkaCache(os.path.join(self.path, 'cache'))
+        target = os.path.join(self.path, 'task', 'input')
+        key = self.key(b'data')
+        self.assertFalse(cache.get(key, target))
+        self.assertFalse(cache.get(None, target))
+        cache.put(key, self.write('source', b'data'))
+        self.assertTrue(cache.get(key, target))
+        self.assertEqual(self.read(target), b'data')
+        self.assertEqual(cache.usage(), 4)
+
+    def test_isolation(self):
+        cache = KolejkaCache(os.path.join(self.path, 'cache'))
+        key = self.key(b'data')
+        source = self.write('source', b'data')
+        os.chmod(source, 0o755)
+        cache.put(key, source)
+        self.assertEqual(os.stat(source).st_mode & 0o777, 0o755)
+        self.assertNotEqual(os.stat(source).st_ino, os.stat(cache.blob_path(key)).st_ino)
+        target = os.path.join(self.path, 'target')
+        self.assertTrue(cache.get(key, target))
+        self.assertNotEqual(os.stat(target).st_ino, os.stat(cache.blob_path(key)).st_ino)
+        with open(target, 'wb') as f:
+            f.write(b'evil')
+        self.assertTrue(cache.get(key, os.path.join(self.path, 'other')))
+        self.assertEqual(self.read(os.path.join(self.path, 'other')), b'data')
+
+    def test_corrupted(self):
+        cache = KolejkaCache(os.path.join(self.path, 'cache'))
+        key = self.key(b'data')
+        cache.put(key, self.write('source', b'data'))
+        os.chmod(cache.blob_path(key), 0o644)
+        with open(cache.blob_path(key), 'wb') as f:
+            f.write(b'evil')
+        target = os.path.join(self.path, 'target')
+        self.assertFalse(cache.get(key, target))
+        self.assertFalse(os.path.exists(target))
+        self.assertFalse(os.path.exists(cache.blob_path(key)))
+        self.assertEqual(cache.usage(), 0)
+
+    def test_lru_eviction(self):
+        cache = KolejkaCache(os.path.join(self.path, 'cache'), size=8)
+        a, b, c = self.key(b'aaaa'), self.key(b'bbbb'), self.key(b'cccc')
+        cache.put(a, self.write('a', b'aaaa'))
+        cache.put(b, self.write('b', b'bbbb'))
+        self.assertTrue(cache.get(a, os.path.join(self.path, 'x')))
+        cache.put(c, self.write('c', b'cccc'))
+        self.assertTrue(os.path.exists(cache.blob_path(a)))
+        self.assertFalse(os.path.exists(cache.blob_path(b)))
+        self.assertTrue(os.path.exists(cache.blob_path(c)))
+        self.assertLessEqual(cache.usage(), 8)
+
+    def test_existing_entries(self):
+        key = self.key(b'data')
+        KolejkaCache(os.path.join(self.path, 'cache')).put(key, self.write('source', b'data'))
+        os.unlink(os.path.join(self.path, 'cache', 'index.sqlite'))
+        cache = KolejkaCache(os.path.join(self.path, 'cache'))
+        self.assertEqual(cache.usage(), 4)
+        self.assertTrue(cache.get(key, os.path.join(self.path, 'target')))
+
+if __name__ == '__main__':
+    unittest.main()
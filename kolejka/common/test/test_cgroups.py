@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from kolejka.common.cgroups import ControlGroupSystem
+
+class TestUnified(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.system = ControlGroupSystem.__new__(ControlGroupSystem)
+        self.system.version = 2
+        self.system.unified = self.temp.name
+        self.system.mount_points = dict([ (group, self.temp.name) for group in [ 'cpu', 'cpuacct', 'memory', 'pids', 'freezer' ] ])
+        self.path = os.path.join(self.temp.name, 'session')
+        os.makedirs(self.path)
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.path, name), 'w') as f:
+            f.write(content)
+
+    def test_stats(self):
+        self.write('cpu.stat', 'usage_usec 3000000\nuser_usec 2000000\nsystem_usec 1000000\nnr_periods 0\n')
+        self.write('memory.current', '1048576\n')
+        self.write('memory.peak', '4194304\n')
+        self.write('memory.swap.current', '0\n')
+        self.write('memory.events', 'low 0\nhigh 0\nmax 2\noom 1\noom_kill 1\n')
+        self.write('pids.current', '3\n')
+        self.write('pids.events', 'max 5\n')
+        stats = self.system.groups_stats({ 'cpuacct' : '/session', 'memory' : '/session', 'pids' : '/session' })
+        self.assertEqual(stats.cpu.usage.total_seconds(), 3.0)
+        self.assertEqual(stats.cpu.user.total_seconds(), 2.0)
+        self.assertEqual(stats.memory.usage, 1048576)
+        self.assertEqual(stats.memory.max_usage, 4194304)
+        self.assertEqual(stats.memory.failures, 3)
+        self.assertEqual(stats.pids.usage, 3)
+        self.assertEqual(stats.pids.failures, 5)
+
+    def test_missing(self):
+        stats = self.system.groups_stats({ 'memory' : '/session' })
+        self.assertIsNone(stats.memory.usage)
+        self.assertIsNone(stats.cpu.usage)
+
+    def test_reader(self):
+        self.write('memory.current', '1048576\n')
+        self.write('pids.current', '3\n')
+        with self.system.groups_reader({ 'memory' : '/session', 'pids' : '/session' }) as reader:
+            self.assertEqual(reader.sample().memory_usage, 1048576)
+            self.write('memory.current', '2097152\n')
+            self.write('pids.current', '12\n')
+            sample = reader.sample()
+            self.assertEqual(sample.memory_usage, 2097152)
+            self.assertEqual(sample.pids_usage, 12)
+            self.assertIsNone(sample.cpu_usage)
+            self.assertIsNone(reader.cpu_usage())
+        self.assertEqual(reader.fds, {})
+
+    def test_close(self):
+        os.makedirs(os.path.join(self.path, 'child'))
+        self.system.groups_close({ 'memory' : '/session', 'pids' : '/session' })
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_close_busy_parent(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.write('cgroup.procs', '123\n')
+        leaf_path = os.path.join(self.temp.name, settings.OBSERVER_CGROUP_LEAF)
+        os.makedirs(leaf_path)
+        with open(os.path.join(leaf_path, 'cgroup.procs'), 'w') as f:
+            f.write('')
+        parent_procs = os.path.join(self.temp.name, 'cgroup.procs')
+        with open(parent_procs, 'w') as f:
+            f.write('')
+        real_open = open
+        def busy_open(path, mode='r', *args, **kwargs):
+            if path == parent_procs and 'w' in mode:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+            return real_open(path, mode, *args, **kwargs)
+        real_rmdir = os.rmdir
+        def cgroup_rmdir(path):
+            os.unlink(os.path.join(path, 'cgroup.procs'))
+            real_rmdir(path)
+        with mock.patch('builtins.open', busy_open), mock.patch('os.rmdir', cgroup_rmdir):
+            self.system.groups_close({ 'memory' : '/session', 'pids' : '/session' })
+        self.assertFalse(os.path.exists(self.path))
+        with open(os.path.join(leaf_path, 'cgroup.procs')) as f:
+            self.assertEqual(f.read(), '123')
+
+class TestLegacy(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.system = ControlGroupSystem.__new__(ControlGroupSystem)
+        self.system.version = 1
+        self.system.unified = None
+        self.system.mount_points = dict()
+        for group in [ 'cpuacct', 'memory', 'pids' ]:
+            self.system.mount_points[group] = os.path.join(self.temp.name, group)
+            os.makedirs(os.path.join(self.temp.name, group, 'session'))
+        self.groups = dict([ (group, '/session') for group in self.system.mount_points ])
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, group, name, content):
+        with open(os.path.join(self.temp.name, group, 'session', name), 'w') as f:
+            f.write(content)
+
+    def test_stats(self):
+        user_hz = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+        self.write('cpuacct', 'cpuacct.usage', '3000000000\n')
+        self.write('cpuacct', 'cpuacct.stat', f'user {2*user_hz}\nsystem {user_hz}\n')
+        self.write('cpuacct', 'cpuacct.usage_percpu', '1000000000 2000000000 \n')
+        self.write('memory', 'memory.usage_in_bytes', '1048576\n')
+        self.write('memory', 'memory.max_usage_in_bytes', '4194304\n')
+        self.write('memory', 'memory.memsw.usage_in_bytes', '1572864\n')
+        self.write('memory', 'memory.memsw.max_usage_in_bytes', '5242880\n')
+        self.write('memory', 'memory.failcnt', '2\n')
+        self.write('pids', 'pids.current', '3\n')
+        self.write('pids', 'pids.events', 'max 5\n')
+        stats = self.system.groups_stats(self.groups)
+        self.assertEqual(stats.cpu.usage.total_seconds(), 3.0)
+        self.assertEqual(stats.cpu.user.total_seconds(), 2.0)
+        self.assertEqual(stats.cpu.system.total_seconds(), 1.0)
+        self.assertEqual(stats.cpus['1'].usage.total_seconds(), 2.0)
+        self.assertEqual(stats.memory.usage, 1048576)
+        self.assertEqual(stats.memory.max_usage, 4194304)
+        self.assertEqual(stats.memory.swap, 524288)
+        self.assertEqual(stats.memory.max_swap, 1048576)
+        self.assertEqual(stats.memory.failures, 2)
+        self.assertEqual(stats.pids.usage, 3)
+        self.assertEqual(stats.pids.failures, 5)
+
+    def test_reader(self):
+        self.write('cpuacct', 'cpuacct.usage', '1000\n')
+        with self.system.groups_reader(self.groups) as reader:
+            self.assertEqual(reader.cpu_usage(), 10**-6)
+            self.write('cpuacct', 'cpuacct.usage', '2000000000\n')
+            self.assertEqual(reader.cpu_usage(), 2.0)
+            self.assertIsNone(reader.sample().memory_usage)
+
+    def test_clamping(self):
+        self.write('memory', 'memory.usage_in_bytes', '4194304\n')
+        self.write('memory', 'memory.max_usage_in_bytes', '1048576\n')
+        self.write('memory', 'memory.memsw.usage_in_bytes', '6291456\n')
+        self.write('memory', 'memory.memsw.max_usage_in_bytes', '5242880\n')
+        with self.system.groups_reader(self.groups) as reader:
+            sample = reader.sample()
+        self.assertEqual(sample.memory_max_usage, 4194304)
+        self.assertEqual(sample.swap_usage, 2097152)
+        self.assertEqual(sample.swap_max_usage, 2097152)
+
+if __name__ == '__main__':
+    unittest.main()
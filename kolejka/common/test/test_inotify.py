@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import os
+import select
+import tempfile
+import unittest
+
+from kolejka.common.inotify import Inotify, inotify_available, IN_IGNORED, IN_MODIFY
+
+@unittest.skipUnless(inotify_available(), 'inotify is not available')
+class TestInotify(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp.name, 'cgroup.events')
+        with open(self.path, 'w') as f:
+            f.write('populated 1\n')
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def test_modify(self):
+        with Inotify() as inotify:
+            wd = inotify.add_watch(self.path, IN_MODIFY)
+            self.assertEqual(inotify.read(), [])
+            with open(self.path, 'w') as f:
+                f.write('populated 0\n')
+            readable, _, _ = select.select([ inotify ], [], [], 1)
+            self.assertEqual(readable, [ inotify ])
+            events = inotify.read()
+            self.assertIn(wd, [ event_wd for event_wd, mask in events ])
+            self.assertTrue(all([ mask & IN_MODIFY for event_wd, mask in events if event_wd == wd ]))
+
+    def test_rm_watch(self):
+        with Inotify() as inotify:
+            wd = inotify.add_watch(self.path)
+            inotify.rm_watch(wd)
+            with open(self.path, 'w') as f:
+                f.write('populated 0\n')
+            self.assertEqual([ event for event in inotify.read() if event[0] == wd and not event[1] & IN_IGNORED ], [])
+
+    def test_missing(self):
+        with Inotify() as inotify:
+            with self.assertRaises(OSError):
+                inotify.add_watch(os.path.join(self.temp.name, 'missing'))
+
+if __name__ == '__main__':
+    unittest.main()
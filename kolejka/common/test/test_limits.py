@@ -19,5 +19,23 @@ class TestStats(unittest.TestCase):
         self.assertEqual(stats.cpu.system.total_seconds(), 5.0)
         self.assertEqual(stats.cpu.user.total_seconds(), 2.0)
 
+    def test_overrun(self):
+        stats = KolejkaStats(time='2s')
+        stats.update(KolejkaStats(time='2.003s', limit='time', overrun='3ms'))
+        dump = stats.dump()
+        self.assertEqual(dump['limit'], 'time')
+        stats = KolejkaStats()
+        stats.load(dump)
+        self.assertEqual(stats.limit, 'time')
+        self.assertAlmostEqual(stats.overrun.total_seconds(), 0.003)
+        self.assertNotIn('limit', KolejkaStats().dump())
+
+class TestLimits(unittest.TestCase):
+    def test_cpu_time(self):
+        limits = KolejkaLimits(time='10s', cpu_time='2s')
+        limits.update(KolejkaLimits(cpu_time='1500ms'))
+        self.assertEqual(limits.cpu_time.total_seconds(), 1.5)
+        self.assertEqual(KolejkaLimits(**limits.dump()).cpu_time.total_seconds(), 1.5)
+
 if __name__ == '__main__':
     unittest.main()
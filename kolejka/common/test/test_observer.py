@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+from kolejka.common.cgroups import ControlGroupSystem
+from kolejka.observer.server import Session, SessionMonitor
+
+class FakeSession:
+    def __init__(self, session_id, pid, close_time=None, events=[]):
+        self.id = session_id
+        self.creator_pid = pid
+        self.close_time = close_time
+        self.events = events
+        self.next_check = None
+        self.populated = True
+
+    def events_paths(self):
+        return self.events
+
+    def finished(self):
+        try:
+            with open(f'/proc/{self.creator_pid}/stat') as stat_file:
+                if stat_file.read().rsplit(')', 1)[1].split()[0] not in [ 'Z', 'X' ]:
+                    return False
+        except OSError:
+            pass
+        return not self.populated
+
+class FakeRegistry:
+    def __init__(self):
+        self.sessions = dict()
+        self.closed = dict()
+        self.monitor = SessionMonitor(self)
+
+    def cleanup_finished(self):
+        current_time = time.perf_counter()
+        for session_id, session in list(self.sessions.items()):
+            if (session.close_time is not None and session.close_time <= current_time) or session.finished():
+                self.monitor.unwatch(session_id)
+                del self.sessions[session_id]
+                self.closed[session_id] = current_time
+
+    def open(self, session):
+        self.sessions[session.id] = session
+        self.monitor.watch(session)
+        self.monitor.schedule(session)
+
+    def wait_closed(self, session_id, timeout=5):
+        deadline = time.perf_counter() + timeout
+        while session_id not in self.closed and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        return self.closed.get(session_id)
+
+class TestSessionMonitor(unittest.TestCase):
+    def setUp(self):
+        self.registry = FakeRegistry()
+        self.registry.monitor.start()
+        self.processes = list()
+
+    def tearDown(self):
+        self.registry.monitor.stop()
+        for process in self.processes:
+            process.kill()
+            process.wait()
+
+    def process(self):
+        process = subprocess.Popen(['sleep', '60'])
+        self.processes.append(process)
+        return process
+
+    def test_deadline(self):
+        process = self.process()
+        close_time = time.perf_counter() + 0.2
+        self.registry.open(FakeSession('deadline', process.pid, close_time=close_time))
+        closed = self.registry.wait_closed('deadline')
+        self.assertIsNotNone(closed)
+        self.assertGreaterEqual(closed, close_time)
+        self.assertLess(closed - close_time, 0.25)
+
+    def test_earlier_deadline(self):
+        process = self.process()
+        self.registry.open(FakeSession('late', process.pid, close_time=time.perf_counter() + 60))
+        close_time = time.perf_counter() + 0.1
+        self.registry.open(FakeSession('early', process.pid, close_time=close_time))
+        closed = self.registry.wait_closed('early')
+        self.assertLess(closed - close_time, 0.25)
+        self.assertIn('late', self.registry.sessions)
+
+    @unittest.skipUnless(hasattr(os, 'pidfd_open'), 'pidfd is not available')
+    def test_creator_exit(self):
+        process = self.process()
+        session = FakeSession('exit', process.pid)
+        session.populated = False
+        self.registry.open(session)
+        time.sleep(0.05)
+        self.assertIn('exit', self.registry.sessions)
+        killed = time.perf_counter()
+        process.kill()
+        process.wait()
+        closed = self.registry.wait_closed('exit')
+        self.assertIsNotNone(closed)
+        self.assertLess(closed - killed, 0.25)
+
+    @unittest.skipUnless(hasattr(os, 'pidfd_open'), 'pidfd is not available')
+    def test_events(self):
+        with tempfile.TemporaryDirectory() as temp:
+            events = os.path.join(temp, 'cgroup.events')
+            with open(events, 'w') as f:
+                f.write('populated 1\n')
+            process = self.process()
+            session = FakeSession('events', process.pid, events=[ events ])
+            self.registry.open(session)
+            process.kill()
+            process.wait()
+            time.sleep(0.05)
+            self.assertIn('events', self.registry.sessions)
+            emptied = time.perf_counter()
+            session.populated = False
+            with open(events, 'w') as f:
+                f.write('populated 0\n')
+            closed = self.registry.wait_closed('events')
+            self.assertIsNotNone(closed)
+            self.assertLess(closed - emptied, 0.25)
+
+class CpuTimeSession(Session):
+    def __init__(self, cpu_time, cpu_count):
+        self.id = 'cpu'
+        self.close_time = None
+        self.cpu_time = cpu_time
+        self.cpu_count = cpu_count
+        self.perf = None
+        self.perf_limits = dict()
+        self.perf_sample = None
+        self.perf_rates = dict()
+        self.next_check = None
+        self.limit = None
+        self.overrun = None
+        self.perf_overrun = None
+        self.usage = 0
+
+    def cpu_usage(self):
+        return self.usage
+
+    def kill(self):
+        pass
+
+class TestCpuTime(unittest.TestCase):
+    def test_adaptive(self):
+        session = CpuTimeSession(cpu_time=2.0, cpu_count=4)
+        self.assertIsNone(session.exceeded(100.0))
+        self.assertAlmostEqual(session.next_check, 100.5)
+        session.usage = 1.99
+        self.assertIsNone(session.exceeded(100.5))
+        self.assertAlmostEqual(session.next_check, 100.5 + settings.OBSERVER_CPU_TIME_INTERVAL)
+        session.usage = 2.004
+        self.assertEqual(session.exceeded(100.6), 'cpu_time')
+        session.enforce('cpu_time')
+        self.assertEqual(session.limit, 'cpu_time')
+        self.assertAlmostEqual(session.overrun.total_seconds(), 0.004)
+
+    def test_wall_time(self):
+        session = CpuTimeSession(cpu_time=None, cpu_count=1)
+        session.close_time = time.perf_counter() - 0.002
+        self.assertEqual(session.exceeded(time.perf_counter()), 'time')
+        session.enforce('time')
+        self.assertGreaterEqual(session.overrun.total_seconds(), 0.002)
+
+class FakeCounters:
+    def __init__(self):
+        self.counts = { 'instructions' : 0, 'cycles' : 0 }
+
+    def read(self):
+        return dict(self.counts)
+
+class TestPerfLimits(unittest.TestCase):
+    def test_instructions(self):
+        session = CpuTimeSession(cpu_time=None, cpu_count=1)
+        session.perf = FakeCounters()
+        session.perf_limits = { 'instructions' : 10**9 }
+        self.assertIsNone(session.exceeded(10.0))
+        self.assertAlmostEqual(session.next_check, 10.0 + settings.OBSERVER_CPU_TIME_INTERVAL)
+        session.perf.counts['instructions'] = 10**7
+        self.assertIsNone(session.exceeded(10.01))
+        self.assertAlmostEqual(session.next_check, 10.01 + settings.OBSERVER_PERF_INTERVAL)
+        session.perf.counts['instructions'] = 9*10**8
+        self.assertIsNone(session.exceeded(10.1))
+        self.assertAlmostEqual(session.next_check, 10.1 + 10**8 / (2 * 8.9 * 10**8 / 0.09))
+        session.perf.counts['instructions'] = 10**9 + 12345
+        self.assertEqual(session.exceeded(10.11), 'perf_instructions')
+        session.enforce('perf_instructions')
+        self.assertEqual(session.limit, 'perf_instructions')
+        self.assertIsNone(session.overrun)
+        self.assertEqual(session.perf_overrun, 12345)
+
+class UnifiedRegistry:
+    def __init__(self, path):
+        self.control_group_system = ControlGroupSystem.__new__(ControlGroupSystem)
+        self.control_group_system.version = 2
+        self.control_group_system.unified = path
+        self.control_group_system.mount_points = dict([ (group, path) for group in [ 'cpuacct', 'memory', 'pids', 'freezer' ] ])
+
+class TestUnifiedSession(unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.registry = UnifiedRegistry(self.temp.name)
+        self.parent = os.path.join(self.temp.name, 'worker')
+        os.makedirs(self.parent)
+        with open(os.path.join(self.parent, 'cgroup.procs'), 'w') as f:
+            f.write('100\n')
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def session(self, parent='/worker'):
+        session = Session.__new__(Session)
+        session.registry = self.registry
+        session.id = 'unified'
+        session.parent_groups = dict([ (group, parent) for group in [ 'cpuacct', 'memory', 'pids', 'freezer' ] ])
+        session.groups = dict([ (group, os.path.join(path, session.group_name)) for group, path in session.parent_groups.items() ])
+        return session
+
+    def test_leaf(self):
+        session = self.session()
+        session.unified_create()
+        leaf = os.path.join(self.parent, settings.OBSERVER_CGROUP_LEAF)
+        with open(os.path.join(leaf, 'cgroup.procs')) as f:
+            self.assertEqual(f.read(), '100')
+        with open(os.path.join(self.parent, 'cgroup.subtree_control')) as f:
+            self.assertEqual(sorted(f.read().split()), [ '+cpu', '+memory', '+pids' ])
+        self.assertTrue(os.path.isdir(session.group_path('freezer')))
+        self.assertEqual(session.leaf_group_path('freezer', filename='cgroup.procs'), os.path.join(leaf, 'cgroup.procs'))
+
+    def test_root(self):
+        session = self.session(parent='/')
+        session.unified_create()
+        self.assertFalse(os.path.exists(os.path.join(self.temp.name, settings.OBSERVER_CGROUP_LEAF)))
+        self.assertEqual(session.leaf_group_path('freezer'), self.temp.name)
+
+    def test_controllers_failure(self):
+        os.makedirs(os.path.join(self.parent, 'cgroup.subtree_control'))
+        with self.assertRaises(OSError):
+            self.session().unified_create()
+
+if __name__ == '__main__':
+    unittest.main()
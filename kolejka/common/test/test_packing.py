@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import unittest
+
+from kolejka.common.limits import KolejkaLimits
+from kolejka.common.packing import KolejkaResources, pack_tasks
+from kolejka.common.task import KolejkaTask
+
+def task(name, **kwargs):
+    return KolejkaTask(None, id=name, image=kwargs.pop('image', 'ubuntu'), **kwargs)
+
+class TestPacking(unittest.TestCase):
+    def test_best_fit(self):
+        tasks = [ task('a', limits={'cpus':2}), task('b', limits={'cpus':3}), task('c', limits={'cpus':1}), task('d', limits={'cpus':2}) ]
+        selected = pack_tasks(KolejkaLimits(cpus=8), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'b', 'c', 'd'])
+        selected = pack_tasks(KolejkaLimits(cpus=5), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'b'])
+        selected = pack_tasks(KolejkaLimits(cpus=4), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'd'])
+
+    def test_skips_blocking_task(self):
+        tasks = [ task('a', limits={'cpus':2, 'memory':'3G'}), task('b', limits={'cpus':2, 'memory':'2G'}), task('c', limits={'cpus':2, 'memory':'1G'}) ]
+        selected = pack_tasks(KolejkaLimits(cpus=4, memory='4G'), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'c'])
+
+    def test_exclusive(self):
+        tasks = [ task('a', exclusive=True, limits={'cpus':1}), task('b', limits={'cpus':1}) ]
+        self.assertEqual([ t.id for t in pack_tasks(KolejkaLimits(cpus=4), tasks) ], ['a'])
+        tasks = [ task('b', limits={'cpus':1}), task('a', exclusive=True, limits={'cpus':1}), task('c', limits={'cpus':1}) ]
+        self.assertEqual([ t.id for t in pack_tasks(KolejkaLimits(cpus=4), tasks) ], ['b', 'c'])
+
+    def test_concurency(self):
+        tasks = [ task(str(i), limits={'cpus':1}) for i in range(8) ]
+        self.assertEqual(len(pack_tasks(KolejkaLimits(cpus=8), tasks, concurency=3)), 3)
+
+    def test_images_are_shared(self):
+        tasks = [ task('a', image='big', limits={'image':'3G'}), task('b', image='big', limits={'image':'3G'}), task('c', image='other', limits={'image':'2G'}) ]
+        selected = pack_tasks(KolejkaLimits(image='4G'), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'b'])
+
+    def test_gpus(self):
+        tasks = [ task('a', limits={'gpus':1, 'gpu_memory':'8G'}), task('b', limits={'gpus':1, 'gpu_memory':'32G'}), task('c') ]
+        selected = pack_tasks(KolejkaLimits(gpus=2, gpu_memory='16G'), tasks)
+        self.assertEqual([ t.id for t in selected ], ['a', 'c'])
+
+    def test_ledger(self):
+        resources = KolejkaResources(KolejkaLimits(cpus=4, memory='4G'))
+        a = task('a', limits={'cpus':3, 'memory':'1G'})
+        b = task('b', limits={'cpus':2, 'memory':'1G'})
+        resources.task_add(a)
+        self.assertEqual(resources.available.cpus, 1)
+        self.assertFalse(resources.task_fits(b))
+        resources.task_remove(a)
+        self.assertTrue(resources.task_fits(b))
+        self.assertEqual(resources.available.memory, 4*1024**3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from kolejka.common import settings
+
+import unittest
+import unittest.mock
+
+from kolejka.common.perf import PerfCounters, perf_available, PERF_TYPE_SOFTWARE, PERF_COUNT_SW_TASK_CLOCK
+
+def software_counters():
+    try:
+        return PerfCounters.process(0, events={ 'clock' : (PERF_TYPE_SOFTWARE, PERF_COUNT_SW_TASK_CLOCK) })
+    except OSError:
+        return None
+
+@unittest.skipUnless(perf_available() and software_counters() is not None, 'perf_event_open is not available')
+class TestPerf(unittest.TestCase):
+    def test_process(self):
+        counters = software_counters()
+        try:
+            before = counters.read()['clock']
+            sum(range(10**6))
+            after = counters.read()['clock']
+            self.assertGreater(after, before)
+        finally:
+            counters.close()
+        self.assertEqual(counters.read(), { 'clock' : 0 })
+
+    def test_restrict(self):
+        counters = software_counters()
+        counters.path = '/sys/fs/cgroup/perf_event/session'
+        counters.cpus = [ 0, 1 ]
+        try:
+            sum(range(10**6))
+            before = counters.read()['clock']
+            with unittest.mock.patch.object(PerfCounters, 'cgroup', lambda path, cpus, events: software_counters()):
+                counters.restrict([ 1 ])
+            self.assertEqual(counters.cpus, [ 1 ])
+            self.assertGreaterEqual(counters.read()['clock'], before)
+        finally:
+            counters.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,8 @@ import glob
 import json
 import logging
 import math
-from multiprocessing import Process
+from multiprocessing import Lock, Process
+import multiprocessing.connection
 import os
 import pathlib
 import random
@@ -24,6 +25,8 @@ import uuid
 
 from kolejka.common import kolejka_config, foreman_config
 from kolejka.common import KolejkaTask, KolejkaResult, KolejkaLimits
+from kolejka.common import KolejkaResources, pack_tasks
+from kolejka.common.cache import KolejkaCache
 from kolejka.common import MemoryAction, TimeAction, BigIntAction
 from kolejka.client import KolejkaClient
 from kolejka.common.gpu import gpu_stats
@@ -78,7 +81,57 @@ def manage_images(pull, size, necessary_images, priority_images):
         image_size = get_docker_image_size(image)
         assert image_size <= size
 
-def foreman_single(temp_path, task, task_timeout=-1):
+def offset_slots(total, offset, count):
+    if total is None or not count:
+        return set()
+    return set(range(offset, offset + count))
+
+def allocate_offset(used, total, count):
+    if total is None or not count:
+        return 0
+    for offset in range(total - count + 1):
+        if len(offset_slots(total, offset, count) & used) == 0:
+            return offset
+
+def directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+def staging_size(staging_path, staged, fetching):
+    size = sum([ size for path, size in staged.values() ], 0)
+    for task_id in fetching:
+        size += directory_size(os.path.join(staging_path, task_id))
+    return size
+
+def foreman_cache():
+    config = foreman_config()
+    if config.cache is not None:
+        return KolejkaCache(config.cache, config.cache_size)
+
+def foreman_prefetch(staging_path, task, images_lock):
+    client = KolejkaClient()
+    client.task_get(task.id, staging_path, cache=foreman_cache())
+    if task.image is not None:
+        with images_lock:
+            if not check_docker_image_existance(task.image):
+                pull_docker_image(task.image)
+
+def foreman_reject(task):
+    config = foreman_config()
+    result = KolejkaResult(None)
+    result.id = task.id
+    result.tags = config.tags
+    result.limits = task.limits
+    result.result = -1
+    try:
+        KolejkaClient().result_put(result)
+    except:
+        traceback.print_exc()
+
+def foreman_single(temp_path, task, task_timeout=None, staging_path=None):
     config = foreman_config()
     with tempfile.TemporaryDirectory(temp_path) as jailed_path:
         if task.limits.workspace is not None:
@@ -92,7 +145,12 @@ def foreman_single(temp_path, task, task_timeout=-1):
             os.makedirs(temp_path, exist_ok=True)
             task.path = task_path
             client = KolejkaClient()
-            client.task_get(task.id, task_path)
+            if staging_path is not None:
+                for name in os.listdir(staging_path):
+                    shutil.move(os.path.join(staging_path, name), task_path)
+                shutil.rmtree(staging_path)
+            else:
+                client.task_get(task.id, task_path, cache=foreman_cache())
             for k,f in task.files.items():
                 f.path = k
             task.commit()
@@ -113,6 +171,33 @@ def foreman_single(temp_path, task, task_timeout=-1):
             if task.limits.storage is not None:
                 subprocess.run(['umount', '-l', jailed_path])
 
+class ForemanDequeue(Thread):
+    def __init__(self, client, concurency, limits, tags, timeout):
+        super().__init__(daemon=True)
+        self.client = client
+        self.concurency = concurency
+        self.limits = limits
+        self.tags = tags
+        self.timeout = timeout
+        self.tasks = list()
+        self.start_time = time.monotonic()
+        self.receiver, self.sender = multiprocessing.Pipe(duplex=False)
+        self.start()
+
+    def run(self):
+        try:
+            self.tasks = self.client.dequeue(self.concurency, self.limits, self.tags, timeout=self.timeout)
+        except:
+            traceback.print_exc()
+        finally:
+            self.sender.send(None)
+
+    def result(self):
+        self.join()
+        self.receiver.close()
+        self.sender.close()
+        return self.tasks
+
 def foreman():
     config = foreman_config()
     gstats = gpu_stats().gpus
@@ -125,6 +210,7 @@ def foreman():
     limits.image = config.image
     limits.workspace = config.workspace
     limits.time = config.time
+    limits.cpu_time = config.cpu_time
     limits.network = config.network
     limits.gpus = config.gpus
     limits.perf_instructions = config.perf_instructions
@@ -141,129 +227,133 @@ def foreman():
             limits.gpu_memory = min(limits.gpu_memory, v.memory_total)
     client = KolejkaClient()
     logging.debug(f'Foreman tags: {config.tags}, limits: {limits.dump()}')
-    while True:
-        try:
-            tasks = client.dequeue(config.concurency, limits, config.tags)
-            if len(tasks) == 0:
-                time.sleep(config.interval)
-            else:
-                check_python_volume()
-                while len(tasks) > 0:
-                    resources = KolejkaLimits()
-                    resources.copy(limits)
-                    image_usage = dict()
-                    children_args = list()
-                    cpus_offset = 0
-                    gpus_offset = 0
-                    tasks_timeout = None
-
-                    for task in tasks:
-                        if len(children_args) >= config.concurency:
-                            break
-                        if task.exclusive and len(children_args) > 0:
-                            break
-                        task.limits.update(limits)
-                        task.limits.cpus_offset = cpus_offset
-                        task.limits.gpus_offset = gpus_offset
-                        ok = True
-                        if resources.cpus is not None and task.limits.cpus > resources.cpus:
-                            ok = False
-                        if task.limits.gpus is not None and task.limits.gpus > 0:
-                            if resources.gpus is None or task.limits.gpus > resources.gpus:
-                                ok = False
-                            if resources.gpu_memory is not None and task.limits.gpu_memory > resources.gpu_memory:
-                                ok = False
-                        if resources.memory is not None and task.limits.memory > resources.memory:
-                            ok = False
-                        if resources.swap is not None and task.limits.swap > resources.swap:
-                            ok = False
-                        if resources.pids is not None and task.limits.pids > resources.pids:
-                            ok = False
-                        if resources.storage is not None and task.limits.storage > resources.storage:
-                            ok = False
-                        if resources.image is not None:
-                            image_usage_add = max(image_usage.get(task.image, 0), task.limits.image) - image_usage.get(task.image, 0)
-                            if image_usage_add > resources.image:
-                                ok = False
-                        if resources.workspace is not None and task.limits.workspace > resources.workspace:
-                            ok = False
-                        if resources.perf_instructions is not None and task.limits.perf_instructions > resources.perf_instructions:
-                            ok = False
-                        if resources.perf_cycles is not None and task.limits.perf_cycles > resources.perf_cycles:
-                            ok = False
-                        if resources.cgroup_depth is not None and task.limits.cgroup_depth > resources.cgroup_depth:
-                            ok = False
-                        if resources.cgroup_descendants is not None and task.limits.cgroup_descendants > resources.cgroup_descendants:
-                            ok = False
-                        if ok:
-                            children_args.append([config.temp_path, task])
-                            cpus_offset += task.limits.cpus
-                            if resources.cpus is not None:
-                                resources.cpus -= task.limits.cpus
-                            if resources.gpus is not None and task.limits.gpus is not None:
-                                resources.gpus -= task.limits.gpus
-                                gpus_offset += task.limits.gpus
-                            if resources.memory is not None:
-                                resources.memory -= task.limits.memory
-                            if resources.swap is not None:
-                                resources.swap -= task.limits.swap
-                            if resources.pids is not None:
-                                resources.pids -= task.limits.pids
-                            if resources.storage is not None:
-                                resources.storage -= task.limits.storage
-                            if resources.image is not None:
-                                resources.image -= image_usage_add
-                                image_usage[task.image] = max(image_usage.get(task.image, 0), task.limits.image)
-                            if resources.workspace is not None:
-                                resources.workspace -= task.limits.workspace
-                            if resources.perf_instructions is not None:
-                                resources.perf_instructions -= task.limits.perf_instructions
-                            if resources.perf_cycles is not None:
-                                resources.perf_cycles -= task.limits.perf_cycles
-                            if resources.cgroup_descendants is not None:
-                                resources.cgroup_descendants -= task.limits.cgroup_descendants
-                            if task.limits.time is None:
-                                tasks_timeout = -1
-                            else:
-                                if tasks_timeout is None:
-                                    tasks_timeout = task.limits.time.total_seconds()
-                                else:
-                                    tasks_timeout = max(task.limits.time.total_seconds(), tasks_timeout)
-                            tasks = tasks[1:]
-                            if task.exclusive:
-                                break
+    resources = KolejkaResources(limits, concurency=config.concurency)
+    staging_path = tempfile.mkdtemp(prefix='staging', dir=config.temp_path)
+    running = dict()
+    queued = list()
+    fetching = dict()
+    staged = dict()
+    used_cpus = set()
+    used_gpus = set()
+    dequeue = None
+    dequeue_after = 0
+    images_lock = Lock()
+    try:
+        while True:
+            try:
+                sentinels = [ process.sentinel for process in list(running) + list(fetching.values()) ]
+                if dequeue is not None:
+                    sentinels.append(dequeue.receiver)
+                finished = multiprocessing.connection.wait(sentinels, timeout=0)
+                for process, (task, cpus, gpus) in list(running.items()):
+                    if process.sentinel in finished:
+                        process.join()
+                        del running[process]
+                        resources.task_remove(task)
+                        used_cpus.difference_update(cpus)
+                        used_gpus.difference_update(gpus)
+                for task_id, process in list(fetching.items()):
+                    if process.sentinel in finished:
+                        process.join()
+                        del fetching[task_id]
+                        task_staging_path = os.path.join(staging_path, task_id)
+                        if process.exitcode == 0:
+                            staged[task_id] = (task_staging_path, directory_size(task_staging_path))
                         else:
-                            break
-                    if config.image is not None:
-                        manage_images(
-                            config.pull,
-                            config.image,
-                            image_usage,
-                            [task.image for task in tasks]
-                        )
-                    if tasks_timeout is not None and tasks_timeout >= 0:
-                        tasks_timeout = 10 + 2*tasks_timeout
-                    children = list()
-                    for args in children_args:
-                        args.append(tasks_timeout)
-                        process = Process(target=foreman_single, args=args)
-                        children.append(process)
+                            shutil.rmtree(task_staging_path, ignore_errors=True)
+
+                tasks = list()
+                if dequeue is not None and dequeue.receiver in finished:
+                    tasks = dequeue.result()
+                    if len(tasks) == 0 and time.monotonic() - dequeue.start_time < config.dequeue_timeout:
+                        dequeue_after = time.monotonic() + config.interval
+                    dequeue = None
+                if dequeue is None and len(tasks) == 0 and time.monotonic() >= dequeue_after:
+                    if len(queued) == 0 and resources.count < config.concurency and not resources.exclusive and (limits.cpus is None or resources.used['cpus'] < limits.cpus):
+                        dequeue = ForemanDequeue(client, config.concurency - resources.count, resources.available, config.tags, config.dequeue_timeout)
+                    elif len(running) > 0 and len(queued) < config.prefetch:
+                        dequeue = ForemanDequeue(client, config.prefetch - len(queued), limits, config.tags, config.dequeue_timeout)
+                for task in tasks:
+                    task.limits.update(limits)
+                    if staging_size(staging_path, staged, fetching) < config.staging:
+                        process = Process(target=foreman_prefetch, args=[os.path.join(staging_path, task.id), task, images_lock])
                         process.start()
-                    for process in children:
-                        process.join()
-        except KeyboardInterrupt:
-            raise
-        except:
-            traceback.print_exc()
-            time.sleep(config.interval)
+                        fetching[task.id] = process
+                queued += tasks
+
+                started = list()
+                for task in pack_tasks(resources, [ task for task in queued if task.id not in fetching ]):
+                    cpus_offset = allocate_offset(used_cpus, limits.cpus, task.limits.cpus)
+                    gpus_offset = allocate_offset(used_gpus, limits.gpus, task.limits.gpus)
+                    if cpus_offset is None or gpus_offset is None:
+                        resources.task_remove(task)
+                        continue
+                    task.limits.cpus_offset = cpus_offset
+                    task.limits.gpus_offset = gpus_offset
+                    cpus = offset_slots(limits.cpus, cpus_offset, task.limits.cpus)
+                    gpus = offset_slots(limits.gpus, gpus_offset, task.limits.gpus)
+                    used_cpus.update(cpus)
+                    used_gpus.update(gpus)
+                    queued.remove(task)
+                    started.append((task, cpus, gpus))
+                if len(started) == 0 and len(running) == 0 and len(fetching) == 0 and len(queued) > 0:
+                    logging.warning(f'Tasks {[task.id for task in queued]} do not fit in foreman resources')
+                    for task in queued:
+                        if task.id in staged:
+                            shutil.rmtree(staged.pop(task.id)[0], ignore_errors=True)
+                        foreman_reject(task)
+                    queued = list()
+
+                if len(started) > 0:
+                    check_python_volume()
+                    if config.image is not None:
+                        with images_lock:
+                            manage_images(
+                                config.pull,
+                                config.image,
+                                dict([ (image, max(sizes)) for image, sizes in resources.images.items() ]),
+                                [task.image for task in queued]
+                            )
+                for task, cpus, gpus in started:
+                    task_timeout = None
+                    if task.limits.time is not None:
+                        task_timeout = 10 + 2*task.limits.time.total_seconds()
+                    process = Process(target=foreman_single, args=[config.temp_path, task, task_timeout, staged.pop(task.id, (None, 0))[0]])
+                    process.start()
+                    running[process] = (task, cpus, gpus)
+
+                if len(started) == 0 and len(tasks) == 0:
+                    sentinels = [ process.sentinel for process in list(running) + list(fetching.values()) ]
+                    timeout = config.interval
+                    if dequeue is not None:
+                        sentinels.append(dequeue.receiver)
+                    elif dequeue_after > time.monotonic():
+                        timeout = min(timeout, dequeue_after - time.monotonic())
+                    multiprocessing.connection.wait(sentinels, timeout=timeout)
+            except KeyboardInterrupt:
+                raise
+            except:
+                traceback.print_exc()
+                time.sleep(config.interval)
+    finally:
+        for process in fetching.values():
+            process.terminate()
+        for process in fetching.values():
+            process.join()
+        shutil.rmtree(staging_path, ignore_errors=True)
 
 def config_parser(parser):
     parser.add_argument('--auto-tags', type=bool, help='add automatically generated machine tags', default=True)
+    parser.add_argument('--cache', type=str, help='blob cache folder')
+    parser.add_argument('--cache-size', action=MemoryAction, help='blob cache size limit')
     parser.add_argument('--pull', action='store_true', help='always pull images, even if local version is present', default=False)
     parser.add_argument('--tags', type=str, help='comma separated list of machine tags')
     parser.add_argument('--temp', type=str, help='temp folder')
     parser.add_argument('--interval', type=float, help='dequeue interval (in seconds)')
+    parser.add_argument('--dequeue-timeout', type=float, help='time to wait for a new task in a single dequeue request (in seconds)')
     parser.add_argument('--concurency', type=int, help='number of simultaneous tasks')
+    parser.add_argument('--prefetch', type=int, help='number of tasks to dequeue and download ahead of execution')
+    parser.add_argument('--staging', action=MemoryAction, help='disk space limit for prefetched tasks')
     parser.add_argument('--cpus', type=int, help='cpus limit')
     parser.add_argument('--memory', action=MemoryAction, help='memory limit')
     parser.add_argument('--swap', action=MemoryAction, help='swap limit')
@@ -272,6 +362,7 @@ def config_parser(parser):
     parser.add_argument('--image', action=MemoryAction, help='image size limit')
     parser.add_argument('--workspace', action=MemoryAction, help='workspace size limit')
     parser.add_argument('--time', action=TimeAction, help='time limit')
+    parser.add_argument('--cpu-time', action=TimeAction, help='cpu time limit')
     parser.add_argument('--network', type=bool, help='allow netowrking')
     parser.add_argument('--gpus', type=int, help='gpus limit')
     parser.add_argument('--gpu-memory', type=MemoryAction, help='gpu memory limit')
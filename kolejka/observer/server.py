@@ -5,15 +5,17 @@ from kolejka.common import settings
 
 import datetime
 import hashlib
+import heapq
 import http.server
 import json
 import logging
-from multiprocessing import Process
 import os
 import re
+import select
 import signal
 import socket
 import socketserver
+import threading
 import time
 import traceback
 from urllib.parse import urlparse, urlencode, parse_qsl
@@ -22,6 +24,8 @@ import uuid
 from kolejka.common.http_socket import HTTPUnixServer, HTTPUnixConnection
 from kolejka.common import KolejkaLimits, KolejkaStats
 from kolejka.common import ControlGroupSystem
+from kolejka.common.inotify import Inotify, inotify_available, IN_MODIFY
+from kolejka.common.perf import PerfCounters
 
 #TODO: detect subsessions?
 
@@ -42,6 +46,27 @@ class Session:
         assert group in self.groups
         return os.path.join(self.system.mount_point(group), self.parent_groups[group].strip('/'), filename.strip('/')).rstrip('/')
 
+    def leaf_group_path(self, group, filename=''):
+        if self.unified and self.parent_groups[group].strip('/'):
+            return os.path.join(self.parent_group_path(group), settings.OBSERVER_CGROUP_LEAF, filename.strip('/')).rstrip('/')
+        return self.parent_group_path(group, filename=filename)
+
+    def pid_parent_groups(self, pid):
+        result = self.system.pid_groups(pid)
+        if self.unified:
+            for group, path in result.items():
+                if os.path.basename(path.rstrip('/')) == settings.OBSERVER_CGROUP_LEAF:
+                    result[group] = os.path.dirname(path.rstrip('/'))
+        return result
+
+    @property
+    def unified(self):
+        return self.system.version == 2
+
+    @property
+    def tasks_file(self):
+        return 'cgroup.procs' if self.unified else 'tasks'
+
     def list_group(self, group):
         result = set()
         path = self.group_path(group)
@@ -55,7 +80,7 @@ class Session:
     def cpuset_cpus(self, path):
         path=os.path.abspath(path)
         while path.startswith(self.system.mount_point('cpuset')):
-            cpuset_path = os.path.join(path, 'cpuset.cpus')
+            cpuset_path = os.path.join(path, self.system.cpuset_file)
             if os.path.exists(cpuset_path):
                 with open(cpuset_path) as cpuset_file:
                     cpus = cpuset_file.readline().strip()
@@ -74,6 +99,8 @@ class Session:
             with open(stat_path) as stat_file:
                 stats = stat_file.read()
             stats = re.sub(r'^[^)]*\) ', '', stats).split()
+            if stats[0] in [ 'Z', 'X' ]:
+                return None
             return int(stats[19])
         except:
             pass
@@ -91,6 +118,14 @@ class Session:
             path = os.path.dirname(path)
         return result
 
+    def events_paths(self):
+        result = set()
+        for group in self.groups:
+            path = self.group_path(group, filename='cgroup.events')
+            if os.path.isfile(path):
+                result.add(path)
+        return sorted(list(result))
+
     def finished(self):
         if self.pid_start_time(self.creator_pid) == self.creator_start_time:
             return False
@@ -103,13 +138,19 @@ class Session:
         self.id = session_id
         self.creator_pid = pid
         self.creator_start_time = self.pid_start_time(self.creator_pid)
-        pid_groups = self.system.pid_groups(pid)
+        pid_groups = self.pid_parent_groups(pid)
         self.parent_groups = dict()
         self.groups = dict()
         for group in settings.OBSERVER_CGROUPS:
+            if self.unified and group not in pid_groups:
+                continue
             self.parent_groups[group] = pid_groups[group]
             self.groups[group] = os.path.join(self.parent_groups[group], self.group_name)
-        for group in settings.OBSERVER_CGROUPS:
+        if self.unified:
+            self.unified_create()
+        for group in self.groups:
+            if self.unified:
+                break
             if group == 'memory':
                 with open(os.path.join(os.path.dirname(self.group_path(group)), 'memory.use_hierarchy')) as f:
                     use_hierarchy = bool(f.readline().strip())
@@ -123,24 +164,78 @@ class Session:
         logging.debug(f'Created session {self.id} with paths {self.groups.values()} for pid {self.creator_pid}')
         self.start_time = time.perf_counter()
         self.close_time = None
+        self.cpu_time = None
+        self.cpu_count = None
+        self.perf_limits = dict()
+        self.perf_sample = None
+        self.perf_rates = dict()
+        self.next_check = None
+        self.limit = None
+        self.overrun = None
+        self.perf_overrun = None
+        self.reader = self.system.groups_reader(self.groups)
+        self.perf = None
+        if 'perf_event' in self.groups:
+            try:
+                self.perf = PerfCounters.cgroup(self.group_path('perf_event'), self.limited_cpus() if 'cpuset' in self.groups else None)
+            except OSError as e:
+                logging.warning(f'Failed to open perf counters for session {self.id}: {e}')
+
+    def unified_leaf(self):
+        parent_path = self.parent_group_path('freezer')
+        leaf_path = self.leaf_group_path('freezer')
+        if leaf_path == parent_path:
+            return
+        os.makedirs(leaf_path, exist_ok=True)
+        with open(os.path.join(parent_path, 'cgroup.procs')) as procs_file:
+            pids = procs_file.read().split()
+        for pid in pids:
+            try:
+                with open(os.path.join(leaf_path, 'cgroup.procs'), 'w') as procs_file:
+                    procs_file.write(pid)
+            except ProcessLookupError:
+                pass
+        if pids:
+            logging.debug(f'Moved processes {pids} from {parent_path} to {leaf_path}')
+
+    def unified_create(self):
+        path = self.group_path('freezer')
+        parent_path = self.parent_group_path('freezer')
+        controllers = [ controller for controller in [ 'cpu', 'cpuset', 'io', 'memory', 'pids' ] if controller in self.groups or (controller == 'cpu' and 'cpuacct' in self.groups) or (controller == 'io' and 'blkio' in self.groups) ]
+        for attempt in range(3):
+            self.unified_leaf()
+            try:
+                with open(os.path.join(parent_path, 'cgroup.subtree_control'), 'w') as subtree_file:
+                    subtree_file.write(' '.join([ '+'+controller for controller in controllers ]))
+                break
+            except OSError as e:
+                error = e
+        else:
+            logging.error(f'Failed to enable controllers {controllers} in {parent_path}: {error}')
+            raise error
+        os.makedirs(path, exist_ok=True)
 
     def attach(self, pid):
-        pid_groups = self.system.pid_groups(pid)
-        for group in settings.OBSERVER_CGROUPS:
+        pid_groups = self.pid_parent_groups(pid)
+        for group in self.groups:
             assert os.path.join(pid_groups[group], self.group_name) == self.groups[group]
-        for group in settings.OBSERVER_CGROUPS:
-            tasks_path = self.group_path(group, filename='tasks')
+        for group in self.groups:
+            tasks_path = self.group_path(group, filename=self.tasks_file)
             assert os.path.isfile(tasks_path)
             with open(tasks_path, 'w') as tasks_file:
                 tasks_file.write(str(pid))
+            if self.unified:
+                break
         logging.debug(f'Attached process {pid} to session {self.id}')
 
     def detach(self, pid):
-        pid_groups = self.system.pid_groups(pid)
-        for group in settings.OBSERVER_CGROUPS:
+        pid_groups = self.pid_parent_groups(pid)
+        for group in self.groups:
             assert os.path.join(pid_groups[group], self.group_name) == self.groups[group] or pid_groups[group] == self.groups[group]
-        for group in settings.OBSERVER_CGROUPS:
-            tasks_path = self.parent_group_path(group, filename='tasks')
+        for group in self.groups:
+            if self.unified and group != 'freezer':
+                continue
+            tasks_path = self.leaf_group_path(group, filename=self.tasks_file)
             assert os.path.isfile(tasks_path)
             with open(tasks_path, 'w') as tasks_file:
                 tasks_file.write(str(pid))
@@ -149,15 +244,20 @@ class Session:
     def limits(self, limits=KolejkaLimits()):
         if limits.memory is not None:
             assert 'memory' in self.groups
-            limit_file = self.group_path('memory', filename='memory.limit_in_bytes')
+            limit_file = self.group_path('memory', filename='memory.max' if self.unified else 'memory.limit_in_bytes')
             with open(limit_file, 'w') as f:
                 f.write(str(limits.memory))
             logging.debug(f'Limited session {self.id} memory to {limits.memory} bytes')
             if limits.swap is not None:
                 assert 'memory' in self.groups
-                limit_file = self.group_path('memory', filename='memory.memsw.limit_in_bytes')
-                with open(limit_file, 'w') as f:
-                    f.write(str(limits.memory+limits.swap))
+                if self.unified:
+                    limit_file = self.group_path('memory', filename='memory.swap.max')
+                    with open(limit_file, 'w') as f:
+                        f.write(str(limits.swap))
+                else:
+                    limit_file = self.group_path('memory', filename='memory.memsw.limit_in_bytes')
+                    with open(limit_file, 'w') as f:
+                        f.write(str(limits.memory+limits.swap))
                 logging.debug(f'Limited session {self.id} swap to {limits.swap} bytes')
         if limits.cpus is not None:
             assert 'cpuset' in self.groups
@@ -172,6 +272,11 @@ class Session:
             with open(limit_file, 'w') as f:
                 f.write(','.join([str(c) for c in cpuset_cpus]))
             logging.debug(f'Limited session {self.id} cpus to {cpuset_cpus}')
+            if self.unified and 'cpu' in self.groups:
+                limit_file = self.group_path('cpu', filename='cpu.max')
+                with open(limit_file, 'w') as f:
+                    f.write(f'{len(cpuset_cpus)*settings.CGROUP_CPU_PERIOD} {settings.CGROUP_CPU_PERIOD}')
+                logging.debug(f'Throttled session {self.id} to {len(cpuset_cpus)} cpus')
         if limits.pids is not None:
             assert 'pids' in self.groups
             limit_file = self.group_path('pids', filename='pids.max')
@@ -183,38 +288,137 @@ class Session:
             logging.debug(f'Limited session {self.id} time to {limits.time.total_seconds()}')
         else:
             self.close_time = None
+        self.cpu_count = len(self.limited_cpus() or []) if 'cpuset' in self.groups else 0
+        self.cpu_count = self.cpu_count or os.cpu_count() or 1
+        if self.perf is not None and 'cpuset' in self.groups:
+            cpus = self.limited_cpus()
+            if cpus:
+                try:
+                    self.perf.restrict(cpus)
+                    logging.debug(f'Restricted session {self.id} perf counters to cpus {cpus}')
+                except OSError as e:
+                    logging.warning(f'Failed to restrict perf counters for session {self.id}: {e}')
+        if limits.cpu_time is not None:
+            assert 'cpuacct' in self.groups
+            self.cpu_time = limits.cpu_time.total_seconds()
+            logging.debug(f'Limited session {self.id} cpu time to {self.cpu_time}')
+        else:
+            self.cpu_time = None
+        self.perf_limits = dict()
+        for name in [ 'instructions', 'cycles' ]:
+            value = getattr(limits, 'perf_'+name)
+            if value is not None:
+                assert self.perf is not None
+                self.perf_limits[name] = value
+                logging.debug(f'Limited session {self.id} perf {name} to {value}')
+        self.next_check = None
+        if self.cpu_time is not None or self.perf_limits:
+            self.next_check = time.perf_counter()
+
+    def cpu_usage(self):
+        usage = self.reader.cpu_usage()
+        if usage is None:
+            raise OSError(f'Failed to read cpu usage of session {self.id}')
+        return usage
+
+    def exceeded(self, current_time):
+        if self.close_time is not None and self.close_time <= current_time:
+            return 'time'
+        delays = list()
+        if self.cpu_time is not None:
+            try:
+                usage = self.cpu_usage()
+            except OSError:
+                return
+            if usage >= self.cpu_time:
+                return 'cpu_time'
+            delays.append((self.cpu_time - usage) / self.cpu_count)
+        if self.perf_limits:
+            counts = self.perf.read()
+            for name, limit in self.perf_limits.items():
+                if counts[name] >= limit:
+                    return 'perf_'+name
+                if self.perf_sample is not None and current_time > self.perf_sample[0]:
+                    rate = (counts[name] - self.perf_sample[1][name]) / (current_time - self.perf_sample[0])
+                    self.perf_rates[name] = max(self.perf_rates.get(name, 0), rate)
+                if self.perf_rates.get(name, 0) > 0:
+                    delays.append(min((limit - counts[name]) / (2 * self.perf_rates[name]), settings.OBSERVER_PERF_INTERVAL))
+                else:
+                    delays.append(0)
+            self.perf_sample = (current_time, counts)
+        if delays:
+            self.next_check = current_time + max(min(delays), settings.OBSERVER_CPU_TIME_INTERVAL)
+
+    def enforce(self, limit):
+        try:
+            self.kill()
+        except:
+            pass
+        self.limit = limit
+        if limit == 'time':
+            self.overrun = datetime.timedelta(seconds = max(0, time.perf_counter() - self.close_time))
+        elif limit == 'cpu_time':
+            self.overrun = datetime.timedelta(seconds = max(0, self.cpu_usage() - self.cpu_time))
+        elif limit.startswith('perf_'):
+            name = limit[len('perf_'):]
+            self.perf_overrun = max(0, self.perf.read()[name] - self.perf_limits[name])
+            logging.debug(f'Session {self.id} exceeded {limit} limit by {self.perf_overrun}')
+            return
+        logging.debug(f'Session {self.id} exceeded {limit} limit by {self.overrun}')
 
     def freeze(self, freeze=True):
         assert 'freezer' in self.groups
-        if freeze:
-            command = 'FROZEN'
+        if self.unified:
+            command = '1' if freeze else '0'
+            state_file = self.group_path('freezer', filename='cgroup.freeze')
         else:
-            command = 'THAWED'
-        state_file = self.group_path('freezer', filename='freezer.state')
+            command = 'FROZEN' if freeze else 'THAWED'
+            state_file = self.group_path('freezer', filename='freezer.state')
         with open(state_file, 'w') as f:
             f.write(command)
-        logging.debug(f'{command} session {self.id}')
+        logging.debug(f'{"FROZEN" if freeze else "THAWED"} session {self.id}')
         if freeze:
             while True:
-                with open(state_file) as f:
-                    if f.readline().strip().lower() == 'frozen':
+                if self.unified:
+                    if self.system.read_keys(self.group_path('freezer', filename='cgroup.events')).get('frozen') == '1':
                         return
+                else:
+                    with open(state_file) as f:
+                        if f.readline().strip().lower() == 'frozen':
+                            return
         #TODO: wait for FROZEN. Is this code good?
 
     def freezing(self):
         assert 'freezer' in self.groups
+        if self.unified:
+            with open(self.group_path('freezer', filename='cgroup.freeze')) as f:
+                return f.readline().strip() == '1'
         state_file = self.group_path('freezer', filename='freezer.self_freezing')
         with open(state_file) as f:
             return f.readline().strip() == '1'
 
     def stats(self):
-        stats = self.system.groups_stats(self.groups)
+        stats = self.reader.stats()
         time_stats = KolejkaStats()
         time_stats.time = datetime.timedelta(seconds = max(0, time.perf_counter() - self.start_time))
+        time_stats.limit = self.limit
+        time_stats.overrun = self.overrun
+        if self.perf is not None:
+            counts = self.perf.read()
+            time_stats.perf.instructions = counts['instructions']
+            time_stats.perf.cycles = counts['cycles']
+            time_stats.perf.overrun = self.perf_overrun
         stats.update(time_stats)
         return stats
 
     def kill(self):
+        if self.unified:
+            kill_file = self.group_path('freezer', filename='cgroup.kill')
+            if os.path.exists(kill_file):
+                with open(kill_file, 'w') as f:
+                    f.write('1')
+                logging.debug(f'KILLED session {self.id}')
+                return
         state = self.freezing()
         self.freeze(freeze=True)
 
@@ -238,15 +442,154 @@ class Session:
         except:
             pass
         time.sleep(0.1) #TODO: Allow thawed killed processes to die. HOW?
+        if self.perf is not None:
+            self.perf.close()
+        self.reader.close()
         self.system.groups_close(self.groups)
         logging.debug(f'CLOSED session {self.id}')
             
+class SessionMonitor:
+    def __init__(self, registry):
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.deadlines = list()
+        self.pidfds = dict()
+        self.watches = dict()
+        self.polled = set()
+        self.epoll = select.epoll()
+        self.wake_read, self.wake_write = os.pipe2(os.O_NONBLOCK | os.O_CLOEXEC)
+        self.epoll.register(self.wake_read, select.EPOLLIN)
+        self.inotify = None
+        if inotify_available():
+            try:
+                self.inotify = Inotify()
+                self.epoll.register(self.inotify.fileno(), select.EPOLLIN)
+            except OSError:
+                self.inotify = None
+        self.stopped = False
+        self.thread = None
+
+    def wake(self):
+        try:
+            os.write(self.wake_write, b'\0')
+        except BlockingIOError:
+            pass
+
+    def watch(self, session):
+        with self.lock:
+            covered = False
+            pidfd_open = getattr(os, 'pidfd_open', None)
+            if pidfd_open is not None:
+                try:
+                    pidfd = pidfd_open(session.creator_pid)
+                    self.epoll.register(pidfd, select.EPOLLIN)
+                    self.pidfds[pidfd] = session.id
+                    covered = True
+                except OSError:
+                    pass
+            if self.inotify is not None:
+                for path in session.events_paths():
+                    try:
+                        self.watches[self.inotify.add_watch(path, IN_MODIFY)] = session.id
+                    except OSError:
+                        pass
+            if not covered:
+                self.polled.add(session.id)
+        self.wake()
+
+    def schedule(self, session, wake=True):
+        with self.lock:
+            for deadline in [ session.close_time, session.next_check ]:
+                if deadline is not None:
+                    heapq.heappush(self.deadlines, (deadline, session.id))
+        if wake:
+            self.wake()
+
+    def unwatch(self, session_id):
+        with self.lock:
+            for pidfd, watched_id in list(self.pidfds.items()):
+                if watched_id == session_id:
+                    self.release_pidfd(pidfd)
+            for wd, watched_id in list(self.watches.items()):
+                if watched_id == session_id:
+                    del self.watches[wd]
+                    self.inotify.rm_watch(wd)
+            self.polled.discard(session_id)
+
+    def release_pidfd(self, pidfd):
+        del self.pidfds[pidfd]
+        self.epoll.unregister(pidfd)
+        os.close(pidfd)
+
+    def timeout(self):
+        with self.lock:
+            while self.deadlines:
+                close_time, session_id = self.deadlines[0]
+                session = self.registry.sessions.get(session_id)
+                if session is not None and close_time in [ session.close_time, session.next_check ]:
+                    break
+                heapq.heappop(self.deadlines)
+            timeout = None
+            if self.deadlines:
+                timeout = max(0, self.deadlines[0][0] - time.perf_counter())
+            if self.polled:
+                timeout = min(timeout if timeout is not None else settings.OBSERVER_REAP_INTERVAL, settings.OBSERVER_REAP_INTERVAL)
+            return timeout
+
+    def poll(self):
+        timeout = self.timeout()
+        events = self.epoll.poll(timeout if timeout is not None else -1)
+        with self.lock:
+            for fd, mask in events:
+                if fd == self.wake_read:
+                    try:
+                        while os.read(self.wake_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif self.inotify is not None and fd == self.inotify.fileno():
+                    self.inotify.read()
+                elif fd in self.pidfds:
+                    session_id = self.pidfds[fd]
+                    self.release_pidfd(fd)
+                    if session_id not in self.watches.values():
+                        self.polled.add(session_id)
+        self.registry.cleanup_finished()
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.poll()
+            except:
+                logging.warning(traceback.format_exc())
+                time.sleep(settings.OBSERVER_REAP_INTERVAL)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='kolejka-observer-monitor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+        self.wake()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            for pidfd in list(self.pidfds):
+                self.release_pidfd(pidfd)
+            if self.inotify is not None:
+                self.inotify.close()
+            self.epoll.close()
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
 class SessionRegistry:
     def __init__(self):
         self.sessions = dict()
         self.session_stats = dict()
         self.control_group_system = ControlGroupSystem()
         self.salt = uuid.uuid4().hex 
+        self.lock = threading.RLock()
+        self.monitor = SessionMonitor(self)
 
     def cleanup(self):
         for session_id in dict(self.sessions):
@@ -254,11 +597,16 @@ class SessionRegistry:
 
     def cleanup_finished(self):
         current_time = time.perf_counter()
-        for session_id, session in list(self.sessions.items()):
-            if session.close_time is not None and session.close_time < current_time:
-                self.close(session_id)
-            if session.finished():
-                self.close(session_id)
+        with self.lock:
+            for session_id, session in list(self.sessions.items()):
+                limit = session.exceeded(current_time)
+                if limit is not None:
+                    session.enforce(limit)
+                    self.close(session_id)
+                elif session.finished():
+                    self.close(session_id)
+                elif session.next_check is not None:
+                    self.monitor.schedule(session, wake=False)
         for session_id, stats in list(self.session_stats.items()):
             if session_id in self.sessions:
                 continue
@@ -267,13 +615,14 @@ class SessionRegistry:
                 del self.session_stats[session_id]
 
     def open(self, session_id, pid):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = Session(self, session_id, pid)
+        with self.lock:
+            if session_id not in self.sessions:
+                self.sessions[session_id] = Session(self, session_id, pid)
+                self.monitor.watch(self.sessions[session_id])
 
     def attach(self, session_id, pid):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = Session(self, session_id, pid)
-        return self.sessions[session_id].attach(pid=pid);
+        self.open(session_id, pid)
+        return self.sessions[session_id].attach(pid=pid)
 
     def detach(self, session_id, pid):
         assert session_id in self.sessions
@@ -281,7 +630,9 @@ class SessionRegistry:
 
     def limits(self, session_id, limits=KolejkaLimits()):
         assert session_id in self.sessions
-        return self.sessions[session_id].limits(limits=limits)
+        result = self.sessions[session_id].limits(limits=limits)
+        self.monitor.schedule(self.sessions[session_id])
+        return result
 
     def stats(self, session_id):
         if session_id in self.sessions:
@@ -305,24 +656,28 @@ class SessionRegistry:
         self.sessions[session_id].kill()
 
     def close(self, session_id):
-        if session_id not in self.sessions:
-            return
-        try:
+        with self.lock:
+            if session_id not in self.sessions:
+                return
+            self.monitor.unwatch(session_id)
             try:
-                self.stats(session_id)
+                try:
+                    self.stats(session_id)
+                except:
+                    pass
+                self.sessions[session_id].close()
+                del self.sessions[session_id]
             except:
                 pass
-            self.sessions[session_id].close()
-            del self.sessions[session_id]
-        except:
-            pass
 
 class ObserverServer(socketserver.ThreadingMixIn, HTTPUnixServer):
     def __enter__(self, *args, **kwargs):
         super().__enter__(*args, **kwargs)
         self.session_registry = SessionRegistry()
+        self.session_registry.monitor.start()
         return self
     def __exit__(self, *args, **kwargs):
+        self.session_registry.monitor.stop()
         self.session_registry.cleanup()
         super().__exit__(*args, **kwargs)
 
@@ -358,18 +713,15 @@ class ObserverHandler(http.server.BaseHTTPRequestHandler):
 
     def do_HEAD(self):
         self.mute_log_request = True
-        self.session_registry.cleanup_finished()
         self.send_response(200)
         self.end_headers()
         self.mute_log_request = False
 
     def do_GET(self, params_override={}):
-        self.session_registry.cleanup_finished()
         self.send_response(200)
         self.end_headers()
 
     def do_POST(self):
-        self.session_registry.cleanup_finished()
         try:
             post_data = dict()
             if 'Content-Length' in self.headers:
@@ -553,42 +905,20 @@ class KolejkaObserverServer(ObserverServer):
         assert os.path.isdir(socket_dir_path)
         super().__init__(self.socket_path, ObserverHandler)
 
-    def __enter__(self, *args, **kwargs):
-        super().__enter__(*args, **kwargs)
-        def scheduler_func(parent, socket_path):
-            while os.getppid() == parent:
-                time.sleep(1)
-                try:
-                    connection = HTTPUnixConnection(socket_path)
-                    connection.request('HEAD', '/')
-                    with connection.getresponse() as response:
-                        response.read()
-                    connection.close()
-                except:
-                    traceback.print_exc()
-                    pass
-        self.scheduler = Process(target=scheduler_func, args=(os.getpid(), self.socket_path))
-        self.scheduler.start()
-        return self
-    def __exit__(self, *args, **kwargs):
-        self.scheduler.terminate()
-        self.scheduler.join()
-        return super().__exit__(*args, **kwargs)
-
 def config_parser(parser):
     from kolejka.observer import KolejkaObserverServer
     parser.add_argument('-s', '--socket', type=str, default=settings.OBSERVER_SOCKET, help='listen on socket')
     parser.add_argument('--detach', action='store_true', default=False, help='run in background')
     parser.add_argument('--pid-file', type=str, default=settings.OBSERVER_PID_FILE, help='pid file')
     def execute(args):
-        with KolejkaObserverServer(args.socket) as server:
-            def action():
+        def action():
+            with KolejkaObserverServer(args.socket) as server:
                 return server.serve_forever()
-            if args.detach:
-                with daemon.DaemonContext(pidfile=args.pid_file):
-                    action()
-            else:
+        if args.detach:
+            with daemon.DaemonContext(pidfile=args.pid_file):
                 action()
+        else:
+            action()
     parser.set_defaults(execute=execute)
 
 def main():
@@ -13,3 +13,7 @@ class BlobAdmin(admin.ModelAdmin):
 @admin.register(models.Reference)
 class ReferenceAdmin(admin.ModelAdmin):
     pass
+
+@admin.register(models.Upload)
+class UploadAdmin(admin.ModelAdmin):
+    pass
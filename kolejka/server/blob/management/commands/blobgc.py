@@ -0,0 +1,197 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+"""
+Management utility to collect unreferenced blobs.
+"""
+
+from django.conf import settings
+
+import datetime
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import ProtectedError
+from django.utils import timezone
+
+from kolejka.common.parse import parse_time
+from kolejka.server.blob.models import Blob, Reference, Upload, flush_access
+from kolejka.server.blob.storage import FileSystemStorage, blob_storage
+
+class Command(BaseCommand):
+    help = 'Used to collect unreferenced blobs, references and stale uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=parse_time,
+            default=settings.BLOB_GC_GRACE,
+            help='Unused objects younger than this are kept.',
+        )
+        parser.add_argument(
+            '--delete-grace',
+            type=parse_time,
+            default=settings.BLOB_GC_DELETE_GRACE,
+            help='Inactive blobs are deleted after this time.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.BLOB_GC_BATCH_SIZE,
+            help='Number of objects processed in one query.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help='Only report what would be collected.',
+        )
+
+    def batches(self, queryset):
+        last = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last).order_by('pk').distinct()[:self.batch_size])
+            if len(batch) == 0:
+                break
+            last = batch[-1].pk
+            yield batch
+
+    def report(self, name, count):
+        if self.verbosity > 0:
+            self.stdout.write(f'{name}: {count}')
+
+    def collect_references(self, cutoff):
+        count = 0
+        queryset = Reference.objects.filter(permanent=False, time_access__lt=cutoff, task__isnull=True, result__isnull=True)
+        for batch in self.batches(queryset):
+            count += len(batch)
+            if not self.dry_run:
+                queryset.filter(pk__in=[ reference.pk for reference in batch ]).delete()
+        self.report('references deleted', count)
+
+    def deactivate_blobs(self, cutoff):
+        count = 0
+        for batch in self.batches(Blob.objects.filter(active=True, time_access__lt=cutoff, reference__isnull=True)):
+            for blob in batch:
+                count += 1
+                if not self.dry_run:
+                    blob.deactivate()
+        self.report('blobs deactivated', count)
+
+    def activate_blobs(self):
+        count = 0
+        for batch in self.batches(Blob.objects.filter(active=False, reference__isnull=False)):
+            for blob in batch:
+                count += 1
+                if not self.dry_run:
+                    blob.activate()
+        self.report('blobs activated', count)
+
+    def delete_blobs(self, cutoff):
+        count = 0
+        for batch in self.batches(Blob.objects.filter(active=False, time_access__lt=cutoff, reference__isnull=True)):
+            for blob in batch:
+                if self.dry_run:
+                    count += 1
+                    continue
+                key = blob.key
+                try:
+                    blob.delete()
+                except ProtectedError:
+                    continue
+                count += 1
+                blob_storage().delete(key)
+        self.report('blobs deleted', count)
+
+    def collect_uploads(self, cutoff):
+        count = 0
+        for batch in self.batches(Upload.objects.filter(time_access__lt=cutoff)):
+            count += len(batch)
+            if not self.dry_run:
+                for upload in batch:
+                    upload.delete()
+        self.report('uploads deleted', count)
+
+    def old_files(self, path, cutoff):
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    if os.stat(file_path).st_mtime < cutoff:
+                        yield root, name, file_path
+                except FileNotFoundError:
+                    pass
+
+    def unlink(self, path):
+        if not self.dry_run:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def collect_temp(self, cutoff):
+        count = 0
+        temp_path = os.path.join(settings.BLOB_STORE_PATH, 'temp')
+        for root, name, file_path in self.old_files(temp_path, cutoff):
+            count += 1
+            self.unlink(file_path)
+        today = os.path.join(temp_path, datetime.datetime.now().strftime('%Y/%m/%d'))
+        if not self.dry_run and os.path.isdir(temp_path):
+            for root, dirs, files in os.walk(temp_path, topdown=False):
+                if root != temp_path and not (today + os.sep).startswith(root + os.sep) and len(os.listdir(root)) == 0:
+                    os.rmdir(root)
+        decoded_path = os.path.join(settings.BLOB_STORE_PATH, 'decoded')
+        for root, name, file_path in self.old_files(decoded_path, cutoff):
+            count += 1
+            self.unlink(file_path)
+        upload_path = os.path.join(settings.BLOB_STORE_PATH, 'upload')
+        for batch in self.file_batches(self.old_files(upload_path, cutoff)):
+            keys = set(Upload.objects.filter(key__in=[ name for root, name, file_path in batch ]).values_list('key', flat=True))
+            for root, name, file_path in batch:
+                if name not in keys:
+                    count += 1
+                    self.unlink(file_path)
+        self.report('temporary files deleted', count)
+
+    def file_batches(self, files):
+        batch = list()
+        for item in files:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = list()
+        if len(batch) > 0:
+            yield batch
+
+    def collect_files(self, cutoff):
+        storage = blob_storage()
+        if not isinstance(storage, FileSystemStorage):
+            return
+        count = 0
+        for subdir in [ 'blob', 'inactive' ]:
+            path = os.path.join(storage.path, subdir)
+            for batch in self.file_batches(self.old_files(path, cutoff)):
+                names = dict()
+                for root, name, file_path in batch:
+                    names[''.join(os.path.relpath(root, path).split(os.sep)) + name] = file_path
+                keys = set(Blob.objects.filter(key__in=list(names.keys())).values_list('key', flat=True))
+                for key, file_path in names.items():
+                    if key not in keys:
+                        count += 1
+                        self.unlink(file_path)
+        self.report('orphaned blob files deleted', count)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        flush_access()
+        now = timezone.now()
+        cutoff = now - options['grace'] - settings.BLOB_ACCESS_INTERVAL
+        self.collect_references(cutoff)
+        self.activate_blobs()
+        self.deactivate_blobs(cutoff)
+        self.delete_blobs(now - options['delete_grace'])
+        self.collect_uploads(cutoff)
+        file_cutoff = time.time() - options['grace'].total_seconds()
+        self.collect_temp(file_cutoff)
+        self.collect_files(file_cutoff)
@@ -2,17 +2,22 @@
 
 from django.conf import settings
 
+import atexit
 import datetime
 import os
-import shutil
+import threading
 import uuid
 
-from django.db import models
+from django.db import connections, models
+from django.utils import timezone
+
+from .storage import blob_storage
 
 class Blob(models.Model):
     key         = models.CharField(max_length=64, unique=True, null=False)
     active      = models.BooleanField(default=True, null=False)
     size        = models.BigIntegerField(null=False)
+    encoding    = models.CharField(max_length=16, null=True, blank=True)
     time_create = models.DateTimeField(auto_now_add=True, null=False)
     time_access = models.DateTimeField(auto_now=True, null=False)
 
@@ -25,20 +30,18 @@ class Blob(models.Model):
         return os.path.join(dirname, filename)
 
     @staticmethod
-    def blob_store_path(key):
-        subdir = f'blob/{key[0:2]}/{key[2:4]}/{key[4:6]}'
-        dirname = os.path.join(settings.BLOB_STORE_PATH, subdir)
+    def blob_decoded_path(key):
+        dirname = os.path.join(settings.BLOB_STORE_PATH, 'decoded')
         os.makedirs(dirname, exist_ok=True)
-        filename = key[6:]
-        return os.path.join(dirname, filename)
+        return os.path.join(dirname, key)
+
+    @staticmethod
+    def blob_store_path(key):
+        return blob_storage().store_path(key)
 
     @staticmethod
     def blob_inactive_path(key):
-        subdir = f'inactive/{key[0:2]}/{key[2:4]}/{key[4:6]}'
-        dirname = os.path.join(settings.BLOB_STORE_PATH, subdir)
-        os.makedirs(dirname, exist_ok=True)
-        filename = key[6:]
-        return os.path.join(dirname, filename)
+        return blob_storage().inactive_path(key)
 
     @property
     def store_path(self):
@@ -50,34 +53,31 @@ class Blob(models.Model):
 
     @property
     def realpath(self):
-        if os.path.exists(self.store_path):
-            return os.path.realpath(self.store_path)
-        if os.path.exists(self.inactive_path):
-            return os.path.realpath(self.inactive_path)
+        return blob_storage().realpath(self.key)
+
+    def url(self, encoding=None):
+        return blob_storage().url(self.key, active=self.active, encoding=encoding)
 
-    def open(self):
-        if os.path.exists(self.store_path):
-            return open(self.store_path, "rb")
-        if os.path.exists(self.inactive_path):
-            return open(self.inactive_path, "rb")
+    def open(self, start=0):
+        return blob_storage().open(self.key, start=start, active=self.active)
+
+    def store(self, temp_file):
+        blob_storage().store(self.key, temp_file)
+
+    def exists(self):
+        return blob_storage().exists(self.key)
 
     def deactivate(self):
         if self.reference_set.count() > 0:
             return
         self.active = False
         self.save()
-        if os.path.exists(self.store_path) and not os.path.exists(self.inactive_path):
-            shutil.move(self.store_path, self.inactive_path)
-        if os.path.exists(self.inactive_path) and os.path.exists(self.store_path):
-            os.unlink(self.store_path)
+        blob_storage().deactivate(self.key)
 
     def activate(self):
         self.active = True
         self.save()
-        if os.path.exists(self.inactive_path) and not os.path.exists(self.store_path):
-            shutil.move(self.inactive_path, self.store_path)
-        if os.path.exists(self.store_path) and os.path.exists(self.inactive_path):
-            os.unlink(self.inactive_path)
+        blob_storage().activate(self.key)
 
 class Reference(models.Model):
     user        = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -88,8 +88,87 @@ class Reference(models.Model):
     permanent   = models.BooleanField(default=False, null=False)
     public      = models.BooleanField(default=False, null=False)
 
+class Upload(models.Model):
+    user        = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key         = models.CharField(max_length=64, unique=True, null=False)
+    size        = models.BigIntegerField(null=False)
+    hash        = models.CharField(max_length=64, null=True, blank=True)
+    time_create = models.DateTimeField(auto_now_add=True, null=False)
+    time_access = models.DateTimeField(auto_now=True, null=False)
+
+    @staticmethod
+    def upload_temp_path(key):
+        dirname = os.path.join(settings.BLOB_STORE_PATH, 'upload')
+        os.makedirs(dirname, exist_ok=True)
+        return os.path.join(dirname, key)
+
+    @property
+    def temp_path(self):
+        return Upload.upload_temp_path(self.key)
+
+    @property
+    def offset(self):
+        if os.path.exists(self.temp_path):
+            return os.path.getsize(self.temp_path)
+        return 0
+
+class AccessTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = dict()
+        self.timer = None
+
+    def touch(self, *instances):
+        now = timezone.now()
+        threshold = now - settings.BLOB_ACCESS_INTERVAL
+        with self.lock:
+            for instance in instances:
+                if instance.time_access is not None and instance.time_access > threshold:
+                    continue
+                self.pending.setdefault(type(instance), set()).add(instance.pk)
+                instance.time_access = now
+            if len(self.pending) > 0 and self.timer is None:
+                self.timer = threading.Timer(settings.BLOB_ACCESS_INTERVAL.total_seconds(), self.flush_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush_timer(self):
+        try:
+            self.flush()
+        finally:
+            connections.close_all()
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = dict()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        now = timezone.now()
+        for model, pks in pending.items():
+            pks = sorted(pks)
+            for start in range(0, len(pks), settings.BLOB_GC_BATCH_SIZE):
+                model.objects.filter(pk__in=pks[start:start+settings.BLOB_GC_BATCH_SIZE]).update(time_access=now)
+
+access_tracker = AccessTracker()
+
+def touch(*instances):
+    access_tracker.touch(*instances)
+
+def flush_access():
+    access_tracker.flush()
+
+atexit.register(flush_access)
+
 def reference_init(instance, **kwargs):
     if not instance.key:
         instance.key = uuid.uuid4().hex
 
+def upload_delete(instance, **kwargs):
+    if os.path.exists(instance.temp_path):
+        os.unlink(instance.temp_path)
+
 models.signals.post_init.connect(reference_init, Reference)
+models.signals.post_init.connect(reference_init, Upload)
+models.signals.post_delete.connect(upload_delete, Upload)
@@ -0,0 +1,172 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from django.conf import settings
+
+import os
+import shutil
+
+from django.utils.module_loading import import_string
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+class BlobStorage:
+    def exists(self, key):
+        raise NotImplementedError()
+
+    def open(self, key, start=0, active=True):
+        raise NotImplementedError()
+
+    def realpath(self, key):
+        return None
+
+    def store_path(self, key):
+        return None
+
+    def inactive_path(self, key):
+        return None
+
+    def url(self, key, active=True, encoding=None):
+        return None
+
+    def store(self, key, temp_file):
+        raise NotImplementedError()
+
+    def activate(self, key):
+        raise NotImplementedError()
+
+    def deactivate(self, key):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+class FileSystemStorage(BlobStorage):
+    def __init__(self, path=None):
+        self._path = path
+
+    @property
+    def path(self):
+        return self._path or settings.BLOB_STORE_PATH
+
+    def key_path(self, subdir, key):
+        dirname = os.path.join(self.path, subdir, key[0:2], key[2:4], key[4:6])
+        os.makedirs(dirname, exist_ok=True)
+        return os.path.join(dirname, key[6:])
+
+    def store_path(self, key):
+        return self.key_path('blob', key)
+
+    def inactive_path(self, key):
+        return self.key_path('inactive', key)
+
+    def exists(self, key):
+        return os.path.exists(self.store_path(key)) or os.path.exists(self.inactive_path(key))
+
+    def realpath(self, key):
+        for path in [ self.store_path(key), self.inactive_path(key) ]:
+            if os.path.exists(path):
+                return os.path.realpath(path)
+
+    def open(self, key, start=0, active=True):
+        path = self.realpath(key)
+        if path is not None:
+            blob_file = open(path, 'rb')
+            if start > 0:
+                blob_file.seek(start)
+            return blob_file
+
+    def store(self, key, temp_file):
+        os.rename(temp_file, self.store_path(key))
+
+    def move(self, source, destination):
+        if os.path.exists(source) and not os.path.exists(destination):
+            shutil.move(source, destination)
+        if os.path.exists(destination) and os.path.exists(source):
+            os.unlink(source)
+
+    def activate(self, key):
+        self.move(self.inactive_path(key), self.store_path(key))
+
+    def deactivate(self, key):
+        self.move(self.store_path(key), self.inactive_path(key))
+
+    def delete(self, key):
+        for path in [ self.store_path(key), self.inactive_path(key) ]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+def s3_missing(error):
+    return getattr(error, 'response', dict()).get('Error', dict()).get('Code') in [ '404', 'NoSuchKey', 'NotFound' ]
+
+class S3Storage(BlobStorage):
+    def __init__(self, bucket, prefix='', client=None, **kwargs):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError('S3 blob storage requires boto3')
+            client = boto3.client('s3', **kwargs)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def object_key(self, key, active=True):
+        return f'{self.prefix}{"blob" if active else "inactive"}/{key}'
+
+    def object_exists(self, object_key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=object_key)
+            return True
+        except Exception as e:
+            if s3_missing(e):
+                return False
+            raise
+
+    def exists(self, key):
+        return self.object_exists(self.object_key(key, True)) or self.object_exists(self.object_key(key, False))
+
+    def open(self, key, start=0, active=True):
+        params = dict()
+        if start > 0:
+            params['Range'] = f'bytes={start}-'
+        for state in [ active, not active ]:
+            try:
+                return self.client.get_object(Bucket=self.bucket, Key=self.object_key(key, state), **params)['Body']
+            except Exception as e:
+                if not s3_missing(e):
+                    raise
+
+    def url(self, key, active=True, encoding=None):
+        params = { 'Bucket' : self.bucket, 'Key' : self.object_key(key, active) }
+        if encoding is not None:
+            params['ResponseContentEncoding'] = encoding
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=int(settings.BLOB_STORAGE_URL_EXPIRES.total_seconds()))
+
+    def store(self, key, temp_file):
+        self.client.upload_file(temp_file, self.bucket, self.object_key(key, True))
+        os.unlink(temp_file)
+
+    def move(self, source, destination):
+        if self.object_exists(source):
+            if not self.object_exists(destination):
+                self.client.copy({ 'Bucket' : self.bucket, 'Key' : source }, self.bucket, destination)
+            self.client.delete_object(Bucket=self.bucket, Key=source)
+
+    def activate(self, key):
+        self.move(self.object_key(key, False), self.object_key(key, True))
+
+    def deactivate(self, key):
+        self.move(self.object_key(key, True), self.object_key(key, False))
+
+    def delete(self, key):
+        for state in [ True, False ]:
+            self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key, state))
+
+_storages = dict()
+
+def blob_storage():
+    cache_key = (settings.BLOB_STORAGE, repr(sorted(settings.BLOB_STORAGE_OPTIONS.items())))
+    if cache_key not in _storages:
+        _storages[cache_key] = import_string(settings.BLOB_STORAGE)(**settings.BLOB_STORAGE_OPTIONS)
+    return _storages[cache_key]
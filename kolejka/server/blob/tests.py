@@ -2,5 +2,443 @@
 
 from django.conf import settings
 
-from django.test import TestCase
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
 
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from kolejka.server.blob import views
+from kolejka.server.blob.models import Blob, Reference, Upload, access_tracker, flush_access
+from kolejka.server.blob.storage import S3Storage
+from kolejka.server.task.models import Task
+
+class BlobTestCase(TestCase):
+    permissions = [ 'add_reference' ]
+    blob_settings = dict()
+
+    def setUp(self):
+        self.store = tempfile.mkdtemp()
+        self.override = override_settings(BLOB_STORE_PATH=self.store, **self.blob_settings)
+        self.override.enable()
+        self.user = self.create_user('user', *self.permissions)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.store)
+
+    def create_user(self, username, *permissions):
+        user = User.objects.create_user(username)
+        for codename in permissions:
+            user.user_permissions.add(Permission.objects.get(codename=codename, content_type__app_label='blob'))
+        return user
+
+    def upload(self, data, **headers):
+        return self.client.post('/blob/reference/', data=data, content_type='application/octet-stream', headers=headers).json()
+
+    def download(self, key, **headers):
+        response = self.client.get(f'/blob/reference/{key}/', headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+class BulkTest(BlobTestCase):
+    permissions = [ 'view_blob' ]
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.create_user('owner', 'add_reference')
+
+    def share(self, data):
+        self.client.force_login(self.owner)
+        return self.upload(data)['reference']
+
+    def bulk(self, blobs=[], references=[]):
+        response = self.client.post('/blob/bulk/', data=json.dumps({ 'blobs' : blobs, 'references' : references }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_references(self):
+        reference = self.share(b'data')
+        response = self.bulk(references=[reference['key'], 'missing'])
+        self.assertEqual(list(response['references']), [reference['key']])
+        self.client.force_login(self.user)
+        self.assertEqual(self.bulk(references=[reference['key']])['references'], {})
+
+    def test_blobs(self):
+        reference = self.share(b'data')
+        missing = hashlib.new(settings.BLOB_HASH_ALGORITHM, b'other').hexdigest()
+        self.client.force_login(self.user)
+        response = self.bulk(blobs=[reference['blob'], missing])
+        self.assertEqual(list(response['blobs']), [reference['blob']])
+        created = Reference.objects.get(key=response['blobs'][reference['blob']]['key'])
+        self.assertEqual(created.user, self.user)
+        self.assertEqual(created.blob.key, reference['blob'])
+
+class UploadTest(BlobTestCase):
+    blob_settings = { 'BLOB_BUFFER_SIZE' : 1024 }
+
+    def test_large_upload(self):
+        data = bytes(range(256)) * 100
+        response = self.upload(data)
+        self.assertEqual(response['reference']['blob'], hashlib.new(settings.BLOB_HASH_ALGORITHM, data).hexdigest())
+        self.assertEqual(response['reference']['size'], len(data))
+        with Reference.objects.get(key=response['reference']['key']).blob.open() as blob_file:
+            self.assertEqual(blob_file.read(), data)
+
+    def test_declared_hash(self):
+        data = b'data'
+        key = hashlib.new(settings.BLOB_HASH_ALGORITHM, data).hexdigest()
+        self.assertEqual(self.upload(data, X_BLOB_HASH=key)['status'], 'OK')
+        self.assertEqual(self.upload(data, X_BLOB_HASH='0'*len(key))['status'], 'FAIL')
+
+class RangeTest(BlobTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = bytes(range(256)) * 4
+        self.reference = self.upload(self.data)['reference']
+
+    def get(self, **headers):
+        return self.download(self.reference['key'], **headers)
+
+    def test_full(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(content, self.data)
+
+    def test_range(self):
+        response, content = self.get(Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(content, self.data[100:200])
+        response, content = self.get(Range='bytes=1000-')
+        self.assertEqual(content, self.data[1000:])
+        response, content = self.get(Range='bytes=-10')
+        self.assertEqual(content, self.data[-10:])
+        response, content = self.get(Range='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        response, content = self.get(Range='bytes=10-', If_Range=etag)
+        self.assertEqual(content, self.data[10:])
+        response, content = self.get(Range='bytes=10-', If_Range='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.data)
+
+class ResumableUploadTest(BlobTestCase):
+    def chunk(self, upload, offset, data):
+        return self.client.post(f'/blob/upload/{upload}/', data=data, content_type='application/octet-stream', headers={'X-Upload-Offset' : str(offset)}).json()
+
+    def test_resume(self):
+        data = b'0123456789' * 10
+        key = hashlib.new(settings.BLOB_HASH_ALGORITHM, data).hexdigest()
+        upload = self.client.post('/blob/upload/', data=json.dumps({'size' : len(data), 'hash' : key}), content_type='application/json').json()['upload']
+        self.assertEqual(upload['offset'], 0)
+        self.assertEqual(self.chunk(upload['key'], 0, data[0:40])['upload']['offset'], 40)
+        self.assertEqual(self.chunk(upload['key'], 20, data[20:60])['status'], 'FAIL')
+        self.assertEqual(self.chunk(upload['key'], 40, data[40:] + b'extra')['status'], 'FAIL')
+        self.assertEqual(self.client.put(f'/blob/upload/{upload["key"]}/').json()['upload']['offset'], 40)
+        response = self.chunk(upload['key'], 40, data[40:])
+        self.assertEqual(response['reference']['blob'], key)
+        with Reference.objects.get(key=response['reference']['key']).blob.open() as blob_file:
+            self.assertEqual(blob_file.read(), data)
+        self.assertEqual(self.client.put(f'/blob/upload/{upload["key"]}/').status_code, 404)
+
+    def test_receive_outside_transaction(self):
+        data = b'0123456789' * 10
+        upload = self.client.post('/blob/upload/', data=json.dumps({'size' : len(data)}), content_type='application/json').json()['upload']
+        savepoints = len(connection.savepoint_ids)
+        receive = views.blob_receive
+        depths = list()
+        def tracked(*args, **kwargs):
+            depths.append(len(connection.savepoint_ids))
+            return receive(*args, **kwargs)
+        with mock.patch.object(views, 'blob_receive', tracked):
+            self.assertEqual(self.chunk(upload['key'], 0, data)['upload']['offset'], len(data))
+        self.assertEqual(depths, [ savepoints ])
+
+class CompressionTest(BlobTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = b'kolejka ' * 1000
+
+    def test_compressed_upload(self):
+        response = self.upload(gzip.compress(self.data), Content_Encoding='gzip')
+        self.assertEqual(response['reference']['blob'], hashlib.new(settings.BLOB_HASH_ALGORITHM, self.data).hexdigest())
+        self.assertEqual(response['reference']['size'], len(self.data))
+        self.assertEqual(self.upload(self.data, Content_Encoding='br')['status'], 'FAIL')
+
+    @override_settings(BLOB_STORE_ENCODING='gzip')
+    def test_compressed_storage(self):
+        key = self.upload(self.data)['reference']['key']
+        blob = Reference.objects.get(key=key).blob
+        self.assertEqual(blob.encoding, 'gzip')
+        self.assertLess(os.path.getsize(blob.store_path), len(self.data))
+        response, content = self.download(key)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(content, self.data)
+        response, content = self.download(key, Accept_Encoding='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content), self.data)
+        response, content = self.download(key, Range='bytes=4000-4999')
+        self.assertEqual(content, self.data[4000:5000])
+        decoded_path = Blob.blob_decoded_path(blob.key)
+        self.assertTrue(os.path.exists(decoded_path))
+        response, content = self.download(key, Range='bytes=7000-')
+        self.assertEqual(content, self.data[7000:])
+        response, content = self.download(key, Range='bytes=0-99')
+        self.assertEqual(content, self.data[0:100])
+
+    @override_settings(BLOB_STORE_ENCODING='gzip', BLOB_DECODED_CACHE_SIZE=12000)
+    def test_decoded_cache_size(self):
+        blobs = list()
+        for data in [ b'first ' * 1000, b'second ' * 1000, b'third ' * 3000 ]:
+            key = self.upload(data)['reference']['key']
+            blobs.append(Reference.objects.get(key=key).blob)
+            response, content = self.download(key, Range='bytes=100-199')
+            self.assertEqual(content, data[100:200])
+        first, second, third = [ os.path.exists(Blob.blob_decoded_path(blob.key)) for blob in blobs ]
+        self.assertFalse(first)
+        self.assertTrue(second)
+        self.assertFalse(third)
+
+    @override_settings(BLOB_BUFFER_SIZE=1024, BLOB_DECODE_MAX_RATIO=10)
+    def test_decompression_ratio(self):
+        response = self.upload(gzip.compress(b'\0' * 1024 * 1024), Content_Encoding='gzip')
+        self.assertEqual(response['status'], 'FAIL')
+        self.assertEqual(Blob.objects.count(), 0)
+
+    @override_settings(BLOB_DECODE_MAX_SIZE=1000)
+    def test_decompression_size(self):
+        response = self.upload(gzip.compress(self.data), Content_Encoding='gzip')
+        self.assertEqual(response['status'], 'FAIL')
+        response = self.upload(gzip.compress(self.data[0:1000]), Content_Encoding='gzip')
+        self.assertEqual(response['reference']['size'], 1000)
+
+    @override_settings(BLOB_COMPRESS_DOWNLOADS=True)
+    def test_compressed_download(self):
+        key = self.upload(self.data)['reference']['key']
+        response, content = self.download(key, Accept_Encoding='gzip;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(content), self.data)
+        response, content = self.download(key, Accept_Encoding='identity')
+        self.assertEqual(content, self.data)
+
+class GarbageCollectorTest(BlobTestCase):
+    permissions = []
+
+    def reference(self, data):
+        temp_file = Blob.blob_temp_path()
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        blob = Blob.objects.create(key=hashlib.new(settings.BLOB_HASH_ALGORITHM, data).hexdigest(), size=len(data))
+        os.rename(temp_file, blob.store_path)
+        return Reference.objects.create(blob=blob, user=self.user)
+
+    def age(self, days):
+        past = timezone.now() - datetime.timedelta(days=days)
+        Reference.objects.update(time_access=past)
+        Blob.objects.update(time_access=past)
+        Upload.objects.update(time_access=past)
+
+    def collect(self):
+        call_command('blobgc', verbosity=0)
+
+    def test_collect(self):
+        live = self.reference(b'live')
+        dead = self.reference(b'dead')
+        fresh = self.reference(b'fresh')
+        task = Task.objects.create(user=self.user, description='{}')
+        task.files.add(live)
+        Reference.objects.filter(pk=fresh.pk).update(permanent=True)
+        self.age(2)
+        self.collect()
+        self.assertEqual(set(Reference.objects.values_list('pk', flat=True)), set([live.pk, fresh.pk]))
+        blob = Blob.objects.get(pk=dead.blob.pk)
+        self.assertFalse(blob.active)
+        self.assertTrue(os.path.exists(blob.inactive_path))
+        self.assertFalse(os.path.exists(blob.store_path))
+        self.assertTrue(Blob.objects.get(pk=live.blob.pk).active)
+        self.age(8)
+        self.collect()
+        self.assertFalse(Blob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(os.path.exists(blob.inactive_path))
+        self.assertTrue(os.path.exists(live.blob.store_path))
+
+    def test_reactivate(self):
+        dead = self.reference(b'dead')
+        self.age(2)
+        self.collect()
+        blob = Blob.objects.get(pk=dead.blob.pk)
+        Reference.objects.create(blob=blob, user=self.user)
+        self.collect()
+        blob = Blob.objects.get(pk=blob.pk)
+        self.assertTrue(blob.active)
+        self.assertTrue(os.path.exists(blob.store_path))
+
+    def test_temporary_files(self):
+        stale = Blob.blob_temp_path()
+        fresh = Blob.blob_temp_path()
+        orphan = Blob.blob_store_path('0'*64)
+        for path in [ stale, fresh, orphan ]:
+            with open(path, 'wb') as f:
+                f.write(b'data')
+        past = time.time() - 2*24*60*60
+        for path in [ stale, orphan ]:
+            os.utime(path, (past, past))
+        upload = Upload.objects.create(user=self.user, size=4)
+        with open(upload.temp_path, 'wb') as f:
+            f.write(b'da')
+        self.age(2)
+        self.collect()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertFalse(Upload.objects.filter(pk=upload.pk).exists())
+        self.assertFalse(os.path.exists(upload.temp_path))
+
+@override_settings(BLOB_ACCESS_INTERVAL=datetime.timedelta(hours=1))
+class AccessTest(BlobTestCase):
+    def setUp(self):
+        super().setUp()
+        self.key = self.upload(b'data')['reference']['key']
+        flush_access()
+        self.past = timezone.now() - datetime.timedelta(days=1)
+        Reference.objects.update(time_access=self.past)
+        Blob.objects.update(time_access=self.past)
+
+    def test_coalesced(self):
+        for i in range(3):
+            response = self.client.get(f'/blob/reference/{self.key}/')
+            self.assertEqual(b''.join(response.streaming_content), b'data')
+        self.assertEqual(Reference.objects.get(key=self.key).time_access, self.past)
+        flush_access()
+        reference = Reference.objects.get(key=self.key)
+        self.assertGreater(reference.time_access, self.past)
+        self.assertGreater(reference.blob.time_access, self.past)
+
+    def test_timer(self):
+        response = self.client.get(f'/blob/reference/{self.key}/')
+        self.assertEqual(b''.join(response.streaming_content), b'data')
+        timer = access_tracker.timer
+        self.assertIsNotNone(timer)
+        self.assertEqual(timer.interval, 60*60)
+        self.assertTrue(timer.daemon)
+        flush_access()
+        self.assertIsNone(access_tracker.timer)
+        self.assertTrue(timer.finished.is_set())
+
+    @override_settings(BLOB_ACCESS_INTERVAL=datetime.timedelta(microseconds=1))
+    def test_no_inline_flush(self):
+        time.sleep(0.01)
+        with mock.patch.object(access_tracker, 'flush') as flush, mock.patch('threading.Timer') as timer:
+            response = self.client.get(f'/blob/reference/{self.key}/')
+            self.assertEqual(b''.join(response.streaming_content), b'data')
+            flush.assert_not_called()
+            timer.return_value.start.assert_called_once()
+        access_tracker.timer = None
+        flush_access()
+
+class FakeS3Error(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = { 'Error' : { 'Code' : code } }
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = dict()
+
+    def get(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeS3Error('NoSuchKey')
+        return self.objects[(Bucket, Key)]
+
+    def head_object(self, Bucket, Key):
+        return { 'ContentLength' : len(self.get(Bucket, Key)) }
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.get(Bucket, Key)
+        if Range is not None:
+            data = data[int(Range[len('bytes='):].rstrip('-')):]
+        return { 'Body' : io.BytesIO(data) }
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, 'rb') as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def copy(self, CopySource, Bucket, Key):
+        self.objects[(Bucket, Key)] = self.get(CopySource['Bucket'], CopySource['Key'])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f'https://s3.example.com/{Params["Bucket"]}/{Params["Key"]}?expires={ExpiresIn}'
+
+class FileSystemStorageTest(BlobTestCase):
+    def setUp(self):
+        self.blobs = tempfile.mkdtemp()
+        self.blob_settings = { 'BLOB_STORAGE_OPTIONS' : { 'path' : self.blobs } }
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.blobs)
+
+    def test_paths(self):
+        reference = self.upload(b'data')['reference']
+        blob = Blob.objects.get(key=reference['blob'])
+        self.assertTrue(blob.store_path.startswith(self.blobs + os.sep))
+        self.assertTrue(os.path.exists(blob.store_path))
+        self.assertTrue(blob.inactive_path.startswith(self.blobs + os.sep))
+
+class S3StorageTest(BlobTestCase):
+    def setUp(self):
+        self.s3 = FakeS3Client()
+        self.blob_settings = { 'BLOB_STORAGE' : 'kolejka.server.blob.storage.S3Storage', 'BLOB_STORAGE_OPTIONS' : { 'bucket' : 'kolejka', 'prefix' : 'blobs/', 'client' : self.s3 } }
+        super().setUp()
+        self.data = bytes(range(256)) * 4
+        self.reference = self.upload(self.data)['reference']
+
+    def get(self, **headers):
+        return self.download(self.reference['key'], **headers)
+
+    def test_store(self):
+        self.assertEqual(self.s3.objects[('kolejka', f'blobs/blob/{self.reference["blob"]}')], self.data)
+        self.assertIsNone(Blob.objects.get(key=self.reference['blob']).store_path)
+        self.assertEqual(os.listdir(os.path.join(self.store, 'temp', datetime.datetime.now().strftime('%Y/%m/%d'))), [])
+        response, content = self.get()
+        self.assertEqual(content, self.data)
+        response, content = self.get(Range='bytes=1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.data[1000:])
+
+    @override_settings(BLOB_STORAGE_REDIRECT=True)
+    def test_redirect(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(f'https://s3.example.com/kolejka/blobs/blob/{self.reference["blob"]}'))
+        response = self.client.head(f'/blob/reference/{self.reference["key"]}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_tiers(self):
+        Reference.objects.all().delete()
+        blob = Blob.objects.get(key=self.reference['blob'])
+        blob.deactivate()
+        self.assertEqual(list(self.s3.objects.keys()), [ ('kolejka', f'blobs/inactive/{blob.key}') ])
+        with blob.open() as blob_file:
+            self.assertEqual(blob_file.read(), self.data)
+        blob.activate()
+        self.assertEqual(list(self.s3.objects.keys()), [ ('kolejka', f'blobs/blob/{blob.key}') ])
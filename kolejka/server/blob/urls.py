@@ -9,6 +9,9 @@ from . import views
 app_name = 'blob'
 urlpatterns = [
     path('blob/<key>/', views.blob),
+    path('bulk/', views.bulk),
+    path('upload/', views.upload),
+    path('upload/<key>/', views.upload),
     path('reference/', views.reference),
     path('reference/<key>/', views.reference),
 ]
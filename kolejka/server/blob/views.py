@@ -2,17 +2,275 @@
 
 from django.conf import settings
 
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
 import hashlib
+import json
 import os
+import re
 
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, FileResponse
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotAllowed, HttpResponseRedirect, FileResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from kolejka.common.compression import DecompressionLimitExceeded, available_encodings, decode_chunks, decode_writer, encode_chunks, file_chunks
+
 from . import models
 
 from kolejka.server.response import OKResponse, FAILResponse
 
-READ_BUF_SIZE = 8192
+FORM_CONTENT_TYPES = [ 'multipart/form-data', 'application/x-www-form-urlencoded' ]
+
+def request_readinto(request):
+    stream = request.META.get('wsgi.input')
+    remaining = int(request.META.get('CONTENT_LENGTH') or 0)
+    if stream is None or not hasattr(stream, 'readinto') or remaining <= 0 or request.content_type in FORM_CONTENT_TYPES:
+        def readinto(view):
+            buf = request.read(len(view))
+            view[0:len(buf)] = buf
+            return len(buf)
+        return readinto
+    def readinto(view):
+        nonlocal remaining
+        if remaining <= 0:
+            return 0
+        count = stream.readinto(view[0:min(len(view), remaining)]) or 0
+        remaining -= count
+        return count
+    return readinto
+
+def blob_receive(request, blob_file, hasher=None, encoding=None):
+    readinto = request_readinto(request)
+    file_size = 0
+    received = 0
+    def write(data):
+        nonlocal file_size
+        file_size += len(data)
+        if encoding is not None:
+            if settings.BLOB_DECODE_MAX_SIZE is not None and file_size > settings.BLOB_DECODE_MAX_SIZE:
+                raise DecompressionLimitExceeded(f'Decoded size exceeds {settings.BLOB_DECODE_MAX_SIZE} bytes')
+            if settings.BLOB_DECODE_MAX_RATIO is not None and file_size > max(settings.BLOB_BUFFER_SIZE, settings.BLOB_DECODE_MAX_RATIO * received):
+                raise DecompressionLimitExceeded(f'Compression ratio exceeds {settings.BLOB_DECODE_MAX_RATIO}')
+        if hasher is not None:
+            hasher.update(data)
+        data = memoryview(data)
+        while len(data) > 0:
+            data = data[blob_file.write(data):]
+    decoder = None
+    if encoding is not None:
+        decoder = decode_writer(encoding, write, settings.BLOB_BUFFER_SIZE)
+    def consume(chunk):
+        nonlocal received
+        received += len(chunk)
+        if decoder is not None:
+            decoder.write(chunk)
+        else:
+            write(chunk)
+    buffers = [ memoryview(bytearray(settings.BLOB_BUFFER_SIZE)) ]
+    if int(request.META.get('CONTENT_LENGTH') or 0) <= settings.BLOB_BUFFER_SIZE:
+        while True:
+            count = readinto(buffers[0])
+            if count == 0:
+                break
+            consume(buffers[0][0:count])
+    else:
+        buffers.append(memoryview(bytearray(settings.BLOB_BUFFER_SIZE)))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = None
+            index = 0
+            while True:
+                count = readinto(buffers[index])
+                if pending is not None:
+                    pending.result()
+                    pending = None
+                if count == 0:
+                    break
+                pending = executor.submit(consume, buffers[index][0:count])
+                index = 1 - index
+    if decoder is not None:
+        decoder.flush()
+    return file_size
+
+def blob_hash(path):
+    hasher = hashlib.new(settings.BLOB_HASH_ALGORITHM)
+    buf = memoryview(bytearray(settings.BLOB_BUFFER_SIZE))
+    with open(path, 'rb', buffering=0) as blob_file:
+        while True:
+            count = blob_file.readinto(buf)
+            if not count:
+                break
+            hasher.update(buf[0:count])
+    return hasher.hexdigest()
+
+def blob_compress(temp_file, encoding):
+    compressed_file = models.Blob.blob_temp_path()
+    with open(compressed_file, 'wb') as cf:
+        for chunk in encode_chunks(file_chunks(temp_file, settings.BLOB_BUFFER_SIZE), encoding):
+            cf.write(chunk)
+    if os.path.getsize(compressed_file) < settings.BLOB_STORE_RATIO * os.path.getsize(temp_file):
+        os.replace(compressed_file, temp_file)
+        return encoding
+    os.unlink(compressed_file)
+
+def blob_store(temp_file, key, size):
+    blob, created = models.Blob.objects.get_or_create(key=key, size=size)
+    if not blob.exists():
+        if settings.BLOB_STORE_ENCODING is not None:
+            blob.encoding = blob_compress(temp_file, settings.BLOB_STORE_ENCODING)
+        blob.store(temp_file)
+    blob.activate()
+    return blob
+
+def accepted_encodings(request):
+    accepted = list()
+    for token in request.headers.get('Accept-Encoding', '').split(','):
+        parts = [ part.strip() for part in token.split(';') ]
+        if parts[0] and not any([ re.fullmatch(r'q=0(\.0*)?', part) for part in parts[1:] ]):
+            accepted.append(parts[0])
+    return accepted
+
+def transfer_encodings():
+    return [ encoding for encoding in settings.BLOB_TRANSFER_ENCODINGS if encoding in available_encodings() ]
+
+def parse_range(header, size):
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if match is None or (match.group(1) == '' and match.group(2) == ''):
+        return None
+    if match.group(1) == '':
+        return max(0, size - int(match.group(2))), size - 1
+    start = int(match.group(1))
+    end = size - 1
+    if match.group(2) != '':
+        end = min(end, int(match.group(2)))
+    return start, end
+
+def file_range(blob_file, length=None):
+    with blob_file:
+        while length is None or length > 0:
+            buf = blob_file.read(settings.BLOB_BUFFER_SIZE if length is None else min(length, settings.BLOB_BUFFER_SIZE))
+            if len(buf) == 0:
+                break
+            if length is not None:
+                length -= len(buf)
+            yield buf
+
+def decoded_evict(dirname, limit):
+    entries = list()
+    for name in os.listdir(dirname):
+        try:
+            stat = os.stat(os.path.join(dirname, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, os.path.join(dirname, name)))
+    usage = sum([ size for mtime, size, path in entries ], 0)
+    for mtime, size, path in sorted(entries):
+        if usage <= limit:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        usage -= size
+
+def blob_decoded(blob):
+    decoded_path = models.Blob.blob_decoded_path(blob.key)
+    try:
+        os.utime(decoded_path)
+        return open(decoded_path, 'rb')
+    except FileNotFoundError:
+        pass
+    temp_file = models.Blob.blob_temp_path()
+    try:
+        decoded_file = open(temp_file, 'w+b')
+        try:
+            for chunk in decode_chunks(file_range(blob.open()), blob.encoding):
+                decoded_file.write(chunk)
+            size = decoded_file.tell()
+            if size <= settings.BLOB_DECODED_CACHE_SIZE:
+                decoded_evict(os.path.dirname(decoded_path), settings.BLOB_DECODED_CACHE_SIZE - size)
+                os.replace(temp_file, decoded_path)
+        except:
+            decoded_file.close()
+            raise
+    finally:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+    return decoded_file
+
+def blob_chunks(blob, start, length):
+    if blob.encoding is None:
+        yield from file_range(blob.open(start), length)
+        return
+    if start > 0:
+        decoded_file = blob_decoded(blob)
+        decoded_file.seek(start)
+        yield from file_range(decoded_file, length)
+        return
+    for chunk in decode_chunks(file_range(blob.open()), blob.encoding):
+        chunk = chunk[0:length]
+        length -= len(chunk)
+        yield chunk
+        if length <= 0:
+            break
+
+def blob_response(request, blob):
+    accepted = accepted_encodings(request)
+    if settings.BLOB_STORAGE_REDIRECT and request.method == 'GET':
+        if blob.encoding is None or (blob.encoding in accepted and 'Range' not in request.headers):
+            url = blob.url(blob.encoding)
+            if url is not None:
+                return HttpResponseRedirect(url)
+    realpath = blob.realpath
+    if settings.USE_X_SENDFILE and realpath is not None and (blob.encoding is None or blob.encoding in accepted):
+        response = HttpResponse(headers={'X-Sendfile': realpath}, content_type='application/octet-stream')
+        if blob.encoding is not None:
+            response['Content-Encoding'] = blob.encoding
+            response['Vary'] = 'Accept-Encoding'
+        return response
+    etag = f'"{blob.key}"'
+    blob_range = parse_range(request.headers.get('Range'), blob.size)
+    if request.headers.get('If-Range', etag).strip('"').split('-')[0] != blob.key:
+        blob_range = None
+    encoding = None
+    if blob_range is not None:
+        start, end = blob_range
+        if start > end:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{blob.size}'})
+        response = StreamingHttpResponse(blob_chunks(blob, start, end - start + 1), status=206, content_type='application/octet-stream')
+        response['Content-Range'] = f'bytes {start}-{end}/{blob.size}'
+        response['Content-Length'] = str(end - start + 1)
+    elif blob.encoding is not None and blob.encoding in accepted:
+        encoding = blob.encoding
+        response = FileResponse(blob.open(), content_type='application/octet-stream')
+        response.block_size = settings.BLOB_BUFFER_SIZE
+    elif blob.encoding is not None:
+        response = StreamingHttpResponse(blob_chunks(blob, 0, blob.size), content_type='application/octet-stream')
+        response['Content-Length'] = str(blob.size)
+    else:
+        if settings.BLOB_COMPRESS_DOWNLOADS and blob.size >= settings.BLOB_COMPRESS_MIN_SIZE:
+            encoding = ([ e for e in transfer_encodings() if e in accepted ] + [ None ])[0]
+        if encoding is not None:
+            response = StreamingHttpResponse(encode_chunks(file_range(blob.open()), encoding, level=1), content_type='application/octet-stream')
+        else:
+            response = FileResponse(blob.open(), content_type='application/octet-stream')
+            response.block_size = settings.BLOB_BUFFER_SIZE
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+        etag = f'"{blob.key}-{encoding}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+def reference_dump(reference):
+    return {
+        'key' : reference.key,
+        'blob' : reference.blob.key,
+        'size' : reference.blob.size,
+        'time_create' : reference.time_create,
+        'time_access' : reference.time_access,
+    }
 
 def reference(request, key=''):
     if request.method == 'POST': #CREATE A NEW REFERENCE BY SENDING A BLOB
@@ -20,37 +278,30 @@ def reference(request, key=''):
             return HttpResponseForbidden()
         if not request.user.has_perm('blob.add_reference'):
             return HttpResponseForbidden()
+        declared_key = request.headers.get('X-Blob-Hash')
+        encoding = request.headers.get('Content-Encoding') or None
+        if encoding is not None and encoding not in transfer_encodings():
+            return FAILResponse(message=f'Content encoding {encoding} is not supported')
         hasher = hashlib.new(settings.BLOB_HASH_ALGORITHM)
         temp_file = models.Blob.blob_temp_path()
-        file_size = 0
         blob = None
         try:
-            with open(temp_file, 'wb') as tf:
-                while True:
-                    buf = request.read(READ_BUF_SIZE)
-                    if len(buf) == 0 :
-                        break
-                    file_size += len(buf)
-                    tf.write(buf)
-                    hasher.update(buf)
+            with open(temp_file, 'wb', buffering=0) as tf:
+                try:
+                    file_size = blob_receive(request, tf, hasher, encoding)
+                except DecompressionLimitExceeded as e:
+                    return FAILResponse(message=str(e))
             key = hasher.hexdigest()
-            blob, created = models.Blob.objects.get_or_create(key=key, size=file_size)
-            if not os.path.exists(blob.store_path):
-                os.rename(temp_file, blob.store_path)
-            blob.activate()
+            if declared_key is not None and declared_key != key:
+                return FAILResponse(message=f'Blob hash {key} does not match declared hash {declared_key}')
+            blob = blob_store(temp_file, key, file_size)
         finally:
             if os.path.exists(temp_file):
                 os.unlink(temp_file)
         reference = models.Reference(blob=blob, user=request.user)
         reference.save()
         response = dict()
-        response['reference'] = {
-            'key' : reference.key,
-            'blob' : reference.blob.key,
-            'size' : reference.blob.size,
-            'time_create' : reference.time_create,
-            'time_access' : reference.time_access,
-        }
+        response['reference'] = reference_dump(reference)
         return OKResponse(response)
     try:
         reference = models.Reference.objects.get(key=key)
@@ -61,13 +312,7 @@ def reference(request, key=''):
             return HttpResponseForbidden()
     if request.method == 'PUT': #QUERY REFERENCE DATA
         response = dict()
-        response['reference'] = {
-            'key' : reference.key,
-            'blob' : reference.blob.key,
-            'size' : reference.blob.size,
-            'time_create' : reference.time_create,
-            'time_access' : reference.time_access,
-        }
+        response['reference'] = reference_dump(reference)
         return OKResponse(response)
     if request.method == 'DELETE': #DELETE REFERENCE
         if not request.user.has_perm('blob.delete_reference') and request.user != reference.user:
@@ -75,11 +320,8 @@ def reference(request, key=''):
         reference.delete()
         return OKResponse({'deleted' : True})
     if request.method == 'GET' or request.method == 'HEAD': #GET REFERENCED BLOB
-        reference.blob.save()
-        reference.save()
-        if settings.USE_X_SENDFILE:
-            return HttpResponse(headers={'X-Sendfile': reference.blob.realpath}, content_type='application/octet-stream')
-        return FileResponse(reference.blob.open(), content_type='application/octet-stream')
+        models.touch(reference, reference.blob)
+        return blob_response(request, reference.blob)
     return HttpResponseNotAllowed(['HEAD', 'GET', 'POST', 'PUT', 'DELETE'])
 
 def blob(request, key):
@@ -95,15 +337,9 @@ def blob(request, key):
                 blob = blob
         )
         reference.save()
-        blob.save()
+        models.touch(blob)
         response = dict()
-        response['reference'] = {
-            'key' : reference.key,
-            'blob' : reference.blob.key,
-            'size' : reference.blob.size,
-            'time_create' : reference.time_create,
-            'time_access' : reference.time_access,
-        }
+        response['reference'] = reference_dump(reference)
         return OKResponse(response)
     if request.method == 'PUT': #QUERY BLOB DATA
         response = dict()
@@ -122,8 +358,98 @@ def blob(request, key):
         blob.delete()
         return OKResponse({'deleted' : True})
     if request.method == 'GET' or request.method == 'HEAD':
-        blob.save()
-        if settings.USE_X_SENDFILE:
-            return HttpResponse(headers={'X-Sendfile': blob.realpath}, content_type='application/octet-stream')
-        return FileResponse(blob.open(), content_type='application/octet-stream')
+        models.touch(blob)
+        return blob_response(request, blob)
     return HttpResponseNotAllowed(['HEAD', 'GET', 'POST', 'PUT', 'DELETE'])
+
+def bulk(request):
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    params = json.loads(str(request.read(), request.encoding or 'utf-8'))
+    blob_keys = set(params.get('blobs', list()))
+    reference_keys = set(params.get('references', list()))
+    response = dict()
+    response['references'] = dict()
+    if reference_keys:
+        references = models.Reference.objects.filter(key__in=reference_keys).select_related('blob')
+        if not request.user.has_perm('blob.view_reference'):
+            references = references.filter(Q(public=True) | Q(user=request.user))
+        for reference in references:
+            models.touch(reference, reference.blob)
+            response['references'][reference.key] = reference_dump(reference)
+    response['blobs'] = dict()
+    if blob_keys and request.user.has_perm('blob.view_blob'):
+        with transaction.atomic():
+            blobs = list(models.Blob.objects.filter(key__in=blob_keys))
+            references = models.Reference.objects.bulk_create([ models.Reference(user=request.user, blob=blob) for blob in blobs ])
+        models.touch(*blobs)
+        for blob, reference in zip(blobs, references):
+            response['blobs'][blob.key] = reference_dump(reference)
+    return OKResponse(response)
+
+def upload_dump(upload):
+    return {
+        'key' : upload.key,
+        'size' : upload.size,
+        'offset' : upload.offset,
+        'time_create' : upload.time_create,
+        'time_access' : upload.time_access,
+    }
+
+def upload(request, key=''):
+    if request.method == 'POST' and key == '': #START A NEW RESUMABLE UPLOAD
+        if not request.user.has_perm('blob.add_reference'):
+            return HttpResponseForbidden()
+        params = json.loads(str(request.read(), request.encoding or 'utf-8'))
+        upload = models.Upload(user=request.user, size=int(params['size']), hash=params.get('hash'))
+        upload.save()
+        return OKResponse({'upload' : upload_dump(upload)})
+    try:
+        upload = models.Upload.objects.get(key=key)
+    except models.Upload.DoesNotExist:
+        return HttpResponseNotFound()
+    if request.user != upload.user:
+        return HttpResponseForbidden()
+    if request.method == 'PUT': #QUERY UPLOAD OFFSET
+        return OKResponse({'upload' : upload_dump(upload)})
+    if request.method == 'DELETE': #CANCEL UPLOAD
+        upload.delete()
+        return OKResponse({'deleted' : True})
+    if request.method == 'POST': #APPEND A CHUNK
+        if request.headers.get('Content-Encoding'):
+            return FAILResponse(message=f'Content encoding is not supported for chunked uploads')
+        with open(upload.temp_path, 'ab', buffering=0) as upload_file:
+            fcntl.flock(upload_file, fcntl.LOCK_EX)
+            offset = os.fstat(upload_file.fileno()).st_size
+            if int(request.headers.get('X-Upload-Offset', -1)) != offset:
+                return FAILResponse(message=f'Upload {upload.key} is at offset {offset}', upload=upload_dump(upload))
+            if int(request.META.get('CONTENT_LENGTH') or 0) > upload.size - offset:
+                return FAILResponse(message=f'Chunk exceeds declared size {upload.size} of upload {upload.key}', upload=upload_dump(upload))
+            blob_receive(request, upload_file)
+            offset = os.fstat(upload_file.fileno()).st_size
+            with transaction.atomic():
+                try:
+                    upload = models.Upload.objects.select_for_update().get(pk=upload.pk)
+                except models.Upload.DoesNotExist:
+                    return HttpResponseNotFound()
+                if offset > upload.size:
+                    upload.delete()
+                    return FAILResponse(message=f'Upload {upload.key} exceeds declared size {upload.size}')
+                upload.save()
+            response = dict()
+            response['upload'] = upload_dump(upload)
+            if offset == upload.size:
+                key = blob_hash(upload.temp_path)
+                if upload.hash and upload.hash != key:
+                    upload.delete()
+                    return FAILResponse(message=f'Blob hash {key} does not match declared hash {upload.hash}')
+                blob = blob_store(upload.temp_path, key, upload.size)
+                with transaction.atomic():
+                    upload.delete()
+                    reference = models.Reference(blob=blob, user=request.user)
+                    reference.save()
+                response['reference'] = reference_dump(reference)
+        return OKResponse(response)
+    return HttpResponseNotAllowed(['POST', 'PUT', 'DELETE'])
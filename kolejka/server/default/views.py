@@ -7,6 +7,7 @@ from django.http import HttpResponse, JsonResponse, HttpResponseForbidden, HttpR
 from django.views.decorators.csrf import ensure_csrf_cookie
 
 from kolejka.common.limits import KolejkaLimits
+from kolejka.server.blob.views import transfer_encodings
 from kolejka.server.response import OKResponse, FAILResponse
 
 @ensure_csrf_cookie
@@ -20,6 +21,7 @@ def settings(request):
         return HttpResponseNotAllowed(['GET'])
     response = dict()
     response['blob_hash_algorithm'] = django_settings.BLOB_HASH_ALGORITHM
+    response['blob_encodings'] = transfer_encodings()
     limits = KolejkaLimits(
             cpus=django_settings.LIMIT_CPUS,
             memory=django_settings.LIMIT_MEMORY,
@@ -30,6 +32,7 @@ def settings(request):
             workspace=django_settings.LIMIT_WORKSPACE,
             network=django_settings.LIMIT_NETWORK,
             time=django_settings.LIMIT_TIME,
+            cpu_time=django_settings.LIMIT_CPU_TIME,
             gpus=django_settings.LIMIT_GPUS,
             gpu_memory=django_settings.LIMIT_GPU_MEMORY,
             perf_instructions=django_settings.LIMIT_PERF_INSTRUCTIONS,
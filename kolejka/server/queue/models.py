@@ -4,3 +4,6 @@ from django.conf import settings
 
 from django.db import models
 
+class Signal(models.Model):
+    name        = models.CharField(max_length=64, unique=True, null=False)
+    generation  = models.BigIntegerField(default=0, null=False)
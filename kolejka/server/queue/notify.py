@@ -0,0 +1,68 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from django.conf import settings
+
+import logging
+import threading
+import time
+
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from .models import Signal
+
+class Notifier:
+    def __init__(self, name):
+        self.name = name
+        self.condition = threading.Condition()
+        self.local = 0
+
+    def shared(self):
+        try:
+            return Signal.objects.filter(name=self.name).values_list('generation', flat=True).first() or 0
+        except DatabaseError as e:
+            logging.warning(f'Failed to read signal \'{self.name}\': {e}')
+
+    def generation(self):
+        return (self.local, self.shared())
+
+    def notify(self):
+        transaction.on_commit(self.signal)
+
+    def signal(self):
+        with self.condition:
+            self.local += 1
+            self.condition.notify_all()
+        for attempt in range(settings.NOTIFY_RETRIES + 1):
+            try:
+                if Signal.objects.filter(name=self.name).update(generation=F('generation')+1) == 0:
+                    Signal.objects.get_or_create(name=self.name, defaults={ 'generation' : 1 })
+                return
+            except DatabaseError as e:
+                if attempt >= settings.NOTIFY_RETRIES:
+                    logging.warning(f'Failed to raise signal \'{self.name}\': {e}')
+                    return
+            time.sleep(settings.NOTIFY_RETRY_DELAY * 2**attempt)
+
+    def wait(self, generation, timeout=None):
+        local, shared = generation
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.local != local:
+                return True
+            step = settings.NOTIFY_INTERVAL
+            if deadline is not None:
+                step = min(step, deadline - time.monotonic())
+                if step <= 0:
+                    return False
+            with self.condition:
+                if self.condition.wait_for(lambda: self.local != local, timeout=step):
+                    return True
+            current = self.shared()
+            if current is not None and shared is not None and current != shared:
+                return True
+
+_notifier = Notifier('queue')
+generation = _notifier.generation
+notify = _notifier.notify
+wait = _notifier.wait
@@ -0,0 +1,84 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from django.conf import settings
+
+import heapq
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Exists, OuterRef, Sum
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+import django.utils.timezone
+
+from kolejka.server.task.models import Task
+
+class DequeuePolicy:
+    def __init__(self, window=100):
+        self.window = window
+
+    def lock(self, queryset):
+        if connection.features.has_select_for_update_skip_locked:
+            return queryset.select_for_update(skip_locked=True)
+        return queryset
+
+    def order(self, candidates):
+        raise NotImplementedError()
+
+class FifoPolicy(DequeuePolicy):
+    def order(self, candidates):
+        return self.lock(candidates.order_by('time_create'))[0:self.window]
+
+class PriorityPolicy(DequeuePolicy):
+    def order(self, candidates):
+        return self.lock(candidates.order_by('-priority', 'time_create'))[0:self.window]
+
+class FairSharePolicy(DequeuePolicy):
+    def __init__(self, window=100, weights=None, usage_period=None):
+        super().__init__(window=window)
+        if weights is None:
+            weights = settings.FAIR_SHARE_WEIGHTS
+        if usage_period is None:
+            usage_period = settings.FAIR_SHARE_PERIOD
+        self.weights = weights
+        self.usage_period = usage_period
+
+    def weight(self, user):
+        return max(self.weights.get(user.username, 1), 10**-6)
+
+    def cost(self, task):
+        return max(task['limit_cpus'] or 1, 1)
+
+    def usage(self, users):
+        since = django.utils.timezone.now() - self.usage_period
+        usage = Task.objects.filter(time_assign__gte=since, user__in=users).values('user').annotate(usage=Sum(Coalesce('limit_cpus', 1)))
+        return dict([ (u['user'], u['usage']) for u in usage ])
+
+    def order(self, candidates):
+        users = dict([ (user.pk, user) for user in get_user_model().objects.filter(Exists(candidates.filter(user=OuterRef('pk')))) ])
+        candidates = candidates.order_by('-priority', 'time_create', 'pk')
+        heads = dict()
+        for user_id in users:
+            heads[user_id] = iter(candidates.filter(user=user_id).values('pk', 'user', 'priority', 'time_create', 'limit_cpus')[0:self.window])
+        usage = self.usage(list(users.values()))
+        heap = list()
+        for user_id, head in heads.items():
+            task = next(head, None)
+            if task is None:
+                continue
+            served = usage.get(user_id, 0) / self.weight(users[user_id])
+            heap.append((-task['priority'], served, task['time_create'], task['pk'], task, head, users[user_id]))
+        heapq.heapify(heap)
+        result = list()
+        while len(heap) > 0 and len(result) < self.window:
+            _, served, _, _, task, head, user = heapq.heappop(heap)
+            result.append(task['pk'])
+            served += self.cost(task) / self.weight(user)
+            task = next(head, None)
+            if task is not None:
+                heapq.heappush(heap, (-task['priority'], served, task['time_create'], task['pk'], task, head, user))
+        locked = dict([ (task.pk, task) for task in self.lock(candidates.filter(pk__in=result)) ])
+        return [ locked[pk] for pk in result if pk in locked ]
+
+def dequeue_policy():
+    return import_string(settings.DEQUEUE_POLICY)()
@@ -2,5 +2,177 @@
 
 from django.conf import settings
 
-from django.test import TestCase
+import json
+import threading
+import time
+from unittest import mock
 
+from django.contrib.auth.models import Permission, User
+from django.db import DatabaseError
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+import django.utils.timezone
+
+from kolejka.common.limits import KolejkaLimits
+from kolejka.common.task import KolejkaTask
+from kolejka.server.task.models import Task
+from kolejka.server.queue import notify
+from kolejka.server.queue.models import Signal
+from kolejka.server.queue.policy import FifoPolicy, PriorityPolicy, FairSharePolicy
+
+class DequeueTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client')
+        self.foreman = User.objects.create_user('foreman')
+        self.foreman.user_permissions.add(Permission.objects.get(codename='process_task', content_type__app_label='task'))
+        self.client.force_login(self.foreman)
+
+    def submit(self, **kwargs):
+        t = KolejkaTask(None, **kwargs)
+        task = Task(user=self.user)
+        t.id = task.key
+        task.set_task(t)
+        task.save()
+        task.set_requirements(t)
+        return task
+
+    def dequeue(self, concurency=1, limits=dict(), tags=list(), timeout=0):
+        response = self.client.post('/queue/dequeue/', data=json.dumps({
+                'concurency' : concurency,
+                'limits' : KolejkaLimits(**limits).dump(),
+                'tags' : tags,
+                'timeout' : timeout,
+            }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [ t['id'] for t in response.json()['tasks'] ]
+
+    def test_denormalized_columns(self):
+        task = self.submit(image='ubuntu', exclusive=True, requires=['gpu'], limits={'cpus' : 2, 'memory' : '1G', 'time' : '10s'})
+        self.assertEqual(task.image, 'ubuntu')
+        self.assertTrue(task.exclusive)
+        self.assertEqual(task.limit_cpus, 2)
+        self.assertEqual(task.limit_memory, 1024**3)
+        self.assertEqual(task.limit_time.total_seconds(), 10)
+        self.assertEqual(set(task.requirements.values_list('tag', flat=True)), {'gpu'})
+
+    def test_head_of_queue_does_not_block(self):
+        big = self.submit(image='ubuntu', limits={'cpus' : 16, 'memory' : '1G'})
+        small = self.submit(image='ubuntu', limits={'cpus' : 1, 'memory' : '1G'})
+        self.assertEqual(self.dequeue(limits={'cpus' : 4, 'memory' : '4G'}), [small.key])
+        self.assertEqual(Task.objects.get(pk=big.pk).assignee, None)
+        self.assertEqual(Task.objects.get(pk=small.pk).assignee, self.foreman)
+
+    def test_requirements(self):
+        gpu = self.submit(image='ubuntu', requires=['gpu'], limits={'cpus' : 1})
+        self.assertEqual(self.dequeue(limits={'cpus' : 4}, tags=['cpu']), [])
+        self.assertEqual(self.dequeue(limits={'cpus' : 4}, tags=['cpu', 'gpu']), [gpu.key])
+
+    def test_resources_are_consumed(self):
+        first = self.submit(image='ubuntu', limits={'cpus' : 3})
+        second = self.submit(image='ubuntu', limits={'cpus' : 3})
+        third = self.submit(image='ubuntu', limits={'cpus' : 1})
+        self.assertEqual(self.dequeue(concurency=4, limits={'cpus' : 4}), [first.key, third.key])
+
+    @override_settings(DEQUEUE_INTERVAL=0.05)
+    def test_long_poll_timeout(self):
+        start = time.monotonic()
+        self.assertEqual(self.dequeue(limits={'cpus' : 4}, timeout=0.2), [])
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_notify_wakes_waiter(self):
+        generation = notify.generation()
+        threading.Timer(0.05, notify.notify).start()
+        start = time.monotonic()
+        self.assertTrue(notify.wait(generation, timeout=10))
+        self.assertLess(time.monotonic() - start, 5)
+
+    @override_settings(NOTIFY_INTERVAL=0.01)
+    def test_shared_signal_wakes_waiter(self):
+        generation = notify.generation()
+        Signal.objects.update_or_create(name='queue', defaults={ 'generation' : (generation[1] or 0) + 1 })
+        start = time.monotonic()
+        self.assertTrue(notify.wait(generation, timeout=10))
+        self.assertLess(time.monotonic() - start, 5)
+        generation = notify.generation()
+        self.assertFalse(notify.wait(generation, timeout=0.05))
+
+    def test_notify_on_commit(self):
+        generation = notify.generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            notify.notify()
+            self.assertEqual(notify.generation(), generation)
+        self.assertNotEqual(notify.generation()[0], generation[0])
+        self.assertNotEqual(notify.generation()[1], generation[1])
+
+    @override_settings(NOTIFY_RETRY_DELAY=0)
+    def test_notify_retry(self):
+        generation = notify.generation()
+        update = QuerySet.update
+        failures = [ DatabaseError('database table is locked') ]
+        def flaky(queryset, **kwargs):
+            if failures:
+                raise failures.pop()
+            return update(queryset, **kwargs)
+        with mock.patch.object(QuerySet, 'update', flaky):
+            with self.captureOnCommitCallbacks(execute=True):
+                notify.notify()
+        self.assertEqual(failures, [])
+        self.assertNotEqual(notify.generation()[1], generation[1])
+
+class PolicyTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def submit(self, user, **kwargs):
+        t = KolejkaTask(None, image='ubuntu', **kwargs)
+        task = Task(user=user)
+        task.set_task(t)
+        task.save()
+        return task
+
+    def test_fifo(self):
+        tasks = [ self.submit(self.alice) for i in range(3) ] + [ self.submit(self.bob, priority=5) ]
+        self.assertEqual(list(FifoPolicy().order(Task.objects.all())), tasks)
+
+    def test_priority(self):
+        low = self.submit(self.alice)
+        high = self.submit(self.bob, priority=5)
+        self.assertEqual(list(PriorityPolicy().order(Task.objects.all())), [high, low])
+
+    def test_fair_share_interleaves_users(self):
+        alice = [ self.submit(self.alice) for i in range(4) ]
+        bob = [ self.submit(self.bob) for i in range(2) ]
+        order = FairSharePolicy(weights={}).order(Task.objects.all())
+        self.assertEqual([ t.user for t in order[0:4] ], [ self.alice, self.bob, self.alice, self.bob ])
+        self.assertEqual(order[4:], alice[2:])
+
+    def test_fair_share_accounts_recent_usage(self):
+        busy = self.submit(self.alice, limits={'cpus' : 8})
+        Task.objects.filter(pk=busy.pk).update(assignee=self.alice, time_assign=django.utils.timezone.now())
+        alice = self.submit(self.alice)
+        bob = self.submit(self.bob)
+        order = FairSharePolicy(weights={}).order(Task.objects.filter(assignee__isnull=True))
+        self.assertEqual(order, [bob, alice])
+
+    def test_fair_share_weights(self):
+        alice = [ self.submit(self.alice) for i in range(4) ]
+        bob = [ self.submit(self.bob) for i in range(4) ]
+        order = FairSharePolicy(weights={'alice' : 3}).order(Task.objects.all())
+        self.assertEqual([ t.user for t in order[0:4] ], [ self.alice, self.bob, self.alice, self.alice ])
+
+    def test_fair_share_queries(self):
+        users = [ User.objects.create_user(f'user{i}') for i in range(5) ]
+        for user in users:
+            self.submit(user)
+            self.submit(user)
+        with self.assertNumQueries(len(users) + 3):
+            order = FairSharePolicy(weights={}).order(Task.objects.all())
+        self.assertEqual([ t.user_id for t in order[0:5] ], [ user.pk for user in users ])
+        self.assertEqual(len(order), 10)
+
+    def test_fair_share_priority_first(self):
+        alice = [ self.submit(self.alice) for i in range(2) ]
+        urgent = self.submit(self.bob, priority=10)
+        order = FairSharePolicy(weights={}).order(Task.objects.all())
+        self.assertEqual(order[0], urgent)
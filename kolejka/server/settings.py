@@ -2,6 +2,7 @@
     
 from kolejka.common.settings import *
 
+import datetime
 import os
 
 KOLEJKA_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -100,7 +101,24 @@ STATIC_ROOT = os.path.join(PROJECT_DIR, '../kolejka-server-static')
 LOGIN_REDIRECT_URL = '/'
 
 BLOB_HASH_ALGORITHM = 'sha256'
+BLOB_BUFFER_SIZE = 4*1024*1024
+BLOB_TRANSFER_ENCODINGS = [ 'zstd', 'gzip' ]
+BLOB_COMPRESS_DOWNLOADS = False
+BLOB_COMPRESS_MIN_SIZE = 1024
+BLOB_STORE_ENCODING = None
+BLOB_DECODE_MAX_SIZE = 1024*1024*1024
+BLOB_DECODE_MAX_RATIO = 1024
+BLOB_DECODED_CACHE_SIZE = 4*1024*1024*1024
+BLOB_STORE_RATIO = 0.9
 BLOB_STORE_PATH = os.path.join(PROJECT_DIR, '../kolejka-server-blobs')
+BLOB_STORAGE = 'kolejka.server.blob.storage.FileSystemStorage'
+BLOB_STORAGE_OPTIONS = {}
+BLOB_STORAGE_REDIRECT = False
+BLOB_STORAGE_URL_EXPIRES = datetime.timedelta(minutes=15)
+BLOB_ACCESS_INTERVAL = datetime.timedelta(minutes=1)
+BLOB_GC_GRACE = datetime.timedelta(days=1)
+BLOB_GC_DELETE_GRACE = datetime.timedelta(days=7)
+BLOB_GC_BATCH_SIZE = 1000
 
 LIMIT_CPUS = None
 LIMIT_MEMORY = None
@@ -109,6 +127,7 @@ LIMIT_PIDS = None
 LIMIT_STORAGE = None 
 LIMIT_NETWORK = None
 LIMIT_TIME = None
+LIMIT_CPU_TIME = None
 LIMIT_IMAGE = None
 LIMIT_WORKSPACE = None
 LIMIT_GPUS = None
@@ -138,7 +157,31 @@ IMAGE_REGISTRY_PASSWORD = None
 
 USE_X_SENDFILE = False
 
+NOTIFY_INTERVAL = 1
+NOTIFY_RETRIES = 5
+NOTIFY_RETRY_DELAY = 0.05
+
+DEQUEUE_TIMEOUT = 60
+DEQUEUE_INTERVAL = 5
+DEQUEUE_POLICY = 'kolejka.server.queue.policy.FairSharePolicy'
+
+EVENTS_TIMEOUT = 120
+EVENTS_INTERVAL = 5
+EVENTS_HEARTBEAT = 15
+
+FAIR_SHARE_WEIGHTS = {
+#        'username' : 2,
+}
+FAIR_SHARE_PERIOD = datetime.timedelta(hours=1)
+
 CALLBACK_USER_AGENT = 'kolejka-server'
+CALLBACK_WORKERS = 4
+CALLBACK_TIMEOUT = 10
+CALLBACK_RETRIES = 8
+CALLBACK_RETRY_DELAY = datetime.timedelta(seconds=5)
+CALLBACK_RETRY_MAX_DELAY = datetime.timedelta(hours=1)
+CALLBACK_BATCH_SIZE = 1
+CALLBACK_INTERVAL = 60
 
 ALLOWED_CALLBACK_HOSTS = [
     'localhost',
@@ -13,3 +13,7 @@ class TaskAdmin(admin.ModelAdmin):
 @admin.register(models.Result)
 class ResultAdmin(admin.ModelAdmin):
     pass
+
+@admin.register(models.Callback)
+class CallbackAdmin(admin.ModelAdmin):
+    pass
@@ -0,0 +1,165 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from django.conf import settings
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import threading
+import urllib.parse
+import urllib.request
+
+from django.db import close_old_connections
+from django.db.models import Min
+import django.utils.timezone
+
+from . import models
+
+_lock = threading.Lock()
+_event = threading.Event()
+_thread = None
+_executor = None
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'delivered' : 0,
+    'failed' : 0,
+    'abandoned' : 0,
+    'requests' : 0,
+    'latency_total' : 0.0,
+    'latency_max' : 0.0,
+}
+
+def callback_allowed(url):
+    try:
+        parsed_url = urllib.parse.urlparse(url)
+        if parsed_url.scheme not in [ 'http', 'https' ] or parsed_url.hostname not in settings.ALLOWED_CALLBACK_HOSTS:
+            logging.warning(f'Callback \'{url}\' is not allowed')
+            return False
+    except:
+        logging.warning(f'Callback \'{url}\' is malformed')
+        return False
+    return True
+
+def schedule(result):
+    url = result.task.task().callback_url
+    if url and callback_allowed(url):
+        models.Callback.objects.create(task=result.task, url=url, time_next=django.utils.timezone.now())
+
+def metrics():
+    with _metrics_lock:
+        response = dict(_metrics)
+    response['pending'] = models.Callback.objects.count()
+    response['latency_average'] = response['latency_total'] / response['delivered'] if response['delivered'] else None
+    return response
+
+def backoff(attempts):
+    delay = settings.CALLBACK_RETRY_DELAY.total_seconds() * (2 ** min(max(attempts - 1, 0), 32))
+    return min(datetime.timedelta(seconds=delay), settings.CALLBACK_RETRY_MAX_DELAY)
+
+def payload(callback):
+    response = dict()
+    response['task'] = callback.task.task().dump()
+    response['result'] = callback.task.result.result().dump()
+    return response
+
+def claim(now):
+    lease = now + datetime.timedelta(seconds=2*settings.CALLBACK_TIMEOUT)
+    limit = max(settings.CALLBACK_WORKERS, 1) * max(settings.CALLBACK_BATCH_SIZE, 1)
+    claimed = list()
+    for callback in models.Callback.objects.filter(time_next__lte=now).order_by('time_next')[0:limit]:
+        if models.Callback.objects.filter(pk=callback.pk, time_next=callback.time_next).update(time_next=lease) == 1:
+            claimed.append(callback)
+    return claimed
+
+def batches(callbacks):
+    urls = dict()
+    for callback in callbacks:
+        urls.setdefault(callback.url, list()).append(callback)
+    size = max(settings.CALLBACK_BATCH_SIZE, 1)
+    result = list()
+    for url, group in urls.items():
+        for start in range(0, len(group), size):
+            result.append(group[start:start+size])
+    return result
+
+def deliver(batch):
+    close_old_connections()
+    try:
+        url = batch[0].url
+        payloads = [ payload(callback) for callback in batch ]
+        if len(payloads) == 1:
+            data = payloads[0]
+        else:
+            data = { 'results' : payloads }
+        headers = dict()
+        headers['User-Agent'] = settings.CALLBACK_USER_AGENT
+        headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url=url, data=bytes(json.dumps(data), 'utf-8'), headers=headers, method='POST')
+        with _metrics_lock:
+            _metrics['requests'] += 1
+        try:
+            with urllib.request.urlopen(request, timeout=settings.CALLBACK_TIMEOUT) as response:
+                response.read()
+        except Exception as e:
+            logging.warning(f'Callback \'{url}\' failed: {e}')
+            now = django.utils.timezone.now()
+            for callback in batch:
+                callback.attempts += 1
+                if callback.attempts >= settings.CALLBACK_RETRIES:
+                    logging.warning(f'Callback \'{url}\' for task {callback.task.key} abandoned after {callback.attempts} attempts')
+                    callback.delete()
+                    with _metrics_lock:
+                        _metrics['abandoned'] += 1
+                else:
+                    models.Callback.objects.filter(pk=callback.pk).update(attempts=callback.attempts, time_next=now + backoff(callback.attempts))
+                with _metrics_lock:
+                    _metrics['failed'] += 1
+            return 0
+        now = django.utils.timezone.now()
+        models.Callback.objects.filter(pk__in=[ callback.pk for callback in batch ]).delete()
+        with _metrics_lock:
+            for callback in batch:
+                latency = (now - callback.time_create).total_seconds()
+                _metrics['delivered'] += 1
+                _metrics['latency_total'] += latency
+                _metrics['latency_max'] = max(_metrics['latency_max'], latency)
+        return len(batch)
+    finally:
+        close_old_connections()
+
+def deliver_pending():
+    global _executor
+    claimed = claim(django.utils.timezone.now())
+    work = batches(claimed)
+    if settings.CALLBACK_WORKERS <= 1 or len(work) <= 1:
+        return sum([ deliver(batch) for batch in work ], 0)
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.CALLBACK_WORKERS, thread_name_prefix='kolejka-callback')
+    return sum(_executor.map(deliver, work), 0)
+
+def run(stop=None):
+    while stop is None or not stop.is_set():
+        _event.clear()
+        try:
+            deliver_pending()
+            upcoming = models.Callback.objects.aggregate(time_next=Min('time_next'))['time_next']
+        except Exception as e:
+            logging.warning(f'Callback delivery failed: {e}')
+            upcoming = None
+        finally:
+            close_old_connections()
+        timeout = settings.CALLBACK_INTERVAL
+        if upcoming is not None:
+            timeout = min(timeout, max((upcoming - django.utils.timezone.now()).total_seconds(), 0))
+        _event.wait(timeout)
+
+def notify():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=run, name='kolejka-callbacks', daemon=True)
+            _thread.start()
+    _event.set()
@@ -0,0 +1,10 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+
+from django.conf import settings
+
+from kolejka.server.queue.notify import Notifier
+
+_notifier = Notifier('events')
+generation = _notifier.generation
+notify = _notifier.notify
+wait = _notifier.wait
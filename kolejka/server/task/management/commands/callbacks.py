@@ -0,0 +1,29 @@
+# vim:ts=4:sts=4:sw=4:expandtab
+"""
+Management utility to deliver pending result callbacks.
+"""
+
+from django.conf import settings
+
+from django.core.management.base import BaseCommand
+
+from kolejka.server.task import callback
+
+class Command(BaseCommand):
+    help = 'Used to deliver pending result callbacks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            default=False,
+            help='Deliver callbacks that are due and exit.',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            delivered = callback.deliver_pending()
+            if options['verbosity'] > 0:
+                self.stdout.write(f'callbacks delivered: {delivered}')
+            return
+        callback.run()
@@ -0,0 +1,159 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from kolejka.common.task import KolejkaTask
+
+
+def task_limits_columns(limits):
+    return {
+        'limit_cpus' : limits.cpus,
+        'limit_memory' : limits.memory,
+        'limit_swap' : limits.swap,
+        'limit_pids' : limits.pids,
+        'limit_storage' : limits.storage,
+        'limit_image' : limits.image,
+        'limit_workspace' : limits.workspace,
+        'limit_network' : limits.network,
+        'limit_time' : limits.time,
+        'limit_gpus' : limits.gpus,
+        'limit_gpu_memory' : limits.gpu_memory,
+        'limit_perf_instructions' : limits.perf_instructions,
+        'limit_perf_cycles' : limits.perf_cycles,
+        'limit_cgroup_depth' : limits.cgroup_depth,
+        'limit_cgroup_descendants' : limits.cgroup_descendants,
+    }
+
+
+def fill_task_columns(apps, schema_editor):
+    Task = apps.get_model('task', 'Task')
+    Requirement = apps.get_model('task', 'Requirement')
+    for task in Task.objects.all().iterator():
+        t = KolejkaTask(None)
+        t.load(task.description)
+        task.image = t.image
+        task.exclusive = bool(t.exclusive)
+        for name, value in task_limits_columns(t.limits).items():
+            setattr(task, name, value)
+        task.save()
+        Requirement.objects.bulk_create([ Requirement(task=task, tag=str(tag)) for tag in set(t.requires) ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blob', '0001_initial'),
+        ('task', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Requirement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(db_index=True, max_length=255)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='exclusive',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='image',
+            field=models.CharField(db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_cgroup_depth',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_cgroup_descendants',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_cpus',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_gpu_memory',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_gpus',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_image',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_memory',
+            field=models.BigIntegerField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_network',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_perf_cycles',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_perf_instructions',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_pids',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_storage',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_swap',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_time',
+            field=models.DurationField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='limit_workspace',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assignee', 'time_create'], name='task_task_assigne_3a7561_idx'),
+        ),
+        migrations.AddField(
+            model_name='requirement',
+            name='task',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requirements', to='task.task'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='requirement',
+            unique_together={('task', 'tag')},
+        ),
+        migrations.RunPython(fill_task_columns, migrations.RunPython.noop),
+    ]
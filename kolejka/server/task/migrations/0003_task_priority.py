@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blob', '0001_initial'),
+        ('task', '0002_task_denormalized_limits'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assignee', '-priority', 'time_create'], name='task_task_assigne_727346_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['assignee', 'user', '-priority', 'time_create'], name='task_task_assigne_a6fba8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['time_assign', 'user'], name='task_task_time_as_f2bb42_idx'),
+        ),
+    ]
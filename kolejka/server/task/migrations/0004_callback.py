@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0003_task_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Callback',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=1024)),
+                ('attempts', models.IntegerField(default=0)),
+                ('time_create', models.DateTimeField(auto_now_add=True)),
+                ('time_next', models.DateTimeField(db_index=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='callbacks', to='task.task')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0004_callback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='limit_cpu_time',
+            field=models.DurationField(null=True),
+        ),
+    ]
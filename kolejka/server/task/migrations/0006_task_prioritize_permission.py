@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0005_task_limit_cpu_time'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='task',
+            options={'permissions': [('process_task', 'Can process task'), ('prioritize_task', 'Can raise task priority')]},
+        ),
+    ]
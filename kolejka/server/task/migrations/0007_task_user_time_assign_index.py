@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blob', '0003_blob_encoding'),
+        ('task', '0006_task_prioritize_permission'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'time_assign'], name='task_task_user_id_f0a64a_idx'),
+        ),
+    ]
@@ -3,14 +3,36 @@
 from django.conf import settings
 
 import datetime
+import json
 import os
 import uuid
 
 from django.db import models
 
+from kolejka.common.limits import KolejkaLimits
 from kolejka.common.task import KolejkaTask, KolejkaResult
 from kolejka.server.blob.models import Reference
 
+def task_limits_columns(limits):
+    return {
+        'limit_cpus' : limits.cpus,
+        'limit_memory' : limits.memory,
+        'limit_swap' : limits.swap,
+        'limit_pids' : limits.pids,
+        'limit_storage' : limits.storage,
+        'limit_image' : limits.image,
+        'limit_workspace' : limits.workspace,
+        'limit_network' : limits.network,
+        'limit_time' : limits.time,
+        'limit_cpu_time' : limits.cpu_time,
+        'limit_gpus' : limits.gpus,
+        'limit_gpu_memory' : limits.gpu_memory,
+        'limit_perf_instructions' : limits.perf_instructions,
+        'limit_perf_cycles' : limits.perf_cycles,
+        'limit_cgroup_depth' : limits.cgroup_depth,
+        'limit_cgroup_descendants' : limits.cgroup_descendants,
+    }
+
 class Task(models.Model):
     user        = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='kolejka_tasks')
     key         = models.CharField(max_length=64, unique=True, null=False)
@@ -19,14 +41,63 @@ class Task(models.Model):
     files       = models.ManyToManyField(Reference)
     assignee    = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='kolejka_assignments')
     time_assign = models.DateTimeField(null=True)
+    image       = models.CharField(max_length=255, null=True, db_index=True)
+    exclusive   = models.BooleanField(default=False, null=False, db_index=True)
+    priority    = models.IntegerField(default=0, null=False)
+    limit_cpus               = models.IntegerField(null=True, db_index=True)
+    limit_memory             = models.BigIntegerField(null=True, db_index=True)
+    limit_swap               = models.BigIntegerField(null=True)
+    limit_pids               = models.IntegerField(null=True)
+    limit_storage            = models.BigIntegerField(null=True)
+    limit_image              = models.BigIntegerField(null=True)
+    limit_workspace          = models.BigIntegerField(null=True)
+    limit_network            = models.BooleanField(null=True)
+    limit_time               = models.DurationField(null=True, db_index=True)
+    limit_cpu_time           = models.DurationField(null=True)
+    limit_gpus               = models.IntegerField(null=True, db_index=True)
+    limit_gpu_memory         = models.BigIntegerField(null=True)
+    limit_perf_instructions  = models.BigIntegerField(null=True)
+    limit_perf_cycles        = models.BigIntegerField(null=True)
+    limit_cgroup_depth       = models.IntegerField(null=True)
+    limit_cgroup_descendants  = models.IntegerField(null=True)
 
     def task(self, task_path=None):
         task = KolejkaTask(task_path)
         task.load(self.description)
         return task
 
+    @property
+    def limits(self):
+        return KolejkaLimits(**dict([ (name[len('limit_'):], getattr(self, name)) for name in task_limits_columns(KolejkaLimits()) ]))
+
+    def set_task(self, task):
+        self.description = json.dumps(task.dump())
+        self.image = task.image
+        self.exclusive = bool(task.exclusive)
+        self.priority = task.priority or 0
+        for name, value in task_limits_columns(task.limits).items():
+            setattr(self, name, value)
+
+    def set_requirements(self, task):
+        Requirement.objects.bulk_create([ Requirement(task=self, tag=str(tag)) for tag in set(task.requires) ])
+
+    class Meta:
+        permissions = [('process_task', 'Can process task'), ('prioritize_task', 'Can raise task priority')]
+        indexes = [
+            models.Index(fields=['assignee', 'time_create']),
+            models.Index(fields=['assignee', '-priority', 'time_create']),
+            models.Index(fields=['assignee', 'user', '-priority', 'time_create']),
+            models.Index(fields=['time_assign', 'user']),
+            models.Index(fields=['user', 'time_assign']),
+        ]
+
+
+class Requirement(models.Model):
+    task        = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='requirements')
+    tag         = models.CharField(max_length=255, null=False, db_index=True)
+
     class Meta:
-        permissions = [('process_task', 'Can process task')]
+        unique_together = [('task', 'tag')]
 
 
 class Result(models.Model):
@@ -41,6 +112,13 @@ class Result(models.Model):
         result.load(self.description)
         return result
 
+class Callback(models.Model):
+    task        = models.ForeignKey(Task, on_delete=models.CASCADE, related_name='callbacks')
+    url         = models.CharField(max_length=1024, null=False)
+    attempts    = models.IntegerField(default=0, null=False)
+    time_create = models.DateTimeField(auto_now_add=True, null=False)
+    time_next   = models.DateTimeField(null=False, db_index=True)
+
 def task_init(instance, **kwargs):
     if not instance.key:
         instance.key = uuid.uuid4().hex
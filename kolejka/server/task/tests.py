@@ -2,5 +2,242 @@
 
 from django.conf import settings
 
-from django.test import TestCase
+import datetime
+import json
+import time
+from unittest import mock
+import uuid
 
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import django.utils.timezone
+
+from kolejka.common.task import KolejkaTask, KolejkaResult
+from kolejka.server.blob.models import Blob, Reference
+from kolejka.server.task import callback
+from kolejka.server.task import events as task_events
+from kolejka.server.task.models import Callback, Result, Task
+
+class SubmitTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client')
+        self.user.user_permissions.add(Permission.objects.get(codename='add_task', content_type__app_label='task'))
+        self.foreman = User.objects.create_user('foreman')
+        self.foreman.user_permissions.add(Permission.objects.get(codename='process_task', content_type__app_label='task'))
+
+    def references(self, user, count):
+        blobs = Blob.objects.bulk_create([ Blob(key=uuid.uuid4().hex, size=0) for i in range(count) ])
+        return Reference.objects.bulk_create([ Reference(user=user, blob=blob) for blob in blobs ])
+
+    def submit(self, count):
+        self.client.force_login(self.user)
+        t = KolejkaTask(None, image='ubuntu', args=['true'])
+        for i, reference in enumerate(self.references(self.user, count)):
+            t.files.add(f'input_{i}', { 'reference' : reference.key })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/task/task/', data=json.dumps(t.dump()), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'OK')
+        return response.json()['task'], len(queries)
+
+    def result(self, task, count):
+        Task.objects.filter(key=task['id']).update(assignee=self.foreman)
+        self.client.force_login(self.foreman)
+        r = KolejkaResult(None, id=task['id'], result=0)
+        for i, reference in enumerate(self.references(self.foreman, count)):
+            r.files.add(f'output_{i}', { 'reference' : reference.key })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/task/result/', data=json.dumps(r.dump()), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'OK')
+        return response.json()['result'], len(queries)
+
+    def test_task_queries(self):
+        task, small = self.submit(2)
+        self.assertEqual(Task.objects.get(key=task['id']).files.count(), 2)
+        self.assertEqual(len([ f for f in task['files'].values() if f.get('blob') ]), 2)
+        task, large = self.submit(50)
+        self.assertEqual(Task.objects.get(key=task['id']).files.count(), 50)
+        self.assertEqual(small, large)
+
+    def test_result_queries(self):
+        task, _ = self.submit(1)
+        result, small = self.result(task, 2)
+        task, _ = self.submit(1)
+        result, large = self.result(task, 50)
+        self.assertEqual(small, large)
+        files = Task.objects.get(key=task['id']).result.files.all()
+        self.assertEqual(len(files), 50)
+        self.assertEqual(set([ reference.user for reference in files ]), set([ self.user ]))
+
+    def test_priority(self):
+        self.client.force_login(self.user)
+        t = KolejkaTask(None, image='ubuntu', args=['true'], priority=10)
+        response = self.client.post('/task/task/', data=json.dumps(t.dump()), content_type='application/json')
+        self.assertEqual(Task.objects.get(key=response.json()['task']['id']).priority, 0)
+        self.user.user_permissions.add(Permission.objects.get(codename='prioritize_task', content_type__app_label='task'))
+        self.user = User.objects.get(pk=self.user.pk)
+        self.client.force_login(self.user)
+        response = self.client.post('/task/task/', data=json.dumps(t.dump()), content_type='application/json')
+        self.assertEqual(Task.objects.get(key=response.json()['task']['id']).priority, 10)
+
+    def test_unknown_reference(self):
+        self.client.force_login(self.user)
+        t = KolejkaTask(None, image='ubuntu', args=['true'], files={ 'input' : { 'reference' : 'missing' } })
+        response = self.client.post('/task/task/', data=json.dumps(t.dump()), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'FAIL')
+        self.assertEqual(Task.objects.count(), 0)
+
+@override_settings(EVENTS_INTERVAL=0.01, EVENTS_HEARTBEAT=0)
+class EventsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client')
+        self.other = User.objects.create_user('other')
+        self.foreman = User.objects.create_user('foreman')
+
+    def create(self, user):
+        return Task.objects.create(user=user, description=json.dumps(KolejkaTask(None, image='ubuntu', args=['true']).dump()))
+
+    def stream(self, keys, timeout=1):
+        self.client.force_login(self.user)
+        response = self.client.post('/task/events/', data=json.dumps({ 'tasks' : keys, 'timeout' : timeout }), content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = list()
+        for message in b''.join(response.streaming_content).decode('utf-8').split('\n\n'):
+            lines = dict([ line.split(': ', 1) for line in message.split('\n') if line and not line.startswith(':') ])
+            if lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def test_forbidden(self):
+        response = self.client.post('/task/events/', data='{}', content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_malformed(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/task/events/', data='{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/task/events/', data=json.dumps({ 'tasks' : [], 'timeout' : 'soon' }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_zero_timeout(self):
+        task = self.create(self.user)
+        start = time.monotonic()
+        events = self.stream([ task.key ], timeout=0)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(events, [ ('state', { 'task' : task.key, 'state' : 'queued' }), ('end', { 'pending' : [ task.key ] }) ])
+
+    def test_states(self):
+        queued = self.create(self.user)
+        finished = self.create(self.user)
+        Task.objects.filter(pk=finished.pk).update(assignee=self.foreman)
+        Result.objects.create(task=finished, user=self.foreman, description='{}')
+        hidden = self.create(self.other)
+        events = self.stream([ queued.key, finished.key, hidden.key, 'missing' ], timeout=0.05)
+        states = dict([ (data['task'], data['state']) for event, data in events if event == 'state' ])
+        self.assertEqual(states, { queued.key : 'queued', finished.key : 'finished', hidden.key : 'unknown', 'missing' : 'unknown' })
+        self.assertEqual(events[-1], ('end', { 'pending' : [ queued.key ] }))
+
+    def test_wakeup(self):
+        task = self.create(self.user)
+        steps = [
+            lambda: Task.objects.filter(pk=task.pk).update(assignee=self.foreman),
+            lambda: Result.objects.create(task=task, user=self.foreman, description='{}'),
+        ]
+        def wait(generation, timeout=None):
+            if steps:
+                steps.pop(0)()
+                return True
+            return False
+        with mock.patch.object(task_events, 'wait', side_effect=wait):
+            events = self.stream([ task.key ], timeout=60)
+        self.assertEqual([ data['state'] for event, data in events if event == 'state' ], [ 'queued', 'assigned', 'finished' ])
+        self.assertEqual(events[-1], ('end', { 'pending' : [] }))
+
+    def test_notify(self):
+        generation = task_events.generation()
+        self.assertFalse(task_events.wait(generation, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            task_events.notify()
+            self.assertFalse(task_events.wait(generation, 0))
+        self.assertTrue(task_events.wait(generation, 0))
+
+@override_settings(CALLBACK_WORKERS=1)
+class CallbackTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client')
+        self.urlopen = mock.patch('urllib.request.urlopen')
+        self.mock = self.urlopen.start()
+
+    def tearDown(self):
+        self.urlopen.stop()
+
+    def resolve(self, url='http://localhost/callback'):
+        task = Task(user=self.user)
+        task.set_task(KolejkaTask(None, id=task.key, image='ubuntu', args=['true'], callback_url=url))
+        task.save()
+        result = Result.objects.create(task=task, user=self.user, description=json.dumps(KolejkaResult(None, id=task.key, result=0).dump()))
+        callback.schedule(result)
+        return task
+
+    def posted(self, call):
+        request = call.args[0]
+        return request.full_url, json.loads(request.data)
+
+    def test_result_view(self):
+        foreman = User.objects.create_user('foreman')
+        foreman.user_permissions.add(Permission.objects.get(codename='process_task', content_type__app_label='task'))
+        task = Task(user=self.user, assignee=foreman)
+        task.set_task(KolejkaTask(None, id=task.key, image='ubuntu', args=['true'], callback_url='http://localhost/callback'))
+        task.save()
+        self.client.force_login(foreman)
+        response = self.client.post('/task/result/', data=json.dumps(KolejkaResult(None, id=task.key, result=0).dump()), content_type='application/json')
+        self.assertEqual(response.json()['status'], 'OK')
+        self.assertEqual(Callback.objects.filter(task=task).count(), 1)
+        self.mock.assert_not_called()
+
+    def test_disallowed(self):
+        self.resolve(url='http://example.com/callback')
+        self.assertEqual(Callback.objects.count(), 0)
+
+    def test_deliver(self):
+        task = self.resolve()
+        self.assertEqual(callback.deliver_pending(), 1)
+        self.assertEqual(self.mock.call_count, 1)
+        self.assertEqual(self.mock.call_args.kwargs['timeout'], settings.CALLBACK_TIMEOUT)
+        url, data = self.posted(self.mock.call_args)
+        self.assertEqual(url, 'http://localhost/callback')
+        self.assertEqual(data['task']['id'], task.key)
+        self.assertEqual(data['result']['result'], 0)
+        self.assertEqual(Callback.objects.count(), 0)
+        self.assertEqual(callback.deliver_pending(), 0)
+
+    @override_settings(CALLBACK_RETRIES=2)
+    def test_retry(self):
+        self.mock.side_effect = OSError('refused')
+        self.resolve()
+        self.assertEqual(callback.deliver_pending(), 0)
+        pending = Callback.objects.get()
+        self.assertEqual(pending.attempts, 1)
+        self.assertGreater(pending.time_next, django.utils.timezone.now() + settings.CALLBACK_RETRY_DELAY - datetime.timedelta(seconds=1))
+        self.assertEqual(callback.deliver_pending(), 0)
+        self.assertEqual(self.mock.call_count, 1)
+        Callback.objects.update(time_next=django.utils.timezone.now())
+        callback.deliver_pending()
+        self.assertEqual(self.mock.call_count, 2)
+        self.assertEqual(Callback.objects.count(), 0)
+
+    def test_backoff(self):
+        self.assertEqual(callback.backoff(1), settings.CALLBACK_RETRY_DELAY)
+        self.assertEqual(callback.backoff(3), 4*settings.CALLBACK_RETRY_DELAY)
+        self.assertEqual(callback.backoff(100), settings.CALLBACK_RETRY_MAX_DELAY)
+
+    @override_settings(CALLBACK_BATCH_SIZE=10)
+    def test_batch(self):
+        tasks = [ self.resolve() for i in range(3) ]
+        self.resolve(url='http://127.0.0.1/other')
+        self.assertEqual(callback.deliver_pending(), 4)
+        self.assertEqual(self.mock.call_count, 2)
+        posted = dict([ self.posted(call) for call in self.mock.call_args_list ])
+        self.assertEqual(sorted([ r['task']['id'] for r in posted['http://localhost/callback']['results'] ]), sorted([ t.key for t in tasks ]))
+        self.assertIn('task', posted['http://127.0.0.1/other'])
@@ -12,4 +12,5 @@ urlpatterns = [
     path('task/<key>/', views.task),
     path('result/', views.result),
     path('result/<key>/', views.result),
+    path('events/', views.events),
 ]
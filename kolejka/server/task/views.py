@@ -6,21 +6,29 @@ import json
 import logging
 import re
 import subprocess
-import threading
-import urllib.parse
-import urllib.request
+import time
 import uuid
 
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotAllowed, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotAllowed, StreamingHttpResponse
+import django.utils.timezone
 from django.views.decorators.csrf import csrf_exempt
 
 from kolejka.common.limits import KolejkaLimits
 from kolejka.common.task import KolejkaTask, KolejkaResult
 from kolejka.server.blob.models import Reference
+from kolejka.server.queue.notify import notify as queue_notify
 from kolejka.server.response import OKResponse, FAILResponse
 
+from . import callback
+from . import events as task_events
 from . import models
 
+def file_references(files):
+    keys = set([ f.reference for f in files.values() ])
+    return dict([ (ref.key, ref) for ref in Reference.objects.filter(key__in=keys).select_related('blob') ])
+
 def task(request, key=''):
     if request.method == 'POST':
         if key != '':
@@ -44,20 +52,23 @@ def task(request, key=''):
                 local_image = True
                 break
         t.id = uuid.uuid4().hex
+        if t.priority is not None and t.priority > 0 and not request.user.has_perm('task.prioritize_task'):
+            t.priority = 0
         for k,f in t.files.items():
             if not f.reference:
                 return FAILResponse(message=f'File {k} does not have a reference')
             f.path = None
-        refs = list()
+        refs = dict()
+        known = file_references(t.files)
         for k,f in t.files.items():
-            try:
-                ref = Reference.objects.get(key = f.reference)
-            except Reference.DoesNotExist:
+            ref = known.get(f.reference)
+            if ref is None:
                 return FAILResponse(message=f'Reference for file {k} is unknown')
             if not ref.public:
-                if not request.user.has_perm('blob.view_reference') and request.user != ref.user:
+                if not request.user.has_perm('blob.view_reference') and request.user.pk != ref.user_id:
                     return FAILResponse(message=f'Reference for file {k} is unknown')
-            refs.append(ref)
+            f.blob = ref.blob.key
+            refs[ref.pk] = ref
         limits = KolejkaLimits(
                 cpus=settings.LIMIT_CPUS,
                 memory=settings.LIMIT_MEMORY,
@@ -66,6 +77,7 @@ def task(request, key=''):
                 storage=settings.LIMIT_STORAGE,
                 network=settings.LIMIT_NETWORK,
                 time=settings.LIMIT_TIME,
+                cpu_time=settings.LIMIT_CPU_TIME,
                 image=settings.LIMIT_IMAGE,
                 workspace=settings.LIMIT_WORKSPACE,
                 gpus=settings.LIMIT_GPUS,
@@ -100,10 +112,13 @@ def task(request, key=''):
             t.image = image_name
             t.limits.image = image_size
 
-        task = models.Task(user=request.user, key=t.id, description=json.dumps(t.dump()))
-        task.save()
-        for ref in refs:
-            task.files.add(ref)
+        with transaction.atomic():
+            task = models.Task(user=request.user, key=t.id)
+            task.set_task(t)
+            task.save()
+            task.set_requirements(t)
+            task.files.add(*refs.values())
+            transaction.on_commit(queue_notify)
         response = dict()
         response['task'] = task.task().dump()
         return OKResponse(response)
@@ -130,33 +145,6 @@ def task(request, key=''):
         return OKResponse(response)
     return HttpResponseNotAllowed(['HEAD', 'GET', 'POST', 'PUT', 'DELETE'])
 
-def result_callback(result):
-    url = result.task.task().callback_url
-    if url:
-        try:
-            parsed_url = urllib.parse.urlparse(url)
-            if parsed_url.scheme not in [ 'http', 'https' ] or parsed_url.hostname not in settings.ALLOWED_CALLBACK_HOSTS:
-                logging.warning(f'Callback \'{url}\' is not allowed')
-                return
-        except:
-            logging.warning(f'Callback \'{url}\' is malformed')
-            return
-        headers = dict()
-        headers['User-Agent'] = settings.CALLBACK_USER_AGENT
-        headers['Content-Type'] = 'application/json'
-        response = dict()
-        response['task'] = result.task.task().dump()
-        response['result'] = result.result().dump()
-        data = bytes(json.dumps(response), 'utf-8')
-        request = urllib.request.Request(url=url, data=data, headers=headers, method='POST')
-        def opener(request):
-            try:
-                response = urllib.request.urlopen(request)
-            except:
-                logging.warning(f'Callback \'{url}\' failed')
-                pass
-        threading.Thread(target=opener, args=[request]).run()
-
 def result(request, key=''):
     if request.method == 'POST':
         if key != '':
@@ -175,25 +163,27 @@ def result(request, key=''):
             if not f.reference:
                 return FAILResponse(message=f'File {k} does not have a reference')
             f.path = None
-        refs = list()
+        refs = dict()
+        known = file_references(r.files)
         for k,f in r.files.items():
-            try:
-                ref = Reference.objects.get(key = f.reference)
-            except Reference.DoesNotExist:
+            ref = known.get(f.reference)
+            if ref is None:
                 return FAILResponse(message=f'Reference for file {k} is unknown')
             if not ref.public:
-                if request.user != ref.user:
+                if request.user.pk != ref.user_id:
                     return FAILResponse(message=f'Reference for file {k} belongs to a different user')
-            refs.append(ref)
-        result,created = models.Result.objects.get_or_create(task=task, user=request.user, description=json.dumps(r.dump()))
-        result.save()
-        for ref in refs:
-            ref.user = task.user
-            ref.save()
-            result.files.add(ref)
+            f.blob = ref.blob.key
+            refs[ref.pk] = ref
+        with transaction.atomic():
+            result,created = models.Result.objects.get_or_create(task=task, user=request.user, description=json.dumps(r.dump()))
+            result.save()
+            Reference.objects.filter(pk__in=list(refs.keys())).update(user=task.user, time_access=django.utils.timezone.now())
+            result.files.add(*refs.values())
+            callback.schedule(result)
+            transaction.on_commit(callback.notify)
+            transaction.on_commit(task_events.notify)
         response = dict()
         response['result'] = result.result().dump()
-        result_callback(result)
         return OKResponse(response)
     if not request.user.is_authenticated:
         return HttpResponseForbidden()
@@ -220,3 +210,67 @@ def result(request, key=''):
         response['result'] = result.result().dump()
         return OKResponse(response)
     return HttpResponseNotAllowed(['HEAD', 'GET', 'POST', 'PUT', 'DELETE'])
+
+def task_states(keys, user=None):
+    states = dict()
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        tasks = models.Task.objects.filter(key__in=keys[start:start+500])
+        if user is not None:
+            tasks = tasks.filter(Q(user=user) | Q(assignee=user))
+        for key, assignee, result in tasks.values_list('key', 'assignee_id', 'result'):
+            if result is not None:
+                states[key] = 'finished'
+            elif assignee is not None:
+                states[key] = 'assigned'
+            else:
+                states[key] = 'queued'
+    return states
+
+def event_message(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def events(request):
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        params = json.loads(str(request.read(), 'utf-8') or '{}')
+        keys = set([ str(key) for key in params.get('tasks', list()) ])
+        timeout = params.get('timeout')
+        timeout = min(max(float(settings.EVENTS_TIMEOUT if timeout is None else timeout), 0), settings.EVENTS_TIMEOUT)
+    except (ValueError, TypeError, AttributeError):
+        return HttpResponseBadRequest()
+    user = None
+    if not request.user.has_perm('task.view_task'):
+        user = request.user
+    def stream():
+        deadline = time.monotonic() + timeout
+        heartbeat = time.monotonic() + settings.EVENTS_HEARTBEAT
+        states = dict()
+        pending = set(keys)
+        while True:
+            generation = task_events.generation()
+            current = task_states(pending, user)
+            for key in sorted(pending):
+                state = current.get(key, 'deleted' if key in states else 'unknown')
+                if states.get(key) != state:
+                    states[key] = state
+                    yield event_message('state', { 'task' : key, 'state' : state })
+            pending = set([ key for key in pending if states[key] in [ 'queued', 'assigned' ] ])
+            remaining = deadline - time.monotonic()
+            if len(pending) == 0 or remaining <= 0:
+                yield event_message('end', { 'pending' : sorted(pending) })
+                return
+            query = min(deadline, time.monotonic() + settings.EVENTS_INTERVAL)
+            while not task_events.wait(generation, max(0, min(query, heartbeat) - time.monotonic())):
+                if time.monotonic() >= heartbeat:
+                    heartbeat = time.monotonic() + settings.EVENTS_HEARTBEAT
+                    yield ': keepalive\n\n'
+                if time.monotonic() >= query:
+                    break
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
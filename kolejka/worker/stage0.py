@@ -21,6 +21,7 @@ from kolejka.common import kolejka_config, worker_config
 from kolejka.common import KolejkaTask, KolejkaResult, KolejkaLimits
 from kolejka.common import ControlGroupSystem
 from kolejka.common import MemoryAction, TimeAction, BigIntAction
+from kolejka.common.bundle import bundle_extract
 from kolejka.common.gpu import gpu_stats, limited_gpuset
 from kolejka.worker.volume import check_python_volume
 
@@ -58,6 +59,7 @@ def stage0(task_path, result_path, temp_path=None, consume_task_folder=False):
     limits.image = config.image
     limits.workspace = config.workspace
     limits.time = config.time
+    limits.cpu_time = config.cpu_time
     limits.network = config.network
     limits.gpus = config.gpus
     limits.perf_instructions = config.perf_instructions
@@ -97,8 +99,15 @@ def stage0(task_path, result_path, temp_path=None, consume_task_folder=False):
         else:
             logging.warning('Observer is not running.')
         volumes.append((jailed_result_path, os.path.join(settings.WORKER_DIRECTORY, 'result'), 'rw'))
+        if task.bundle is not None:
+            bundle_path = os.path.join(task.path, task.files.files[task.bundle].path)
+            for key in bundle_extract(bundle_path, jailed.path):
+                jailed.files.add(key)
+            if consume_task_folder:
+                os.unlink(bundle_path)
+            jailed.bundle = None
         for key, val in task.files.items():
-            if key != settings.TASK_SPEC:
+            if key != settings.TASK_SPEC and key != task.bundle:
                 src_path = os.path.join(task.path, val.path)
                 dst_path = os.path.join(jailed_path, 'task', key)
                 os.makedirs(os.path.dirname(dst_path), exist_ok=True)
@@ -220,6 +229,7 @@ def stage0(task_path, result_path, temp_path=None, consume_task_folder=False):
             pass
         time.sleep(0.1)
 
+        stats_reader = None
         while True:
             try:
                 docker_state_run = subprocess.run(['docker', 'inspect', '--format', '{{json .State}}', cid], stdout=subprocess.PIPE)
@@ -227,7 +237,11 @@ def stage0(task_path, result_path, temp_path=None, consume_task_folder=False):
             except:
                 break
             try:
-                result.stats.update(cgs.name_stats(cid))
+                if stats_reader is None or not stats_reader.fds:
+                    if stats_reader is not None:
+                        stats_reader.close()
+                    stats_reader = cgs.name_reader(cid)
+                result.stats.update(stats_reader.stats())
 
                 if task.limits.gpus is not None and task.limits.gpus > 0:
                     result.stats.update(
@@ -247,6 +261,8 @@ def stage0(task_path, result_path, temp_path=None, consume_task_folder=False):
                 break
             if task.limits.time is not None and datetime.datetime.now() - start_time > task.limits.time + datetime.timedelta(seconds=2):
                 docker_kill_run = subprocess.run([ 'docker', 'kill', docker_task ])
+        if stats_reader is not None:
+            stats_reader.close()
         subprocess.run(['docker', 'logs', cid], stdout=subprocess.PIPE)
         try:
             summary = KolejkaResult(jailed_result_path)
@@ -296,6 +312,7 @@ def config_parser(parser):
     parser.add_argument('--image', action=MemoryAction, help='image size limit')
     parser.add_argument('--workspace', action=MemoryAction, help='workspace size limit')
     parser.add_argument('--time', action=TimeAction, help='time limit')
+    parser.add_argument('--cpu-time', action=TimeAction, help='cpu time limit')
     parser.add_argument('--network', type=bool, help='allow netowrking')
     parser.add_argument('--gpus', type=int, help='gpus limit')
     parser.add_argument('--perf-instructions', type=BigIntAction, help='CPU instructions limit')
@@ -129,7 +129,7 @@ class HTTPUnixConnection(http.client.HTTPConnection):
         if self._tunnel_host:
             self._tunnel()
 
-def observer_start(cpus, cpus_offset, memory, swap, pids, time, perf_instructions, perf_cycles, cgroup_depth, cgroup_descendants):
+def observer_start(cpus, cpus_offset, memory, swap, pids, time, cpu_time, perf_instructions, perf_cycles, cgroup_depth, cgroup_descendants):
     if not os.path.exists(OBSERVER_SOCKET):
         logging.error('Limits enabled with no kolejka-observer socket present')
         sys.exit(0)
@@ -142,7 +142,7 @@ def observer_start(cpus, cpus_offset, memory, swap, pids, time, perf_instruction
         response_body = json.loads(response.read().decode('utf-8'))
     session_id = response_body['session_id']
     secret = response_body['secret']
-    if cpus is not None or memory is not None or swap is not None or pids is not None or perf_instructions is not None or perf_cycles is not None or cgroup_depth is not None or cgroup_descendants is not None:
+    if cpus is not None or memory is not None or swap is not None or pids is not None or cpu_time is not None or perf_instructions is not None or perf_cycles is not None or cgroup_depth is not None or cgroup_descendants is not None:
         limits = dict()
         if cpus is not None:
             limits['cpus'] = int(cpus)
@@ -156,6 +156,8 @@ def observer_start(cpus, cpus_offset, memory, swap, pids, time, perf_instruction
             limits['pids'] = int(pids)
         if time is not None:
             limits['time'] = float(time.total_seconds()) 
+        if cpu_time is not None:
+            limits['cpu_time'] = float(cpu_time.total_seconds())
         if perf_instructions is not None:
             limits['perf_instructions'] = int(perf_instructions)
         if perf_cycles is not None:
@@ -198,7 +200,7 @@ def observer_stop(session_id, secret):
     conn.close()
     return response_body
 
-def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=None, swap=None, pids=None, time=None, perf_instructions=None, perf_cycles=None, cgroup_depth=None, cgroup_descendants=None):
+def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=None, swap=None, pids=None, time=None, cpu_time=None, perf_instructions=None, perf_cycles=None, cgroup_depth=None, cgroup_descendants=None):
     if not os.path.isdir(task_path):
         logging.error('Provided task path is not a directory')
         sys.exit(1)
@@ -242,6 +244,7 @@ def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=
     task_swap = parse_memory(task.get('limits', dict()).get('swap', None))
     task_pids = parse_int(task.get('limits', dict()).get('pids', None))
     task_time = parse_time(task.get('limits', dict()).get('time', None))
+    task_cpu_time = parse_time(task.get('limits', dict()).get('cpu_time', None))
     task_perf_instructions = parse_bigint(task.get('limits', dict()).get('perf_instructions', None))
     task_perf_cycles = parse_bigint(task.get('limits', dict()).get('perf_cycles', None))
     task_cgroup_depth = parse_int(task.get('limits', dict()).get('cgroup_depth', None))
@@ -260,6 +263,8 @@ def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=
         pids = task_pids
     if task_time is not None and (time is None or task_time.total_seconds() < time.total_seconds()):
         time = task_time
+    if task_cpu_time is not None and (cpu_time is None or task_cpu_time.total_seconds() < cpu_time.total_seconds()):
+        cpu_time = task_cpu_time
     if task_perf_instructions is not None and (perf_instructions is None or task_perf_instructions < perf_instructions):
         perf_instructions = task_perf_instructions
     if task_perf_cycles is not None and (perf_cycles is None or task_perf_cycles < perf_cycles):
@@ -288,6 +293,8 @@ def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=
         summary['limits']['pids'] = pids
     if time is not None:
         summary['limits']['time'] = time.total_seconds()
+    if cpu_time is not None:
+        summary['limits']['cpu_time'] = cpu_time.total_seconds()
     if perf_instructions is not None:
         summary['limits']['perf_instructions'] = perf_instructions
     if perf_cycles is not None:
@@ -299,10 +306,10 @@ def stage2(task_path, result_path, consume, cpus=None, cpus_offset=None, memory=
 
     observer = None
     if os.path.exists(OBSERVER_SOCKET):
-        observer = observer_start(cpus, cpus_offset, memory, swap, pids, time, perf_instructions, perf_cycles, cgroup_depth, cgroup_descendants)
+        observer = observer_start(cpus, cpus_offset, memory, swap, pids, time, cpu_time, perf_instructions, perf_cycles, cgroup_depth, cgroup_descendants)
         logging.info('Using Kolejka Observer to limit task and collect stats.')
     else:
-        if cpus is not None or memory is not None or swap is not None or pids is not None or time is not None or perf_instructions is not None or perf_cycles is not None or cgroup_depth is not None or cgroup_descendants is not None:
+        if cpus is not None or memory is not None or swap is not None or pids is not None or time is not None or cpu_time is not None or perf_instructions is not None or perf_cycles is not None or cgroup_depth is not None or cgroup_descendants is not None:
             logging.error('Can\'t limit task without Kolejka Observer running.')
             sys.exit(1)
 
@@ -434,12 +441,13 @@ def config_parser(parser):
     parser.add_argument('--swap', action=MemoryAction, help='swap limit')
     parser.add_argument('--pids', type=int, help='pids limit')
     parser.add_argument('--time', action=TimeAction, help='time limit')
+    parser.add_argument('--cpu-time', action=TimeAction, help='cpu time limit')
     parser.add_argument('--perf-instructions', type=BigIntAction, help='CPU instructions limit')
     parser.add_argument('--perf-cycles', type=BigIntAction, help='CPU cycles limit')
     parser.add_argument('--cgroup-depth', type=int, help='Cgroup depth limit')
     parser.add_argument('--cgroup-descendants', type=int, help='Cgroup descendants limit')
     def execute(args):
-        stage2(args.task, args.result, args.consume, cpus=args.cpus, cpus_offset=args.cpus_offset, memory=args.memory, swap=args.swap, pids=args.pids, time=args.time, perf_instructions=args.perf_instructions, perf_cycles=args.perf_cycles, cgroup_depth=args.cgroup_depth, cgroup_descendants=args.cgroup_descendants)
+        stage2(args.task, args.result, args.consume, cpus=args.cpus, cpus_offset=args.cpus_offset, memory=args.memory, swap=args.swap, pids=args.pids, time=args.time, cpu_time=args.cpu_time, perf_instructions=args.perf_instructions, perf_cycles=args.perf_cycles, cgroup_depth=args.cgroup_depth, cgroup_descendants=args.cgroup_descendants)
     parser.set_defaults(execute=execute)
 
 def main():
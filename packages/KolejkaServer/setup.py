@@ -14,6 +14,9 @@ kolejka_server = {
             'setproctitle',
             'KolejkaCommon',
         ],
+        'extras_require' : {
+            's3' : [ 'boto3' ],
+        },
         'entry_points' : {
             'console_scripts' : [
                 'kolejka-server = kolejka.server:main',